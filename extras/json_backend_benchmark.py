@@ -0,0 +1,100 @@
+"""Times a detail and a list run with every installed json backend.
+
+Each run reads the model and input file, runs the model and writes the result,
+like the cli does.
+
+    python3 extras/json_backend_benchmark.py -rows 100000
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+from settipy import settipy
+
+from semantic_model import run_detail_json, run_list_json
+from sm_json import JSON_BACKENDS
+
+
+DSM_MODEL = {
+    "type": "dict",
+    "nested": {
+        "name": {"type": "string", "source": {"type": "get_from_source", "source": "input", "dn": "meta.name"}},
+        "events": {
+            "type": "list",
+            "source": {"type": "dn_lookup_loop", "source": "input", "dn": "events"},
+            "nested": {
+                "id": {"type": "string", "source": {"type": "json_key_item", "dn": "id"}},
+                "timestamp": {"type": "integer", "source": {"type": "json_key_item", "dn": "ts"}},
+                "host": {"type": "string", "source": {"type": "get_from_source", "dn": "source.host"}},
+                "score": {"type": "float", "source": {"type": "json_key_item", "dn": "score"}},
+            }
+        },
+    }
+}
+
+
+def create_input(rows):
+    return {
+        "meta": {"name": "export"},
+        "events": [
+            {
+                "id": f"event-{i}",
+                "ts": 1585234800000 + i,
+                "score": random.random(),
+                "source": {"host": f"host-{i % 100}.example.com", "port": 443},
+                "tags": ["a", "b", "c"],
+                "message": "x" * random.randint(20, 200),
+            }
+            for i in range(rows)
+        ],
+    }
+
+
+def run(action, backend, model_path, input_path, output_path):
+    if action == "detail":
+        result = run_detail_json(model_path, json_backend=backend.name, input=input_path)
+    else:
+        result = list(run_list_json(model_path, json_backend=backend.name, input=input_path))
+    with open(output_path, "w") as f:
+        f.write(backend.dumps(result))
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(rows, repeat):
+    with tempfile.TemporaryDirectory() as directory:
+        model_path = os.path.join(directory, "sm_model.json")
+        input_path = os.path.join(directory, "input.json")
+        output_path = os.path.join(directory, "output.json")
+        with open(model_path, "w") as f:
+            f.write(JSON_BACKENDS["json"].dumps(DSM_MODEL))
+        with open(input_path, "w") as f:
+            f.write(JSON_BACKENDS["json"].dumps(create_input(rows)))
+
+        print(f"{rows} rows, {os.path.getsize(input_path) / 1e6:.1f} MB input, best of {repeat}")
+        for action in ["detail", "list"]:
+            baseline = None
+            for name, backend in JSON_BACKENDS.items():
+                parse = best_time(lambda: backend.load(open(input_path, "rb")), repeat)
+                total = best_time(lambda: run(action, backend, model_path, input_path, output_path), repeat)
+                if baseline is None:
+                    baseline = total
+                print(f"{action:<8}{name:<10}parse {parse:.3f}s  total {total:.3f}s  {baseline / total:.2f}x")
+
+
+if __name__ == "__main__":
+    settipy.set_int("rows", 50000, "number of events in the input")
+    settipy.set_int("repeat", 3, "runs per backend, the fastest is shown")
+    settipy.parse()
+    main(settipy.get("rows"), settipy.get("repeat"))
@@ -1,8 +1,8 @@
-import re
 import sys
-import json
 
 from data import regexes, descriptions
+from sm_json import get_json_backend, get_output_backend
+from sm_regex import RegexSet
 
 # I like vanilla python, for some reason parser like the request liberary could be installed already.
 # If it's not installed we will just skip it.
@@ -42,17 +42,45 @@ DATA = {
 
 CONFIG = {}
 
+# the regexes of DATA["regex"] joined into one pattern, with the dict and the number of regexes it was made from
+REGEX_SET = {"regex": None, "regexes": None, "size": 0}
+
+
+def set_regexes(regexes):
+    DATA["regex"] = regexes
+    REGEX_SET["regex"] = None
+
+
+def get_regex_set():
+    """The RegexSet of DATA["regex"], made again when DATA["regex"] is replaced or regexes are added or removed.
+
+    A regex that is changed in place is seen after set_regexes.
+    """
+    regexes = DATA["regex"]
+    if REGEX_SET["regex"] is None or REGEX_SET["regexes"] is not regexes or REGEX_SET["size"] != len(regexes):
+        REGEX_SET.update(regex=RegexSet(regexes), regexes=regexes, size=len(regexes))
+    return REGEX_SET["regex"]
+
+
+def is_timestamp(item):
+    try:
+        return bool(type(item) == str and not item.isdigit() and parser.parse(item))
+    except Exception:
+        return False
+
 
 def identify(item):
-    for name, regex in DATA["regex"].items():
-        if re.match(regex, item):
-            return name
-        try:
-            if type(item) == str and not item.isdigit() and parser.parse(item):
-                return "timestamp"
-        except Exception:
-            pass
-    return ""
+    regex_set = get_regex_set()
+    if not regex_set.names:
+        return ""
+
+    # the first regex goes before timestamps, the others after
+    name = regex_set.match(item)
+    if name is not None and name == regex_set.names[0]:
+        return name
+    if is_timestamp(item):
+        return "timestamp"
+    return "" if name is None else name
 
 
 def str_type(item):
@@ -180,11 +208,12 @@ def one_to_one_looper(data, title=None, dn="", has_context_data=False):
     return result
 
 
-def run_one_to_one(sm_model_path, input_file):
-    return one_to_one_looper(json.load(open(input_file)))
+def run_one_to_one(sm_model_path, input_file, json_backend=None):
+    with open(input_file, "rb") as f:
+        return one_to_one_looper(get_json_backend(json_backend).load(f))
 
 
 if __name__ == "__main__":
-    result = one_to_one_looper(json.load(sys.stdin))
+    result = one_to_one_looper(get_json_backend().load(sys.stdin))
 
-    print(json.dumps(result, indent=2))
+    print(get_output_backend().dumps(result, indent=2))
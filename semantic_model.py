@@ -1,17 +1,26 @@
+import os
 import re
-import json
+import sys
 import uuid
+import hashlib
 import datetime
+import functools
+import operator
+import itertools
+import queue
+import threading
+import collections
+import multiprocessing
 
 from settipy import settipy
 
-
-DEBUG_MODE = False
+from sm_json import JsonStream, JsonDocument, JsonWriter, iter_json_lines_file, write_json_lines, get_json_backend, get_output_backend, set_json_backend, JSON_BACKENDS
+from sm_columns import encode_column, numpy, numpy_int_to_iso_timestamp, CATEGORICAL_RATIO
+from sm_regex import RegexSet, compile_regex
+from sm_join import KeyJoin, SpilledKeyJoin, RowView, BLOCK_SIZE, JOIN_PARTITIONS, pivot, pivot_sorted, PIVOT_MAX_IDS, PIVOT_PARTITIONS
 
 
-STORAGE = {
-    "input": {}, "context_data": {},
-}
+DEBUG_MODE = False
 
 
 ITEMS = {
@@ -52,16 +61,90 @@ KEY_RBAC = "rbac"
 KEY_GATHER = "source"
 
 KEY_STORAGE_LIST_ITEM = "__global_list_item"
-STORAGE[KEY_STORAGE_LIST_ITEM] = {}
+# inputs that are read as a stream, loaded once per run by the sources that need the whole document
+KEY_STORAGE_LOADED = "__loaded_input"
+
+
+def load_json_file(path, json_backend=None):
+    backend = get_json_backend(json_backend)
+    if path == "-":
+        return backend.load(sys.stdin)
+    with open(path, "rb") as f:
+        return backend.load(f)
+
+
+# models loaded by run_with_json per (path, mtime, size), the same file gives the same model object.
+MODEL_CACHE = collections.OrderedDict()
+MODEL_CACHE_SIZE = 32
+MODEL_CACHE_LOCK = threading.Lock()
+
+
+def load_model_file(path, json_backend=None):
+    """Loads the sm model at path, it is kept in a LRU cache until the file changes.
+
+    As the same model object is returned, its plan also comes from the plan cache.
+    The returned model should not be changed in place.
+    """
+    if path == "-":
+        return load_json_file(path, json_backend)
+
+    stat = os.stat(path)
+    path = os.path.abspath(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with MODEL_CACHE_LOCK:
+        model = MODEL_CACHE.get(key)
+        if model is not None:
+            MODEL_CACHE.move_to_end(key)
+            return model
+
+    model = load_json_file(path, json_backend)
+    with MODEL_CACHE_LOCK:
+        # older versions of the file are not used again
+        for old_key in [k for k in MODEL_CACHE if k[0] == path]:
+            del MODEL_CACHE[old_key]
+        MODEL_CACHE[key] = model
+        while len(MODEL_CACHE) > MODEL_CACHE_SIZE:
+            MODEL_CACHE.popitem(last=False)
+    return model
 
 
-def prepare_model_for_run(model, roles=None):
-    pass
+def clear_model_cache():
+    with MODEL_CACHE_LOCK:
+        MODEL_CACHE.clear()
+
+
+# how the input files are read, with stream the loop sources read their items one at a time,
+# with mmap the file is memory-mapped and only the values the sources reach are decoded.
+INPUT_FORMAT = {
+    "json": load_json_file,
+    "stream": JsonStream,
+    "mmap": JsonDocument,
+}
+
+# inputs that are read by get_by_dn and yield_by_dn without loading the whole file
+LAZY_INPUT = (JsonStream, JsonDocument)
+
+
+# input formats with a document per line, the model runs on every document.
+INPUT_FORMAT_LINES = {
+    "ndjson": iter_json_lines_file,
+}
+
+
+def load_json_input(input_format, json_backend=None, **input_path):
+    try:
+        load_input = INPUT_FORMAT[input_format]
+    except KeyError:
+        raise ValueError(f"Input format not part of {INPUT_FORMAT.keys() | INPUT_FORMAT_LINES.keys()}")
+    return {k: load_input(v, json_backend=json_backend) for k, v in input_path.items()}
 
 
-def run_with_json(action, model_path, roles=None, **input_path):
-    dsm_model = json.load(open(model_path))
-    input_data = {k: json.load(open(v)) for k, v in input_path.items()}
+def run_with_json(action, model_path, roles=None, input_format="json", json_backend=None, **input_path):
+    dsm_model = load_model_file(model_path, json_backend)
+    if input_format in INPUT_FORMAT_LINES:
+        return run_with_json_lines(action, dsm_model, roles=roles, input_format=input_format, json_backend=json_backend, **input_path)
+
+    input_data = load_json_input(input_format, json_backend=json_backend, **input_path)
 
     try:
         func = ACTIONS[action]
@@ -71,32 +154,71 @@ def run_with_json(action, model_path, roles=None, **input_path):
     return func(dsm_model, roles=roles, **input_data)
 
 
-def run_detail_json(model_path, roles=None, **input_path):
-    return run_with_json("detail", model_path, roles=None, **input_path)
+def run_with_json_lines(action, dsm_model, roles=None, input_format="ndjson", json_backend=None, **input_path):
+    """Runs the model on every line of the input file, the other input files are json.
+
+    Yields a result per line for detail, and the items of all lines for list and node.
+    """
+    documents = INPUT_FORMAT_LINES[input_format](input_path.pop("input"), json_backend=json_backend)
+    input_data = load_json_input("json", json_backend=json_backend, **input_path)
+
+    try:
+        func = ACTIONS_MANY[action]
+    except KeyError:
+        raise ValueError(f"Action not part of {ACTIONS_MANY.keys()}")
+
+    results = func(dsm_model, documents, roles=roles, **input_data)
+    if action == "detail":
+        return results
+    return itertools.chain.from_iterable(results)
+
+
+def run_detail_json(model_path, roles=None, input_format="json", json_backend=None, **input_path):
+    return run_with_json("detail", model_path, roles=None, input_format=input_format, json_backend=json_backend, **input_path)
+
 
+def run_detail_json_to(model_path, fp, roles=None, indent=None, input_format="json", json_backend=None, **input_path):
+    dsm_model = load_model_file(model_path, json_backend)
+    input_data = load_json_input(input_format, json_backend=json_backend, **input_path)
+    return run_detail_to(dsm_model, fp, roles=roles, indent=indent, json_backend=json_backend, **input_data)
 
-def run_list_json(model_path, roles=None, **input_path):
-    return run_with_json("list", model_path, roles=None, **input_path)
 
+def run_list_json(model_path, roles=None, input_format="json", json_backend=None, **input_path):
+    return run_with_json("list", model_path, roles=None, input_format=input_format, json_backend=json_backend, **input_path)
 
-def run_node_json(model_path, roles=None, **input_path):
-    return run_with_json("node", model_path, roles=None, **input_path)
+
+def run_node_json(model_path, roles=None, input_format="json", json_backend=None, **input_path):
+    return run_with_json("node", model_path, roles=None, input_format=input_format, json_backend=json_backend, **input_path)
 
 
 def run_detail(model, roles=None, **input_data):
-    # setup connection to database
-    # setup api credential
-    for k, v in input_data.items():
-        STORAGE["input"][k] = v
+    return Runner(model, roles=roles).detail(**input_data)
+
+
+def run_columns(model, roles=None, categorical_ratio=CATEGORICAL_RATIO, use_numpy=False, **input_data):
+    """Detail result where lists with nested items are a dict of columns, see sm_columns.encode_column."""
+    encode = functools.partial(encode_column, categorical_ratio=categorical_ratio, use_numpy=use_numpy)
+    return Runner(model, roles=roles).columns(encode=encode, **input_data)
+
 
-    return full_detail(model, roles=roles, storage=STORAGE)
+def run_detail_to(model, fp, roles=None, indent=None, json_backend=None, **input_data):
+    """Writes the detail result as json to fp while it is produced, formatted like the dumps of the json backend."""
+    Runner(model, roles=roles).write_detail(JsonWriter(fp, indent=indent, json_backend=json_backend), **input_data)
 
 
-def get_data(gather_args, model, dn_parent, storage):
+def get_data(gather_args, model, dn_parent, storage, stream=False):
     if KEY_GATHER not in gather_args:
         data = storage["context_data"]
     else:
-        data = storage["input"][gather_args[KEY_GATHER]]
+        name = gather_args[KEY_GATHER]
+        data = storage["input"][name]
+        # sources that can't read a stream get the whole document, it is loaded once per run.
+        # a JsonDocument is read like a dict and decodes only the keys that are used
+        if not stream and type(data) is JsonStream:
+            loaded = storage.setdefault(KEY_STORAGE_LOADED, {})
+            if name not in loaded:
+                loaded[name] = data.load()
+            data = loaded[name]
     return data
 
 
@@ -113,26 +235,35 @@ def json_key(gather_args, model, dn_parent, storage):
 
 def json_key_item(gather_args, model, dn_parent, storage):
     data = get_data(gather_args, model, dn_parent, storage)
+    dn = gather_args["dn"]
     try:
-        return data[gather_args["dn"]]
+        return data[dn]
     except KeyError:
         if "default" in gather_args:
             return gather_args.get("default")
         raise InvalidModel(f"Missing data and default for source {model['source']['type']} with dn {dn_parent}")
+    except TypeError:
+        if type(dn) is not DnPath:
+            raise
+    # data that can't be read by key, like a list, raises the error of the dn as it is in the model
+    return data[str(dn)]
 
 
 def dn_lookup_loop(gather_args, model, dn_parent, storage):
     dn = gather_args["dn"]
+    reject = gather_args.get("filter")
 
-    data = get_data(gather_args, model, dn_parent, storage)
-    for i in yield_by_dn(data, dn):
-        yield i
+    data = get_data(gather_args, model, dn_parent, storage, stream=True)
+    if reject is None:
+        yield from yield_by_dn(data, dn)
+    else:
+        yield from itertools.filterfalse(reject, yield_by_dn(data, dn))
 
 
 def dn_lookup(gather_args, model, dn_parent, storage):
     data = get_data(gather_args, model, dn_parent, storage)
     current_pointer = data
-    for item in gather_args["dn"].split("."):
+    for item in compile_dn(gather_args["dn"]).keys:
         try:
             current_pointer = current_pointer.get(item)
         except AttributeError:
@@ -142,7 +273,7 @@ def dn_lookup(gather_args, model, dn_parent, storage):
 
 
 def get_from_source(gather_args, model, dn_parent, storage):
-    data = get_data(gather_args, model, dn_parent, storage)
+    data = get_data(gather_args, model, dn_parent, storage, stream=True)
 
     try:
         dn = gather_args.get("path_to_target") or gather_args["dn"]
@@ -156,15 +287,15 @@ def get_from_source(gather_args, model, dn_parent, storage):
 
 def key_lookup(gather_args, model, dn_parent, storage):
     key = gather_args.get("key") or gather_args.get("dn")
-    if KEY_GATHER not in gather_args:
-        return storage["context_data"].get(key)  # TODO set better debugging
-    else:
-        return storage["input"][gather_args[KEY_GATHER]].get(key)
+    return get_data(gather_args, model, dn_parent, storage).get(key)
 
 
 def loop_over(gather_args, model, dn_parent, storage):
-    data = get_data(gather_args, model, dn_parent, storage)
-    yield from data
+    data = get_data(gather_args, model, dn_parent, storage, stream=True)
+    if type(data) in LAZY_INPUT:
+        yield from data.iter_steps(())
+    else:
+        yield from data
 
 
 def index(gather_args, model, dn_parent, storage):
@@ -182,7 +313,41 @@ def get_index_num_from_list_dn(item):
     return int(item[1:item.find("]")])
 
 
-def get_by_dn(data_source, dn):
+class DnPath(str):
+    """Dn that is parsed once into steps, a step is a tuple of (is_index, key or index number).
+
+    It is still a str, so it can be used as a dict key and stored in the model.
+    Dns that can't be parsed up front, like empty steps, have steps set to None.
+    """
+
+    def __new__(cls, dn):
+        self = super().__new__(cls, dn)
+        self.keys = tuple(dn.split("."))
+        try:
+            self.steps = tuple(parse_dn_step(step) for step in self.keys)
+        except (IndexError, ValueError):
+            self.steps = None
+        return self
+
+
+def parse_dn_step(step):
+    if is_list_dn(step):
+        return True, get_index_num_from_list_dn(step)
+    return False, step
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_dn(dn):
+    if type(dn) is DnPath:
+        return dn
+    return DnPath(dn)
+
+
+# source arguments that contain a dn, these are compiled by prepare_model_for_run.
+DN_ARGS = ("dn", "path_to_target", "dn_data_source", "dn_to_ids", "dn_to_values", "dn_to_id", "dn_to_value")
+
+
+def get_by_dn_steps(data_source, dn):
     found = True
     index = data_source
     try:
@@ -198,7 +363,67 @@ def get_by_dn(data_source, dn):
     return found, index
 
 
+def get_by_dn(data_source, dn):
+    steps = (dn if type(dn) is DnPath else compile_dn(dn)).steps
+    if steps is None:
+        if type(data_source) in LAZY_INPUT:
+            data_source = data_source.load()
+        return get_by_dn_steps(data_source, dn)
+    if type(data_source) in LAZY_INPUT:
+        return data_source.get_by_steps(steps)
+
+    index = data_source
+    try:
+        for is_index, step in steps:
+            if is_index:
+                index = index[step]
+            else:
+                index = index.get(step, {})
+    except (AttributeError, IndexError, KeyError):
+        return False, ""
+
+    return True, index
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_dn_getter(dn):
+    """Returns a function that does get_by_dn(data_source, dn) on plain data, made for the steps of the dn."""
+    dn = compile_dn(dn)
+    steps = dn.steps
+    if steps is None:
+        return lambda data_source: get_by_dn_steps(data_source, dn)
+
+    if len(steps) == 1 and not steps[0][0]:
+        key = steps[0][1]
+
+        def get_key(data_source):
+            try:
+                return True, data_source.get(key, {})
+            except AttributeError:
+                return False, ""
+        return get_key
+
+    def get_steps(data_source):
+        index = data_source
+        try:
+            for is_index, step in steps:
+                if is_index:
+                    index = index[step]
+                else:
+                    index = index.get(step, {})
+        except (AttributeError, IndexError, KeyError):
+            return False, ""
+        return True, index
+    return get_steps
+
+
 def yield_by_dn(data_source, dn):
+    if type(data_source) in LAZY_INPUT:
+        steps = compile_dn(dn).steps
+        if steps is not None:
+            yield from data_source.iter_steps(steps)
+            return
+
     found, index = get_by_dn(data_source, dn)
     if found:
         yield from index
@@ -216,53 +441,29 @@ def iter_by_key(gather_args, model, dn_parent, storage):
     # get the initial data_source
     data_source = storage["input"][gather_args[KEY_GATHER]]
 
-    # point the datasource to a subset of data.
-    # this will make subsequent dn searches simpler.
-    if dn_data_source is not None:
-        _, data_source = get_by_dn(data_source=data_source, dn=dn_data_source)
-
-    # get the items that need to be joined
-    items = [item[key] for item in data_source]
-
-    # create a buffer to join items with be done N(1) complexity.
-    buffer = {}
-    for item in data_source:
-        found, data = get_by_dn(data_source=item, dn=dn_to_values)
-        if found:
-            buffer[item[key]] = data
-    found, ids = get_by_dn(data_source, dn_to_ids)
-
-    # loop over ids and join the fields
-    for index, id_ in enumerate(ids):
-        yield {item: buffer.get(item, {}).get(id_) for item in items}
-
-
-def iter_by_prop(gather_args, model, dn_parent, storage):
-    # setup args
-    dn_data_source = gather_args.get("dn_data_source")
-    dn_to_id = gather_args["dn_to_id"]
-    dn_to_value = gather_args["dn_to_value"]
-
-    # get the initial data_source
-    data_source = storage["input"][gather_args[KEY_GATHER]]
-
-    # point the datasource to a subset of data.
-    # this will make subsequent dn searches simpler.
-    if dn_data_source is not None:
-        _, data_source = get_by_dn(data_source=data_source, dn=dn_data_source)
-
-    buffer = {}
-    for key, item in data_source.items():
-        for element_in_list in item:
-            data_found, data = get_by_dn(data_source=element_in_list, dn=dn_to_value)
-            index_found, index = get_by_dn(data_source=element_in_list, dn=dn_to_id)
-            if index_found and data_found:
-                if index not in buffer:
-                    buffer[index] = {}
-                buffer[index][key] = data
-
-    for index, item in buffer.items():
-        yield {**item, "id": index}
+    if type(data_source) in LAZY_INPUT:
+        # the items are read one at a time, only the ids and the value maps are kept
+        prefix = "" if dn_data_source is None else f"{dn_data_source}."
+        _, ids = get_by_dn(data_source=data_source, dn=prefix + dn_to_ids)
+        if dn_data_source is None:
+            items = data_source.iter_steps(())
+        else:
+            items = yield_by_dn(data_source, dn_data_source)
+    else:
+        # point the datasource to a subset of data.
+        # this will make subsequent dn searches simpler.
+        if dn_data_source is not None:
+            _, data_source = get_by_dn(data_source=data_source, dn=dn_data_source)
+        items = data_source
+        _, ids = get_by_dn(data_source, dn_to_ids)
+
+    select, block_size = gather_args.get("select"), gather_args.get("block_size", BLOCK_SIZE)
+    if gather_args.get("spill"):
+        join = SpilledKeyJoin(ids, select=select, block_size=block_size, partitions=gather_args.get("partitions", JOIN_PARTITIONS))
+    else:
+        join = KeyJoin(ids, select=select, block_size=block_size)
+    join.index(items, key, lambda item: get_by_dn(data_source=item, dn=dn_to_values))
+    yield from join.iter_rows(gather_args.get("row_format", "dict"), reject=gather_args.get("filter"))
 
 
 def generate_informations(index):
@@ -272,32 +473,67 @@ def generate_informations(index):
     return f"({source if source is not None else '*'},{group})"
 
 
-def iter_by_prop2(gather_args, model, dn_parent, storage):
-    # setup args
-    dn_data_source = gather_args.get("dn_data_source")
-    dn_to_id = gather_args["dn_to_id"]
-    dn_to_value = gather_args["dn_to_value"]
+# formatters for the id of a pivot row, picked with the id_format source argument
+ID_FORMAT = {
+    "informations": generate_informations,
+}
 
-    # get the initial data_source
-    data_source = storage["input"][gather_args[KEY_GATHER]]
+
+def iter_pivot_groups(data_source, dn_data_source):
+    """Yields (key, list) for the lists in the data source, lazy inputs are read a list at a time."""
+    steps = () if dn_data_source is None else compile_dn(dn_data_source).steps
+    if type(data_source) in LAZY_INPUT and steps is not None:
+        for key in list(data_source.iter_steps(steps)):
+            yield key, data_source.iter_steps(steps + ((False, key),))
+        return
 
     # point the datasource to a subset of data.
     # this will make subsequent dn searches simpler.
     if dn_data_source is not None:
         _, data_source = get_by_dn(data_source=data_source, dn=dn_data_source)
+    yield from data_source.items()
+
+
+def iter_pivot_pairs(items, get_id, get_value):
+    for element_in_list in items:
+        data_found, data = get_value(element_in_list)
+        index_found, index = get_id(element_in_list)
+        if index_found and data_found:
+            yield index, data
+
+
+def pivot_by_prop(gather_args, model, dn_parent, storage):
+    """Pivots the lists in the data source into a row per id, with a column per list.
+
+    With sorted the lists are sorted by id and the rows are streamed in order of id,
+    otherwise the rows come in the order their ids are first seen and the pivot goes
+    to disk when there are more than max_ids ids.
+    """
+    get_id = compile_dn_getter(gather_args["dn_to_id"])
+    get_value = compile_dn_getter(gather_args["dn_to_value"])
+    id_format = gather_args.get("id_format")
+    if id_format is not None and id_format not in ID_FORMAT:
+        raise ValueError(f"Id format not part of {ID_FORMAT.keys()}")
+    format_id = ID_FORMAT.get(id_format)
+
+    groups = iter_pivot_groups(storage["input"][gather_args[KEY_GATHER]], gather_args.get("dn_data_source"))
+    if gather_args.get("sorted"):
+        rows = pivot_sorted([(key, iter_pivot_pairs(items, get_id, get_value)) for key, items in groups])
+    else:
+        elements = ((index, key, data) for key, items in groups for index, data in iter_pivot_pairs(items, get_id, get_value))
+        rows = pivot(elements, max_ids=gather_args.get("max_ids", PIVOT_MAX_IDS), partitions=gather_args.get("partitions", PIVOT_PARTITIONS))
 
-    buffer = {}
-    for key, item in data_source.items():
-        for element_in_list in item:
-            data_found, data = get_by_dn(data_source=element_in_list, dn=dn_to_value)
-            index_found, index = get_by_dn(data_source=element_in_list, dn=dn_to_id)
-            if index_found and data_found:
-                if index not in buffer:
-                    buffer[index] = {}
-                buffer[index][key] = data
+    for index, row in rows:
+        row["id"] = index if format_id is None else format_id(index)
+        yield row
 
-    for index, item in buffer.items():
-        yield {**item, "id": generate_informations(index)}
+
+def iter_by_prop(gather_args, model, dn_parent, storage):
+    return pivot_by_prop(gather_args, model, dn_parent, storage)
+
+
+def iter_by_prop2(gather_args, model, dn_parent, storage):
+    return pivot_by_prop({"id_format": "informations", **gather_args}, model, dn_parent, storage)
 
 
 def return_value(gather_args, model, dn_parent, storage):
@@ -319,6 +555,7 @@ SOURCE_FUNC = {
     "iter_by_key": iter_by_key,
     "iter_by_prop": iter_by_prop,
     "iter_by_prop2": iter_by_prop2,
+    "pivot_by_prop": pivot_by_prop,
     "loop_over": loop_over,
     "index": index,
     "return_value": return_value,
@@ -327,6 +564,9 @@ SOURCE_FUNC = {
     "yield": yield_from,
 }
 
+# sources that apply the compiled filter of the filter argument themselves
+FILTER_PUSHDOWN = {dn_lookup_loop, iter_by_key}
+
 
 def always_false(*args, **kwargs):
     return False
@@ -351,6 +591,126 @@ FILTERS = {
     "default": always_false,
 }
 
+FILTER_COMPARISONS = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "lt": operator.lt,
+    "le": operator.le,
+    "gt": operator.gt,
+    "ge": operator.ge,
+}
+# filters that work on the views that sources can give to a pushed down filter instead
+# of the items, like the RowView of iter_by_key. Other filters get the loaded item.
+VIEW_FILTERS = {contains, not_cotains, dict_key_is_empty, always_false}
+FILTER_VIEWS = (RowView,)
+MISSING = object()
+
+
+class Filter():
+    """A compiled filter expression, returns True for the items that are left out.
+
+    The repr gives the call that compiles it again, so it can be part of generated code.
+    """
+    __slots__ = ("expression", "reject")
+
+    def __init__(self, expression, reject):
+        self.expression = expression
+        self.reject = reject
+
+    def __repr__(self):
+        return f"compile_filter({self.expression!r})"
+
+    def __call__(self, item, **kwargs):
+        return self.reject(item)
+
+
+def compile_filter_getter(dn):
+    """Returns a function that gives the value at dn in an item, MISSING when it is not there."""
+    if dn is None:
+        return lambda item: item.load() if type(item) in FILTER_VIEWS else item
+
+    steps = compile_dn(dn).steps
+    if steps is None:
+        raise ValueError(f"Invalid dn {dn!r} in filter")
+
+    def get_value(item):
+        value = item
+        for is_index, step in steps:
+            try:
+                value = value[step] if is_index else value.get(step, MISSING)
+            except (AttributeError, IndexError, KeyError, TypeError):
+                return MISSING
+            if value is MISSING:
+                return MISSING
+        return value.load() if type(value) in FILTER_VIEWS else value
+    return get_value
+
+
+def compile_filter_expression(expression):
+    if not isinstance(expression, dict):
+        raise ValueError(f"Filter should be a dict, got {expression!r}")
+
+    if "and" in expression:
+        rejects = [compile_filter_expression(part) for part in expression["and"]]
+        return lambda item: all(reject(item) for reject in rejects)
+    if "or" in expression:
+        rejects = [compile_filter_expression(part) for part in expression["or"]]
+        return lambda item: any(reject(item) for reject in rejects)
+    if "not" in expression:
+        reject = compile_filter_expression(expression["not"])
+        return lambda item: not reject(item)
+
+    filter_type = expression.get("type")
+    args = {k: v for k, v in expression.items() if k != "type"}
+    if filter_type in FILTER_COMPARISONS:
+        compare = FILTER_COMPARISONS[filter_type]
+        get_value = compile_filter_getter(args.get("dn"))
+        expected = args.get("value")
+
+        def compare_value(item):
+            value = get_value(item)
+            return value is not MISSING and compare(value, expected)
+        return compare_value
+
+    if filter_type in ("in", "not_in"):
+        get_value = compile_filter_getter(args.get("dn"))
+        values = args.get("values", [])
+        try:
+            values = frozenset(values)
+        except TypeError:
+            values = tuple(values)
+        is_in = filter_type == "in"
+
+        def value_in(item):
+            value = get_value(item)
+            if value is MISSING:
+                return False
+            try:
+                return (value in values) is is_in
+            except TypeError:
+                # unhashable values are never in the set
+                return not is_in
+        return value_in
+
+    if filter_type in FILTERS:
+        func = functools.partial(FILTERS[filter_type], **args)
+        if FILTERS[filter_type] in VIEW_FILTERS:
+            return func
+        return lambda item: func(item.load() if type(item) in FILTER_VIEWS else item)
+
+    raise ValueError(f"Filter {filter_type} not part of {list(FILTERS) + list(FILTER_COMPARISONS) + ['in', 'not_in', 'and', 'or', 'not']}")
+
+
+def compile_filter(expression):
+    """Compiles a filter expression of the filter source argument into a Filter.
+
+    An expression is {"and": [...]}, {"or": [...]}, {"not": expression}, a comparison like
+    {"type": "eq", "dn": "status", "value": "done"}, {"type": "in", "dn": "status", "values": [...]},
+    or a filter of FILTERS with its arguments, {"type": "contains", "arg": "10"}.
+    Comparisons are False for items without a value at dn.
+    """
+    return Filter(expression, compile_filter_expression(expression))
+
 
 def default_postformat(item, **kwargs):
     return item
@@ -367,22 +727,183 @@ def int_to_iso_timestamp(item, **kwargs):
     return result
 
 
+# strptime directives that a DatetimeParser reads itself, zero-padded only
+DATETIME_DIRECTIVES = {
+    "Y": ("[0-9]{4}", "year"),
+    "m": ("[0-9]{2}", "month"),
+    "d": ("[0-9]{2}", "day"),
+    "H": ("[0-9]{2}", "hour"),
+    "M": ("[0-9]{2}", "minute"),
+    "S": ("[0-9]{2}", "second"),
+    "f": ("[0-9]{1,6}", "microsecond"),
+}
+DATETIME_FIELDS = ["year", "month", "day", "hour", "minute", "second", "microsecond"]
+DATETIME_DEFAULTS = [1900, 1, 1, 0, 0, 0, 0]
+ISO_FORMATS = {
+    "%Y-%m-%d",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S.%f",
+}
+EPOCH_FORMAT = "%s"
+# timestamps that a DatetimeParser keeps the result of, timestamps in logs repeat a lot
+DATETIME_CACHE_SIZE = 65536
+
+
+def compile_datetime_format(re_format):
+    """Returns a regex with a group per directive of the format, and the names of the groups.
+
+    None when the format has directives that are not in DATETIME_DIRECTIVES.
+    """
+    if not isinstance(re_format, str):
+        return None
+    regex = ""
+    names = []
+    pieces = re.split("(%.)", re_format)
+    for number, piece in enumerate(pieces):
+        if number % 2 == 0:
+            if "%" in piece:
+                return None
+            regex += re.escape(piece)
+        elif piece == "%%":
+            regex += "%"
+        else:
+            directive = DATETIME_DIRECTIVES.get(piece[1])
+            if directive is None or directive[1] in names:
+                return None
+            # a fraction right before other digits can be split in more than one way
+            if directive[1] == "microsecond" and number + 2 < len(pieces) and not pieces[number + 1]:
+                return None
+            regex += f"({directive[0]})"
+            names.append(directive[1])
+    return re.compile(regex), names
+
+
+class DatetimeParser():
+    """datetime.strptime(item, format).isoformat(), made once for a format.
+
+    Zero-padded timestamps are read with a regex, or datetime.fromisoformat for ISO-8601 formats.
+    Timestamps that don't fit go to strptime, so the results and errors stay the same.
+    The format "%s" reads seconds since epoch in local time.
+    """
+
+    def __init__(self, re_format):
+        self.format = re_format
+        self.compiled = compile_datetime_format(re_format)
+        if self.compiled is not None:
+            pattern, names = self.compiled
+            fraction = names.index("microsecond") + 1 if "microsecond" in names else None
+            self.compiled = pattern, [DATETIME_FIELDS.index(name) for name in names], fraction
+        self.iso = re_format in ISO_FORMATS
+        self.cache = {}
+
+    def parse(self, item):
+        if type(item) is not str and self.format != EPOCH_FORMAT:
+            return datetime.datetime.strptime(item, self.format).isoformat()
+
+        result = self.cache.get(item)
+        if result is None:
+            result = self.read(item)
+            if len(self.cache) >= DATETIME_CACHE_SIZE:
+                self.cache.clear()
+            self.cache[item] = result
+        return result
+
+    def read(self, item):
+        if self.format == EPOCH_FORMAT:
+            try:
+                seconds = int(item)
+            except ValueError:
+                seconds = float(item)
+            return datetime.datetime.fromtimestamp(seconds).isoformat()
+
+        if self.compiled is not None:
+            pattern, positions, fraction = self.compiled
+            result = pattern.fullmatch(item)
+            if result is not None:
+                try:
+                    if self.iso:
+                        return datetime.datetime.fromisoformat(item).isoformat()
+                    values = DATETIME_DEFAULTS[:]
+                    for position, value in zip(positions, result.groups()):
+                        values[position] = int(value)
+                    if fraction is not None:
+                        values[6] = int(result.group(fraction).ljust(6, "0"))
+                    return datetime.datetime(*values).isoformat()
+                except ValueError:
+                    pass
+        return datetime.datetime.strptime(item, self.format).isoformat()
+
+
+@functools.lru_cache(maxsize=256)
+def get_datetime_parser(re_format):
+    return DatetimeParser(re_format)
+
+
 def regex_to_iso_timestamp(item, **kwargs):
-    re_format = kwargs.get("format")
-    return datetime.datetime.strptime(item, re_format).isoformat()
+    return get_datetime_parser(kwargs.get("format")).parse(item)
+
+
+def regex_to_iso_timestamp_batch(items, **kwargs):
+    parse = get_datetime_parser(kwargs.get("format")).parse
+    return [parse(item) for item in items]
 
 
 def regex_search(item, **kwargs):
-    regex = kwargs.get("regex")
-    result = re.search(regex, item)
+    result = compile_regex(kwargs.get("regex")).search(item)
     if result is None:
         return kwargs.get("default")
     return result.group(0)
 
 
+@functools.lru_cache(maxsize=4096)
+def uuid_namespace(domain):
+    return uuid.UUID(bytes=bytes(f"{domain}".ljust(16, "o").encode("ASCII")))
+
+
 def create_uuid5(domain, id):
-    namespace = uuid.UUID(bytes=bytes(f"{domain}".ljust(16, "o").encode("ASCII")))
-    return str(uuid.uuid5(namespace, id))
+    return str(uuid.uuid5(uuid_namespace(domain), id))
+
+
+STABLE_ID_HASHES = ("uuid5", "fast")
+
+
+@functools.lru_cache(maxsize=4096)
+def stable_id_prefix(namespace, id_hash):
+    """The hash state after the namespace, copied for every id."""
+    if id_hash == "uuid5":
+        return hashlib.sha1(uuid_namespace(namespace).bytes)
+    if id_hash == "fast":
+        return hashlib.blake2b(uuid_namespace(namespace).bytes, digest_size=8)
+    raise ValueError(f"Hash {id_hash} not part of {STABLE_ID_HASHES}")
+
+
+def stable_id_batch(items, **kwargs):
+    id_hash = kwargs.get("hash", "uuid5")
+    prefix = stable_id_prefix(kwargs.get("namespace", ""), id_hash)
+    results = []
+    for item in items:
+        state = prefix.copy()
+        state.update(f"{item}".encode())
+        if id_hash == "fast":
+            results.append(state.hexdigest())
+            continue
+        # the version and variant bits of a uuid5
+        digest = bytearray(state.digest()[:16])
+        digest[6] = digest[6] & 0x0F | 0x50
+        digest[8] = digest[8] & 0x3F | 0x80
+        h = digest.hex()
+        results.append(f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}")
+    return results
+
+
+def stable_id(item, **kwargs):
+    """A uuid5 of the item in a namespace, the same as hash_uuid with the namespace as item and the item as id.
+
+    With "hash": "fast" the id is a 64 bit blake2b hash in hex, for ids that only have to be stable.
+    """
+    return stable_id_batch([item], **kwargs)[0]
 
 
 def format_dict_to_key_list(item, **kwargs):
@@ -395,10 +916,164 @@ POSTFORMAT = {
     "regex_to_iso_timestamp": regex_to_iso_timestamp,
     "regex_search": regex_search,
     "hash_uuid": create_uuid5,
+    "stable_id": stable_id,
     "format_dict_to_key_list": format_dict_to_key_list,
 }
 
 
+def int_to_iso_timestamp_batch(items, **kwargs):
+    if numpy is not None:
+        try:
+            return numpy_int_to_iso_timestamp(items, **kwargs)
+        except Exception:
+            pass
+    fromtimestamp = datetime.datetime.fromtimestamp
+    fail_silent = kwargs.get("fail-silent")
+    results = []
+    for item in items:
+        try:
+            results.append(fromtimestamp(int(item) / 1e3).isoformat())
+        except Exception:
+            if not fail_silent:
+                raise
+            results.append(item)
+    return results
+
+
+def regex_search_batch(items, **kwargs):
+    search = compile_regex(kwargs.get("regex")).search
+    default = kwargs.get("default")
+    results = []
+    for item in items:
+        result = search(item)
+        results.append(default if result is None else result.group(0))
+    return results
+
+
+# batch versions of postformats, they take a list of items and return a list of results.
+# They are looked up by the postformat function, so a postformat that is replaced
+# in POSTFORMAT is called per item again. A batch that raises is redone per item.
+POSTFORMAT_BATCH = {
+    int_to_iso_timestamp: int_to_iso_timestamp_batch,
+    regex_to_iso_timestamp: regex_to_iso_timestamp_batch,
+    regex_search: regex_search_batch,
+    stable_id: stable_id_batch,
+}
+# items that are formatted at once by a batch postformat
+POSTFORMAT_CHUNK_SIZE = 256
+
+
+# results a pure postformat keeps
+POSTFORMAT_CACHE_SIZE = 4096
+
+
+class PurePostformat():
+    """A postformat whose result only depends on its arguments, the results are kept in an LRU cache.
+
+    Items or arguments that can't be hashed, like dicts, are formatted without the cache.
+    """
+
+    def __init__(self, func, maxsize=POSTFORMAT_CACHE_SIZE):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.cached = functools.lru_cache(maxsize=maxsize, typed=True)(func)
+        self.uncached = 0
+        # the repeated and the distinct items of batch, that doesn't go through the LRU cache
+        self.batch_hits = 0
+        self.batch_misses = 0
+
+    def __call__(self, item, **kwargs):
+        try:
+            return self.cached(item, **kwargs)
+        except TypeError:
+            try:
+                hash((item, *kwargs.values()))
+            except TypeError:
+                self.uncached += 1
+                return self.func(item, **kwargs)
+            raise
+
+    def batch(self, items, **kwargs):
+        """Formats the distinct items of a chunk once, with the batch version of func when it has one."""
+        batch_func = POSTFORMAT_BATCH.get(self.func)
+        if batch_func is None:
+            return [self(item, **kwargs) for item in items]
+        try:
+            distinct = {(item.__class__, item): item for item in items}
+        except TypeError:
+            self.uncached += len(items)
+            return batch_func(items, **kwargs)
+        self.batch_hits += len(items) - len(distinct)
+        self.batch_misses += len(distinct)
+        results = dict(zip(distinct, batch_func(list(distinct.values()), **kwargs)))
+        return [results[(item.__class__, item)] for item in items]
+
+    def cache_info(self):
+        info = self.cached.cache_info()
+        return {
+            "hits": info.hits + self.batch_hits,
+            "misses": info.misses + self.batch_misses,
+            "uncached": self.uncached,
+            "size": info.currsize,
+            "maxsize": info.maxsize,
+        }
+
+    def cache_clear(self):
+        self.cached.cache_clear()
+        self.uncached = 0
+        self.batch_hits = 0
+        self.batch_misses = 0
+
+
+def register_postformat(name, func, batch=None, pure=False, cache_size=POSTFORMAT_CACHE_SIZE):
+    """Adds a postformat, with batch as the version that formats a list of items at once.
+
+    A pure postformat, one whose result only depends on its arguments, keeps its results in an LRU cache.
+    """
+    if batch is not None:
+        POSTFORMAT_BATCH[func] = batch
+    if pure:
+        func = PurePostformat(func, maxsize=cache_size)
+        POSTFORMAT_BATCH[func] = func.batch
+    POSTFORMAT[name] = func
+
+
+register_postformat("int_to_iso_timestamp", int_to_iso_timestamp, pure=True)
+register_postformat("hash_uuid", create_uuid5, pure=True)
+
+
+def postformat_cache_info():
+    """Hits and misses of the cache of every pure postformat, by name."""
+    return {name: func.cache_info() for name, func in POSTFORMAT.items() if isinstance(func, PurePostformat)}
+
+
+def clear_postformat_cache():
+    for func in POSTFORMAT.values():
+        if isinstance(func, PurePostformat):
+            func.cache_clear()
+
+
+def iter_postformat(items, postformat_func, postformat_args):
+    """Yields the postformat of every item, a chunk at a time when it has a batch version."""
+    if postformat_func is default_postformat:
+        yield from items
+        return
+
+    batch_func = POSTFORMAT_BATCH.get(postformat_func)
+    if batch_func is None:
+        for item in items:
+            yield postformat_func(item, **postformat_args)
+        return
+
+    for chunk in iter_chunks(items, POSTFORMAT_CHUNK_SIZE):
+        try:
+            results = batch_func(chunk, **postformat_args)
+        except Exception:
+            # per item, so the items before the failing one are still given
+            results = (postformat_func(item, **postformat_args) for item in chunk)
+        yield from results
+
+
 def get_func_args_from_source(source, dn):
     try:
         source_type = source["type"]
@@ -420,13 +1095,33 @@ def get_func_args_from_source(source, dn):
         postformat_name = postformat_options.pop("type", "default")
         postformat_func = POSTFORMAT[postformat_name]
         postformat_args = postformat_options
+        if postformat_func is regex_search:
+            # compiled while the model is prepared, errors are still raised per item
+            try:
+                compile_regex(postformat_args.get("regex"))
+            except (re.error, TypeError):
+                pass
     except KeyError:
         # TODO add below message to errors, to make more descriptive
         raise InvalidModel(
             f"Missing post_format on {source_type} on source with dn {dn}, {postformat_name} not in available options {POSTFORMAT.keys()}"
         )
 
-    return source_func, filter_func, {k: v for k, v in source.items() if k != "type" or k.startswith("filter_")}, source.get("filter_args", {}), postformat_func, postformat_args
+    gather_args = {k: v for k, v in source.items() if k != "type" or k.startswith("filter_")}
+    filter_args = source.get("filter_args", {})
+    if "filter" in source:
+        expression = source["filter"]
+        if filter_func is not always_false:
+            expression = {"or": [{"type": source["filter_type"], **filter_args}, expression]}
+        try:
+            gather_args["filter"] = compile_filter(expression)
+        except (ValueError, TypeError) as e:
+            raise InvalidModel(f"Invalid filter on {source_type} on source with dn {dn}, {e}")
+        # sources that filter their items themselves skip them before they are built
+        filter_func = always_false if source_func in FILTER_PUSHDOWN else gather_args["filter"]
+        filter_args = {}
+
+    return source_func, filter_func, gather_args, filter_args, postformat_func, postformat_args
 
 
 def gather_items(model, dn, storage):
@@ -438,9 +1133,9 @@ def gather_items(model, dn, storage):
 
     try:
         gather_func, filter_func, gather_args, filter_args, postformat_func, postformat_args = get_func_args_from_source(source, dn)
-        for item in gather_func(gather_args=gather_args, model=model, dn_parent=dn, storage=storage):
-            if not filter_func(item, **filter_args):
-                yield postformat_func(item, **postformat_args)
+        items = gather_func(gather_args=gather_args, model=model, dn_parent=dn, storage=storage)
+        items = (item for item in items if not filter_func(item, **filter_args))
+        yield from iter_postformat(items, postformat_func, postformat_args)
 
     except Exception as e:
         raise InvalidModel(f"Error while gathering data, on dn {dn}, reason: {e}")
@@ -483,58 +1178,440 @@ def new_dn(dn, key):
     return dn + (key,)
 
 
-def full_detail(model, dn=(), context_data=None, roles=None, storage=None):
-    item = init_item(model, dn)
+def get_depends_on(model, dn):
+    """Returns the (model dns, input sources) that a sub model declares with depends_on.
 
-    if model["type"] == "dict":
-        for key, sub_model in model["nested"].items():
-            if sub_model.get("skip"):
-                continue
-            if has_read_rights(sub_model, roles):
-                item[key] = full_detail(sub_model, new_dn(dn, key), roles=roles, storage=storage)
+    A model dn is a dot separated path of keys in the result, like "person.name".
+    An input source is a dict like a source, {"source": "input", "dn": "meta.version"},
+    for sources that read more than their dn shows.
+    """
+    depends_on = model.get(KEY_DEPENDS_ON) or []
+    if isinstance(depends_on, (str, dict)):
+        depends_on = [depends_on]
 
-    elif model["type"] == "list":
+    model_dns, input_sources = [], []
+    for entry in depends_on:
+        if isinstance(entry, str):
+            model_dns.append(tuple(entry.split(".")) if entry else ())
+        elif isinstance(entry, dict) and KEY_GATHER in entry:
+            input_sources.append(entry)
+        else:
+            raise InvalidModel(f"Invalid {KEY_DEPENDS_ON} {entry!r} on dn {dn}, should be a model dn or a dict with a source")
+    return model_dns, input_sources
+
+
+# plan kinds, created by prepare_model_for_run
+PLAN_ERROR = "error"
+PLAN_DICT = "dict"
+PLAN_VALUE = "value"
+PLAN_LIST = "list"
+PLAN_LIST_ITEM = "item"
+PLAN_LIST_ITEMS = "items"
+PLAN_LIST_NESTED = "nested"
+
+
+class Plan():
+    """Compiled (sub) model, the source functions and arguments are resolved once.
+
+    Errors found while compiling are stored on the plan and raised when the plan
+    is executed, so unused or empty branches behave the same as the model dict.
+    """
+    __slots__ = ("model", "dn", "roles", "kind", "source", "children", "common", "error", "positional")
+
+    def __init__(self, model, dn, roles, kind, source=None, children=(), error=None):
+        self.model = model
+        self.dn = dn
+        self.roles = roles
+        self.kind = kind
+        self.source = source
+        self.children = children
+        self.common = None
+        self.error = error
+        self.positional = None
+
+    def __repr__(self):
+        return f"Plan(kind={self.kind!r}, dn={self.dn!r})"
+
+
+def compile_source(model, dn):
+    """Returns the resolved source tuple, None when missing or the error raised while resolving."""
+    if KEY_GATHER not in model:
+        return None
+    try:
+        source = get_func_args_from_source(model[KEY_GATHER], dn)
+    except Exception as e:
+        return e
+
+    gather_args = source[2]
+    for key in DN_ARGS:
+        if isinstance(gather_args.get(key), str):
+            gather_args[key] = compile_dn(gather_args[key])
+    return source
+
+
+def compile_child(sub_model, dn, roles, check_skip=False, compile_func=None):
+    """Returns the plan for sub_model, or None when it is skipped or not readable."""
+    try:
+        if check_skip and sub_model.get("skip"):
+            return None
+        if not has_read_rights(sub_model, roles):
+            return None
+    except Exception as e:
+        return Plan(sub_model, dn, roles, PLAN_ERROR, error=e)
+    return (compile_func or compile_plan)(sub_model, dn, roles)
+
+
+def compile_value(model, dn, roles):
+    """Plan for the sub models of list "item" and "items", these are gathered as a single value."""
+    try:
+        get_item_type(model, dn)
+    except Exception as e:
+        return Plan(model, dn, roles, PLAN_ERROR, error=e)
+    return Plan(model, dn, roles, PLAN_VALUE, source=compile_source(model, dn))
+
+
+def compile_positional(children):
+    """Returns (index, postformat_func, postformat_args) per item when all items are taken by
+    position from the list item, like [timestamp, value] rows of a timeseries. Otherwise None.
+    """
+    positional = []
+    for sub_plan in children:
+        if sub_plan.kind != PLAN_VALUE or not isinstance(sub_plan.source, tuple):
+            return None
+        gather_func, _, gather_args, _, postformat_func, postformat_args = sub_plan.source
+        if gather_func not in (index, yield_from) or KEY_GATHER in gather_args or not isinstance(gather_args.get("index"), int):
+            return None
+        positional.append((gather_args["index"], postformat_func, postformat_args))
+    return positional
+
+
+def compile_plan(model, dn, roles):
+    try:
+        item_type = get_item_type(model, dn)
+        if item_type == "dict":
+            children = []
+            for key, sub_model in model["nested"].items():
+                sub_plan = compile_child(sub_model, new_dn(dn, key), roles, check_skip=True)
+                if sub_plan is not None:
+                    children.append((key, sub_plan))
+            return Plan(model, dn, roles, PLAN_DICT, children=children)
+
+        if item_type != "list":
+            return Plan(model, dn, roles, PLAN_VALUE, source=compile_source(model, dn))
+
+        source = compile_source(model, dn)
         if "item" in model:
-            sub_model = model["item"]
-            for result in gather_items(model, dn, storage=storage):
-                if has_read_rights(sub_model, roles):
-                    sub_item = init_item(sub_model, dn)
-                    # TODO apply "item" logic
-                    item.append(result)
-
-        elif "items" in model:
-            for result in gather_items(model, dn, storage=storage):
-                p = []
-                for i, sub_model in enumerate(model["items"]):
-                    if has_read_rights(sub_model, roles):
-                        sub_item = init_item(sub_model, dn)
-                        storage["context_data"] = result
-
-                        result_i = gather_item(sub_model, dn, storage=storage)
-                        # TODO apply "item" logic, and tests
-                        # result_i = full_detail(sub_model, dn+("[]",), context_data=result, roles=roles, storage=storage)
-                        p.append(result_i)
-
-                item.append(p)
-
-        elif "nested" in model:
-            for partial_result in gather_items(model, dn, storage=storage):
-                sub_item = {}
-                for key, sub_model in model["nested"].items():
-                    if has_read_rights(sub_model, roles):
-                        storage["context_data"] = partial_result
-                        sub_item[key] = full_detail(sub_model,  new_dn(dn, key), roles=roles, storage=storage)
-                item.append(sub_item)
-        # item of default
+            children = compile_child(model["item"], dn, roles, compile_func=compile_value)
+            return Plan(model, dn, roles, PLAN_LIST_ITEM, source=source, children=children)
+
+        if "items" in model:
+            children = []
+            for sub_model in model["items"]:
+                sub_plan = compile_child(sub_model, dn, roles, compile_func=compile_value)
+                if sub_plan is not None:
+                    children.append(sub_plan)
+            plan = Plan(model, dn, roles, PLAN_LIST_ITEMS, source=source, children=children)
+            plan.positional = compile_positional(children)
+            return plan
+
+        if "nested" in model:
+            children = []
+            for key, sub_model in model["nested"].items():
+                sub_plan = compile_child(sub_model, new_dn(dn, key), roles)
+                if sub_plan is not None:
+                    children.append((key, sub_plan))
+            return Plan(model, dn, roles, PLAN_LIST_NESTED, source=source, children=children)
+
+        return Plan(model, dn, roles, PLAN_LIST, source=source)
+
+    except Exception as e:
+        return Plan(model, dn, roles, PLAN_ERROR, error=e)
+
+
+def prepare_model_for_run(model, roles=None, dn=()):
+    """Compile the model into a Plan, that can be reused by run_detail, run_list and run_nodes.
+
+    The roles are applied while compiling, sub models without read rights are left out of the plan.
+    """
+    roles = None if roles is None else frozenset(roles)
+    plan = compile_plan(model, dn, roles)
+
+    if not dn and plan.kind != PLAN_ERROR and has_list_item_config(model):
+        common_key = "common" if "common" in model.get("nested", {}) else "standard"
+        plan.common = compile_plan(model["nested"][common_key], (common_key,), roles)
+    return plan
+
+
+# plans per (model, roles), the model is kept in the entry so its id stays unique.
+PLAN_CACHE = collections.OrderedDict()
+PLAN_CACHE_SIZE = 128
+PLAN_CACHE_LOCK = threading.Lock()
+
+
+def cached_plan(model, roles=None):
+    """Returns the plan for the model and roles, prepared once and kept in a LRU cache.
+
+    The cache is keyed by the identity of the model, call clear_plan_cache after
+    changing a model in place.
+    """
+    key = (id(model), None if roles is None else frozenset(roles))
+    with PLAN_CACHE_LOCK:
+        entry = PLAN_CACHE.get(key)
+        if entry is not None and entry[0] is model:
+            PLAN_CACHE.move_to_end(key)
+            return entry[1]
+
+    plan = prepare_model_for_run(model, roles=roles)
+    with PLAN_CACHE_LOCK:
+        PLAN_CACHE[key] = (model, plan)
+        PLAN_CACHE.move_to_end(key)
+        while len(PLAN_CACHE) > PLAN_CACHE_SIZE:
+            PLAN_CACHE.popitem(last=False)
+    return plan
+
+
+def clear_plan_cache():
+    with PLAN_CACHE_LOCK:
+        PLAN_CACHE.clear()
+
+
+def as_plan(model, dn=(), roles=None):
+    if isinstance(model, Plan):
+        if roles is None or model.roles == frozenset(roles):
+            return model
+        model = model.model
+    if not dn:
+        return cached_plan(model, roles=roles)
+    return prepare_model_for_run(model, roles=roles, dn=dn)
+
+
+def plan_gather_items(plan, storage):
+    source = plan.source
+    if source is None:
+        raise InvalidModel(f"Missing 'source' on dn {plan.dn}")
+
+    try:
+        if isinstance(source, Exception):
+            raise source
+        gather_func, filter_func, gather_args, filter_args, postformat_func, postformat_args = source
+        items = gather_func(gather_args=gather_args, model=plan.model, dn_parent=plan.dn, storage=storage)
+        items = (item for item in items if not filter_func(item, **filter_args))
+        yield from iter_postformat(items, postformat_func, postformat_args)
+
+    except Exception as e:
+        raise InvalidModel(f"Error while gathering data, on dn {plan.dn}, reason: {e}")
+
+
+def plan_gather_item(plan, storage):
+    source = plan.source
+    if source is None:
+        raise InvalidModel(f"Missing 'source' on dn {plan.dn}")
+    if isinstance(source, Exception):
+        raise source
+    gather_func, filter_func, gather_args, filter_args, postformat_func, postformat_args = source
+    result = gather_func(gather_args=gather_args, model=plan.model, dn_parent=plan.dn, storage=storage)
+    return postformat_func(result, **postformat_args)
+
+
+def full_detail(model, dn=(), context_data=None, roles=None, storage=None):
+    return plan_detail(as_plan(model, dn=dn, roles=roles), storage)
+
+
+def plan_detail(plan, storage):
+    kind = plan.kind
+    if kind == PLAN_ERROR:
+        raise plan.error
+
+    if kind == PLAN_DICT:
+        item = {}
+        for key, sub_plan in plan.children:
+            item[key] = plan_detail(sub_plan, storage)
+
+    elif kind == PLAN_LIST_ITEM:
+        item = []
+        sub_plan = plan.children
+        for result in plan_gather_items(plan, storage):
+            if sub_plan is not None:
+                if sub_plan.kind == PLAN_ERROR:
+                    raise sub_plan.error
+                # TODO apply "item" logic
+                item.append(result)
+
+    elif kind == PLAN_LIST_ITEMS:
+        item = []
+        if plan.positional is not None:
+            for rows in iter_chunks(plan_gather_items(plan, storage), POSITIONAL_CHUNK_SIZE):
+                item.extend(plan_positional_rows(plan, rows, storage))
         else:
-            return item
+            for result in plan_gather_items(plan, storage):
+                item.append(plan_items_row(plan, result, storage))
+
+    elif kind == PLAN_LIST_NESTED:
+        item = []
+        for partial_result in plan_gather_items(plan, storage):
+            sub_item = {}
+            for key, sub_plan in plan.children:
+                storage["context_data"] = partial_result
+                sub_item[key] = plan_detail(sub_plan, storage)
+            item.append(sub_item)
+
+    # item of default
+    elif kind == PLAN_LIST:
+        item = []
+
     else:
-        item = gather_item(model, dn, storage=storage)
+        item = plan_gather_item(plan, storage)
 
     return item
 
 
-def list_item(model, dn, value):
+def plan_items_row(plan, result, storage):
+    row = []
+    for sub_plan in plan.children:
+        if sub_plan.kind == PLAN_ERROR:
+            raise sub_plan.error
+        storage["context_data"] = result
+        # TODO apply "item" logic, and tests
+        row.append(plan_gather_item(sub_plan, storage))
+    return row
+
+
+# rows of a positional items list that are turned into columns at once
+POSITIONAL_CHUNK_SIZE = 4096
+
+
+def iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def format_column(column, postformat_func, postformat_args):
+    if postformat_func is default_postformat:
+        return column
+    batch_func = POSTFORMAT_BATCH.get(postformat_func)
+    if batch_func is not None:
+        try:
+            return batch_func(column, **postformat_args)
+        except Exception:
+            pass
+    return [postformat_func(value, **postformat_args) for value in column]
+
+
+def plan_positional_rows(plan, rows, storage):
+    """Rows of an items list where every item is taken by position, see compile_positional.
+
+    Every item is taken from all rows at once and formatted as a column. When that
+    fails the rows are done one at a time, so errors are the same as without columns.
+    """
+    if not plan.positional:
+        return [[] for _ in rows]
+    try:
+        columns = [
+            format_column(list(map(operator.itemgetter(position), rows)), postformat_func, postformat_args)
+            for position, postformat_func, postformat_args in plan.positional
+        ]
+    except Exception:
+        return [plan_items_row(plan, result, storage) for result in rows]
+
+    storage["context_data"] = rows[-1]
+    return list(map(list, zip(*columns)))
+
+
+def plan_detail_columns(plan, storage, encode=encode_column):
+    """Same as plan_detail, but a list with nested items gives a column per key instead of a list of dicts.
+
+    encode is called with the values and model type of every column, see sm_columns.encode_column.
+    """
+    kind = plan.kind
+    if kind == PLAN_ERROR:
+        raise plan.error
+
+    if kind == PLAN_DICT:
+        item = {}
+        for key, sub_plan in plan.children:
+            item[key] = plan_detail_columns(sub_plan, storage, encode)
+        return item
+
+    if kind == PLAN_LIST_NESTED:
+        columns = [[] for _ in plan.children]
+        for partial_result in plan_gather_items(plan, storage):
+            for column, (key, sub_plan) in zip(columns, plan.children):
+                storage["context_data"] = partial_result
+                column.append(plan_detail_columns(sub_plan, storage, encode))
+
+        item = {}
+        for column, (key, sub_plan) in zip(columns, plan.children):
+            model_type = sub_plan.model.get("type") if isinstance(sub_plan.model, dict) else None
+            item[key] = encode(column, model_type)
+        return item
+
+    return plan_detail(plan, storage)
+
+
+def plan_detail_events(plan, storage, writer):
+    """Same as plan_detail, the result is passed to the writer as it is produced."""
+    kind = plan.kind
+    if kind == PLAN_ERROR:
+        raise plan.error
+
+    if kind == PLAN_DICT:
+        writer.start_dict()
+        for key, sub_plan in plan.children:
+            writer.key(key)
+            plan_detail_events(sub_plan, storage, writer)
+        writer.end_dict()
+
+    elif kind == PLAN_LIST_ITEM:
+        writer.start_list()
+        sub_plan = plan.children
+        for result in plan_gather_items(plan, storage):
+            if sub_plan is not None:
+                if sub_plan.kind == PLAN_ERROR:
+                    raise sub_plan.error
+                writer.value(result)
+        writer.end_list()
+
+    elif kind == PLAN_LIST_ITEMS:
+        writer.start_list()
+        if plan.positional is not None:
+            for rows in iter_chunks(plan_gather_items(plan, storage), POSITIONAL_CHUNK_SIZE):
+                for row in plan_positional_rows(plan, rows, storage):
+                    writer.value(row)
+        else:
+            for result in plan_gather_items(plan, storage):
+                writer.start_list()
+                for sub_plan in plan.children:
+                    if sub_plan.kind == PLAN_ERROR:
+                        raise sub_plan.error
+                    storage["context_data"] = result
+                    writer.value(plan_gather_item(sub_plan, storage))
+                writer.end_list()
+        writer.end_list()
+
+    elif kind == PLAN_LIST_NESTED:
+        writer.start_list()
+        for partial_result in plan_gather_items(plan, storage):
+            writer.start_dict()
+            for key, sub_plan in plan.children:
+                storage["context_data"] = partial_result
+                writer.key(key)
+                plan_detail_events(sub_plan, storage, writer)
+            writer.end_dict()
+        writer.end_list()
+
+    elif kind == PLAN_LIST:
+        writer.start_list()
+        writer.end_list()
+
+    else:
+        writer.value(plan_gather_item(plan, storage))
+
+
+def list_item(model, dn, value, storage=None):
     item = {
         "value": value,
         "dn": dn,
@@ -544,7 +1621,8 @@ def list_item(model, dn, value):
         "field_type": model.get("field_type"),
         "searchable": model.get("searchable", True),
     }
-    item.update(STORAGE[KEY_STORAGE_LIST_ITEM])
+    if storage is not None:
+        item.update(storage.get(KEY_STORAGE_LIST_ITEM, {}))
     return item
 
 
@@ -570,9 +1648,10 @@ def create_meta_data_list(model, dn, key, value):
     return meta_data
 
 
-def list_node(model, dn, value):
+def list_node(model, dn, value, storage=None):
     item = {"_dn": dn, "__columns": []}
-    item.update(STORAGE[KEY_STORAGE_LIST_ITEM])
+    if storage is not None:
+        item.update(storage.get(KEY_STORAGE_LIST_ITEM, {}))
     if isinstance(value, dict):
         for key, loop_value in value.items():
             nested_value = create_meta_data_list(model["nested"][key], new_dn(dn, key), key, loop_value)
@@ -587,50 +1666,54 @@ def list_node(model, dn, value):
 
 
 def list_items(model, dn=(), context_data=None, roles=None, storage=None):
-    item = init_item(model, dn)
-    if model["type"] == "dict":
-        for key, sub_model in model["nested"].items():
-            if sub_model.get("skip"):
-                continue
-            if has_read_rights(sub_model, roles):
-                yield from list_items(sub_model, new_dn(dn, key), roles=roles, storage=storage)
-
-    elif model["type"] == "list":
-
-        # list item contains single item
-        if "item" in model:
-            sub_model = model["item"]
-            for result in gather_items(model, dn, storage=storage):
-                if has_read_rights(sub_model, roles):
-                    sub_item = init_item(sub_model, dn)
-                    # TODO apply "item" logic
-                    yield list_item(sub_model, dn + ("item",), result)
-
-        # list contains multiple single items
-        elif "items" in model:
-            for result in gather_items(model, dn, storage=storage):
-                for i, sub_model in enumerate(model["items"]):
-                    if has_read_rights(sub_model, roles):
-                        # TODO apply "sub_item" logic
-                        sub_item = init_item(sub_model, dn)
-                        storage["context_data"] = result
-                        result_i = gather_item(sub_model, dn, storage=storage)
-                        yield list_item(sub_model, dn + ("item",), result_i)
-
-        # list contains dict
-        elif "nested" in model:
-            for partial_result in gather_items(model, dn, storage=storage):
-                for key, sub_model in model["nested"].items():
-                    if has_read_rights(sub_model, roles):
-                        storage["context_data"] = partial_result
-                        yield from list_items(sub_model,  new_dn(dn, key), roles=roles, storage=storage)
-        # return default or initil item
-        else:
-            yield item
+    yield from plan_list_items(as_plan(model, dn=dn, roles=roles), storage)
+
+
+def plan_list_items(plan, storage):
+    kind = plan.kind
+    dn = plan.dn
+    if kind == PLAN_ERROR:
+        raise plan.error
+
+    if kind == PLAN_DICT:
+        for key, sub_plan in plan.children:
+            yield from plan_list_items(sub_plan, storage)
+
+    # list item contains single item
+    elif kind == PLAN_LIST_ITEM:
+        sub_plan = plan.children
+        for result in plan_gather_items(plan, storage):
+            if sub_plan is not None:
+                if sub_plan.kind == PLAN_ERROR:
+                    raise sub_plan.error
+                # TODO apply "item" logic
+                yield list_item(sub_plan.model, dn + ("item",), result, storage=storage)
+
+    # list contains multiple single items
+    elif kind == PLAN_LIST_ITEMS:
+        for result in plan_gather_items(plan, storage):
+            for sub_plan in plan.children:
+                if sub_plan.kind == PLAN_ERROR:
+                    raise sub_plan.error
+                # TODO apply "sub_item" logic
+                storage["context_data"] = result
+                result_i = plan_gather_item(sub_plan, storage)
+                yield list_item(sub_plan.model, dn + ("item",), result_i, storage=storage)
+
+    # list contains dict
+    elif kind == PLAN_LIST_NESTED:
+        for partial_result in plan_gather_items(plan, storage):
+            for key, sub_plan in plan.children:
+                storage["context_data"] = partial_result
+                yield from plan_list_items(sub_plan, storage)
+
+    # return default or initil item
+    elif kind == PLAN_LIST:
+        yield []
 
     else:
-        result = gather_item(model, dn, storage=storage)
-        yield list_item(model=model, dn=dn, value=result)
+        result = plan_gather_item(plan, storage)
+        yield list_item(model=plan.model, dn=dn, value=result, storage=storage)
 
 
 def is_node(model):
@@ -638,61 +1721,44 @@ def is_node(model):
 
 
 def list_nodes(model, dn=(), context_data=None, roles=None, storage=None):
-    item = init_item(model, dn)
-    if model["type"] == "dict":
+    yield from plan_list_nodes(as_plan(model, dn=dn, roles=roles), storage)
+
+
+def plan_list_nodes(plan, storage):
+    kind = plan.kind
+    model = plan.model
+    dn = plan.dn
+    if kind == PLAN_ERROR:
+        raise plan.error
+
+    if kind == PLAN_DICT:
         if is_node(model):
-            result = full_detail(model, dn, roles=roles, storage=storage)
-            yield list_node(model=model, dn=dn, value=result)
+            result = plan_detail(plan, storage)
+            yield list_node(model=model, dn=dn, value=result, storage=storage)
         else:
-            for key, sub_model in model["nested"].items():
-                if sub_model.get("skip"):
-                    continue
-
-                if has_read_rights(sub_model, roles):
-                    yield from list_nodes(sub_model, new_dn(dn, key), roles=roles, storage=storage)
+            for key, sub_plan in plan.children:
+                yield from plan_list_nodes(sub_plan, storage)
 
     elif model["type"] == "list":
+        # is_node only holds for lists with nested, other lists fail on the lookup of "nested".
         if is_node(model):
-            result = full_detail(model, dn, roles=roles, storage=storage)
+            result = plan_detail(plan, storage)
             for item in result:
-                yield list_node(model=model, dn=dn, value=item)
-        else:
+                yield list_node(model=model, dn=dn, value=item, storage=storage)
 
-            # list item contains single item
-            if "item" in model:
-                sub_model = model["item"]
-                for result in gather_items(model, dn, storage=storage):
-                    if has_read_rights(sub_model, roles):
-                        # TODO apply "item" logic, and tests
-                        sub_item = init_item(sub_model, dn)
-                        yield list_nodes(sub_model, new_dn(dn, "item"), result)
-
-            # list contains multiple single items
-            elif "items" in model:
-                for result in gather_items(model, dn, storage=storage):
-                    for i, sub_model in enumerate(model["items"]):
-                        if has_read_rights(sub_model, roles):
-                            # TODO apply "item" logic, and tests
-                            sub_item = init_item(sub_model, dn)
-                            storage["context_data"] = result
-                            result_i = gather_item(sub_model, dn, storage=storage)
-                            yield list_nodes(sub_model, new_dn(dn, "item",), result_i)
-
-            # list contains dict
-            elif "nested" in model:
-                for partial_result in gather_items(model, dn, storage=storage):
-                    for key, sub_model in model["nested"].items():
-                        if has_read_rights(sub_model, roles):
-                            storage["context_data"] = partial_result
-                            yield from list_nodes(sub_model,  new_dn(dn, key), roles=roles, storage=storage)
-            # return default or initil item
-            else:
-                print("should not happen")
-                pass
+        # list contains dict
+        elif kind == PLAN_LIST_NESTED:
+            for partial_result in plan_gather_items(plan, storage):
+                for key, sub_plan in plan.children:
+                    storage["context_data"] = partial_result
+                    yield from plan_list_nodes(sub_plan, storage)
+        # nested is only used when the list has no item or items
+        else:
+            raise InvalidModel(f"List with nested and item or items can't be listed, on dn {dn}")
 
     else:
-        result = gather_item(model, dn, storage=storage)
-        yield list_node(model=model, dn=dn, value=result)
+        result = plan_gather_item(plan, storage)
+        yield list_node(model=model, dn=dn, value=result, storage=storage)
 
 
 def list_item_config(model, dn):
@@ -706,27 +1772,145 @@ def has_list_item_config(model):
 
 
 def run_list(model, roles=None, **input_data):
-    for k, v in input_data.items():
-        STORAGE["input"][k] = v
+    return Runner(model, roles=roles).list(**input_data)
 
-    if has_list_item_config(model):
-        common_key = "common" if "common" in model.get("nested", {}) else "standard"
-        common_fields = full_detail(model["nested"][common_key], dn=(common_key, ), roles=roles, storage=STORAGE)
-        STORAGE[KEY_STORAGE_LIST_ITEM] = {f"common_{key}": val for key, val in common_fields.items()}
 
-    return list_items(model, roles=roles, storage=STORAGE)
+def run_nodes(model, roles=None, **input_data):
+    return Runner(model, roles=roles).nodes(**input_data)
 
 
-def run_nodes(model, roles=None, **input_data):
-    for k, v in input_data.items():
-        STORAGE["input"][k] = v
+def run_detail_many(model, inputs, roles=None, input_name="input", workers=None, chunksize=64, ordered=True, **input_data):
+    """Yields the detail result for every document in inputs, the model is prepared once.
+
+    Every document is passed as input_name, input_data is shared by all runs.
+    With workers the documents are spread in chunks over a process pool, two chunks per
+    worker are read ahead of the results. With ordered set to False the results are yielded
+    as soon as they are done, as (index, result) pairs with the index of the document in inputs.
+    """
+    yield from Runner(model, roles=roles).run_many(
+        "detail", inputs, input_name=input_name, workers=workers, chunksize=chunksize, ordered=ordered, **input_data
+    )
+
+
+def run_list_many(model, inputs, roles=None, input_name="input", workers=None, chunksize=64, ordered=True, **input_data):
+    """Yields the list items for every document in inputs, as a list when run with workers."""
+    yield from Runner(model, roles=roles).run_many(
+        "list", inputs, input_name=input_name, workers=workers, chunksize=chunksize, ordered=ordered, **input_data
+    )
+
+
+def run_nodes_many(model, inputs, roles=None, input_name="input", workers=None, chunksize=64, ordered=True, **input_data):
+    """Yields the nodes for every document in inputs, as a list when run with workers."""
+    yield from Runner(model, roles=roles).run_many(
+        "nodes", inputs, input_name=input_name, workers=workers, chunksize=chunksize, ordered=ordered, **input_data
+    )
+
+
+# runner of the process pool worker, created once by init_worker.
+WORKER = {}
+
+
+def init_worker(model, roles):
+    WORKER["runner"] = Runner(model, roles=roles)
 
-    if has_list_item_config(model):
-        common_key = "common" if "common" in model.get("nested", {}) else "standard"
-        common_fields = full_detail(model["nested"][common_key], dn=(common_key, ), roles=roles, storage=STORAGE)
-        STORAGE[KEY_STORAGE_LIST_ITEM] = {f"common_{key}": val for key, val in common_fields.items()}
 
-    return list_nodes(model, roles=roles, storage=STORAGE)
+def run_worker(mode, input_name, input_data, document):
+    result = getattr(WORKER["runner"], mode)(**input_data, **{input_name: document})
+    if mode != "detail":
+        result = list(result)
+    return result
+
+
+def run_worker_chunk(run, chunk):
+    return [(index, run(document)) for index, document in chunk]
+
+
+def create_storage(input_data):
+    return {"input": dict(input_data), "context_data": {}, KEY_STORAGE_LIST_ITEM: {}}
+
+
+class Runner():
+    """Runs a model, every run gets its own storage.
+
+    The plan is shared and not changed while running, so one runner can be used
+    from multiple threads, and the generators of list and nodes can be interleaved.
+    """
+
+    def __init__(self, model, roles=None):
+        self.plan = as_plan(model, roles=roles)
+
+    def detail(self, **input_data):
+        storage = create_storage(input_data)
+        return plan_detail(self.plan, storage)
+
+    def list(self, **input_data):
+        storage = self.create_list_storage(input_data)
+        return plan_list_items(self.plan, storage)
+
+    def nodes(self, **input_data):
+        storage = self.create_list_storage(input_data)
+        return plan_list_nodes(self.plan, storage)
+
+    def columns(self, encode=encode_column, **input_data):
+        """Detail result with a column per key for lists with nested items, see plan_detail_columns."""
+        storage = create_storage(input_data)
+        return plan_detail_columns(self.plan, storage, encode)
+
+    def write_detail(self, writer, **input_data):
+        """Passes the detail result to the writer while it is produced, see sm_json.JsonWriter."""
+        storage = create_storage(input_data)
+        plan_detail_events(self.plan, storage, writer)
+
+    def detail_many(self, inputs, input_name="input", **input_data):
+        yield from self.run_many("detail", inputs, input_name=input_name, **input_data)
+
+    def list_many(self, inputs, input_name="input", **input_data):
+        yield from self.run_many("list", inputs, input_name=input_name, **input_data)
+
+    def nodes_many(self, inputs, input_name="input", **input_data):
+        yield from self.run_many("nodes", inputs, input_name=input_name, **input_data)
+
+    def run_many(self, mode, inputs, input_name="input", workers=None, chunksize=64, ordered=True, **input_data):
+        if not workers:
+            run = getattr(self, mode)
+            for index, document in enumerate(inputs):
+                result = run(**input_data, **{input_name: document})
+                yield result if ordered else (index, result)
+            return
+
+        # the workers prepare the model themselves, custom functions added to SOURCE_FUNC,
+        # FILTERS and POSTFORMAT are only available when the workers are forked.
+        run = functools.partial(run_worker_chunk, functools.partial(run_worker, mode, input_name, input_data))
+        # at most two chunks per worker are read from inputs ahead of the results, so streamed inputs are not read at once
+        chunks = iter_chunks(enumerate(inputs), chunksize)
+        # unordered, the chunks are put here when they are done
+        done = queue.SimpleQueue()
+        with multiprocessing.Pool(workers, initializer=init_worker, initargs=(self.plan.model, self.plan.roles)) as pool:
+            def submit(chunk):
+                if ordered:
+                    return pool.apply_async(run, (chunk,))
+                return pool.apply_async(run, (chunk,), callback=done.put, error_callback=done.put)
+
+            running = collections.deque(submit(chunk) for chunk in itertools.islice(chunks, workers * 2))
+            while running:
+                if ordered:
+                    results = running.popleft().get()
+                else:
+                    running.popleft()
+                    results = done.get()
+                    if isinstance(results, BaseException):
+                        raise results
+                running.extend(submit(chunk) for chunk in itertools.islice(chunks, 1))
+                for index, result in results:
+                    yield result if ordered else (index, result)
+
+    def create_list_storage(self, input_data):
+        storage = create_storage(input_data)
+        if self.plan.common is not None:
+            common_fields = plan_detail(self.plan.common, storage)
+            storage[KEY_STORAGE_LIST_ITEM] = {f"common_{key}": val for key, val in common_fields.items()}
+            storage["context_data"] = {}
+        return storage
 
 
 def rbac_views(items):
@@ -774,17 +1958,28 @@ ACTIONS = {
     "node": run_nodes,
 }
 
+ACTIONS_MANY = {
+    "detail": run_detail_many,
+    "list": run_list_many,
+    "node": run_nodes_many,
+}
+
 
-def run_semantic_model(sm_model_path, input_file):
-    return run_detail_json(sm_model_path, input=input_file)
+def run_semantic_model(sm_model_path, input_file, input_format="json"):
+    return run_detail_json(sm_model_path, input_format=input_format, input=input_file)
 
 
-def run_semantic_list_model(sm_model_path, input_file):
-    return run_list_json(sm_model_path, input=input_file)
+def write_semantic_model(sm_model_path, input_file, fp, input_format="json", indent=None):
+    run_detail_json_to(sm_model_path, fp, indent=indent, input_format=input_format, input=input_file)
+    fp.write("\n")
 
 
-def run_semantic_nodes_model(sm_model_path, input_file):
-    return run_node_json(sm_model_path, input=input_file)
+def run_semantic_list_model(sm_model_path, input_file, input_format="json"):
+    return run_list_json(sm_model_path, input_format=input_format, input=input_file)
+
+
+def run_semantic_nodes_model(sm_model_path, input_file, input_format="json"):
+    return run_node_json(sm_model_path, input_format=input_format, input=input_file)
 
 
 def explain(*args, **kwargs):
@@ -795,6 +1990,9 @@ def explain(*args, **kwargs):
     print("Run model with just created model and example_data")
     print("python3 -m semantic_model -input example.json -sm sm_model.json")
     print("")
+    print("Generate a python module from the model, next to the model")
+    print("python3 -m semantic_model -mode compile -sm sm_model.json")
+    print("")
     print("Graph created model and create a png image")
     print("sudo docker run -i attumm/dsm_png:lastest < sm_model.json > output.png")
     print("")
@@ -803,30 +2001,52 @@ def explain(*args, **kwargs):
 def pjson(result):
     if result is None:
         return
-    print(json.dumps(result, indent=4))
+    if not isinstance(result, (dict, list)):
+        result = list(result)
+    print(get_output_backend().dumps(result, indent=4))
 
 
 def json_(result):
     if result is None:
         return
-    print(json.dumps(result))
+    if not isinstance(result, (dict, list)):
+        result = list(result)
+    print(get_output_backend().dumps(result))
+
+
+def ndjson(result):
+    if result is None:
+        return
+    if isinstance(result, dict):
+        result = [result]
+    write_json_lines(sys.stdout, result)
 
 
 def tofile(result):
     if result is None:
         return
+    if not isinstance(result, (dict, list)):
+        result = list(result)
     with open("output.json", "w") as f:
-        json.dump(f, result)
+        f.write(get_output_backend().dumps(result))
 
 
 OUTPUT = {
     "pjson": pjson,
     "json": json_,
     "tofile": tofile,
+    "ndjson": ndjson,
+}
+
+# outputs that the detail mode writes while the result is produced, with their indent.
+OUTPUT_STREAM = {
+    "pjson": 4,
+    "json": None,
 }
 
 if __name__ == "__main__":
     from one_to_one import run_one_to_one
+    from sm_to_python import run_sm_to_python
     CLI = {
         "default": run_semantic_model,
         "detail": run_semantic_model,
@@ -834,26 +2054,49 @@ if __name__ == "__main__":
         "nodes": run_semantic_nodes_model,
         "greg": run_one_to_one,
         "one_to_one": run_one_to_one,
+        "compile": run_sm_to_python,
         "help": explain,
     }
 
     settipy.set("mode", "default", f"set the mode options: {CLI.keys()}")
     settipy.set("sm", "", "path to sm model. example: ./sm.json")
-    settipy.set("input", "", "path to input json file. example: ./example.json")
+    settipy.set("input", "", "path to input json file, - for stdin. example: ./example.json")
     settipy.set("output", "pjson", "path to input json file. options: {OUTPUT.keys()}")
+    settipy.set("input-format", "json", f"how the input file is read. options: {INPUT_FORMAT.keys() | INPUT_FORMAT_LINES.keys()}")
+    settipy.set("json-backend", "", f"json library to read and write json, default the fastest installed for reading and json for writing. options: {JSON_BACKENDS.keys()}")
+    settipy.set_bool("postformat-stats", False, "print the cache hits and misses of the pure postformats to stderr")
     settipy.parse()
 
+    def cli_path(flag):
+        # settipy reads the bare - of "-input -" as no value, - is stdin
+        for name in ["-" + flag, "--" + flag]:
+            if name in sys.argv and sys.argv[sys.argv.index(name) + 1:][:1] == ["-"]:
+                return "-"
+        return settipy.get(flag)
+
     mode = settipy.get("mode")
-    sm_model_path = settipy.get("sm")
-    input_path = settipy.get("input")
+    sm_model_path = cli_path("sm")
+    input_path = cli_path("input")
     output = settipy.get("output")
+    input_format = settipy.get("input-format")
+    set_json_backend(settipy.get("json-backend") or None)
+    if settipy.get("postformat-stats"):
+        import atexit
+        atexit.register(lambda: print(get_output_backend().dumps(postformat_cache_info(), indent=2), file=sys.stderr))
 
     try:
         run_mode = CLI[mode]
     except KeyError:
         print(f"{mode} not in valid mode options: {list(CLI.keys)}")
 
-    result = run_mode(sm_model_path, input_path)
+    if run_mode is run_semantic_model and output in OUTPUT_STREAM and input_format not in INPUT_FORMAT_LINES:
+        write_semantic_model(sm_model_path, input_path, sys.stdout, input_format=input_format, indent=OUTPUT_STREAM[output])
+        sys.exit(0)
+
+    if run_mode in {run_semantic_model, run_semantic_list_model, run_semantic_nodes_model}:
+        result = run_mode(sm_model_path, input_path, input_format=input_format)
+    else:
+        result = run_mode(sm_model_path, input_path)
 
     try:
         OUTPUT[output](result)
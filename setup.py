@@ -15,7 +15,7 @@ setup(
     long_description_content_type='text/markdown',
 
     version='2.2.0',
-    py_modules=['semantic_model', 'one_to_one', 'data'],
+    py_modules=['semantic_model', 'one_to_one', 'sm_to_python', 'sm_json', 'sm_join', 'sm_columns', 'sm_incremental', 'sm_schedule', 'data'],
     install_requires=['settipy'],
     include_package_data=True,
     license='MIT',
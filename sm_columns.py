@@ -0,0 +1,110 @@
+import time
+import array
+
+# numpy is optional, without it numeric columns stay an array.array
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# array typecodes for the numeric model types
+NUMERIC_TYPES = {
+    "integer": "q",
+    "float": "d",
+}
+# string columns with at most this share of distinct values are dictionary-encoded
+CATEGORICAL_RATIO = 0.5
+# milliseconds since epoch of the years 1 and 10000, the range of datetime
+MIN_TIMESTAMP_MS = -62135596800000
+MAX_TIMESTAMP_MS = 253402300800000
+
+
+class DictionaryColumn():
+    """Dictionary-encoded column, every code is the index of its value in categories."""
+    __slots__ = ("categories", "codes")
+
+    def __init__(self, categories, codes):
+        self.categories = categories
+        self.codes = codes
+
+    def __repr__(self):
+        return f"DictionaryColumn(categories={self.categories!r}, codes={self.codes!r})"
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        return self.categories[self.codes[index]]
+
+    def __iter__(self):
+        return map(self.categories.__getitem__, self.codes)
+
+    def __eq__(self, other):
+        if isinstance(other, DictionaryColumn):
+            return self.categories == other.categories and self.codes == other.codes
+        return NotImplemented
+
+    def to_list(self):
+        return list(self)
+
+
+def dictionary_encode(values, categorical_ratio=CATEGORICAL_RATIO):
+    """Returns a DictionaryColumn of the values, None when they have too many distinct values."""
+    index = {}
+    try:
+        codes = array.array("I", [index.setdefault(value, len(index)) for value in values])
+    except TypeError:
+        # unhashable values
+        return None
+    if len(index) > categorical_ratio * len(values):
+        return None
+    return DictionaryColumn(list(index), codes)
+
+
+def encode_column(values, model_type, categorical_ratio=CATEGORICAL_RATIO, use_numpy=False):
+    """Encodes the list of values of a column, by the type of its model.
+
+    Integer and float columns become an array.array, or a numpy array with use_numpy
+    when numpy is installed. Columns with values that don't fit, like None, stay a list.
+    String columns with few distinct values become a DictionaryColumn.
+    """
+    typecode = NUMERIC_TYPES.get(model_type)
+    if typecode is not None:
+        try:
+            column = array.array(typecode, values)
+        except (TypeError, OverflowError):
+            return values
+        if use_numpy and numpy is not None:
+            return numpy.frombuffer(column, dtype=typecode)
+        return column
+
+    if model_type == "string" and values and categorical_ratio:
+        column = dictionary_encode(values, categorical_ratio)
+        if column is not None:
+            return column
+    return values
+
+
+def to_rows(columns):
+    """Turns a dict of columns back into a list of dicts."""
+    keys = list(columns)
+    return [dict(zip(keys, row)) for row in zip(*columns.values())]
+
+
+def numpy_int_to_iso_timestamp(column, **kwargs):
+    """int_to_iso_timestamp on a whole column with numpy.
+
+    datetime.fromtimestamp gives local time, so this only works when local time is UTC.
+    It raises ValueError when it can't give the same result, the caller then formats
+    the values one at a time.
+    """
+    if time.timezone != 0 or time.daylight:
+        raise ValueError("local time is not UTC")
+    values = numpy.array(column, dtype=numpy.int64)
+    if len(values) and (values.min() < MIN_TIMESTAMP_MS or values.max() >= MAX_TIMESTAMP_MS):
+        raise ValueError("timestamp out of range")
+
+    # isoformat leaves out the microseconds when they are zero
+    strings = numpy.datetime_as_string(values.astype("datetime64[ms]"), unit="us").tolist()
+    return [s[:-7] if s.endswith(".000000") else s for s in strings]
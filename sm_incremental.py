@@ -0,0 +1,406 @@
+import copy
+
+from semantic_model import (
+    KEY_GATHER, LAZY_INPUT, Plan, PLAN_DICT, PLAN_LIST_ITEM, PLAN_LIST_ITEMS, PLAN_LIST_NESTED, as_plan, compile_dn, create_storage, get_depends_on, plan_detail,
+    json_key, json_key_item, key_lookup, dn_lookup_loop, dn_lookup, get_from_source, loop_over, index,
+    iter_by_key, pivot_by_prop, iter_by_prop, iter_by_prop2, return_value, yield_from,
+)
+
+
+# a key of an input path that matches any key, for list indexes that move when items are added or removed
+ANY = None
+
+# plans that leave their last item as the context_data of the values after them
+CONTEXT_PLANS = {PLAN_LIST_ITEM, PLAN_LIST_ITEMS, PLAN_LIST_NESTED}
+
+
+def dn_to_path(dn):
+    """The input path of a dn, a tuple of keys. Dns that can't be parsed are the whole input."""
+    if dn is None:
+        return ()
+    steps = compile_dn(dn).steps
+    if steps is None:
+        return ()
+    return tuple(ANY if is_index else step for is_index, step in steps)
+
+
+def read_key(gather_args):
+    return [(str(gather_args.get("key") or gather_args["dn"]),)]
+
+
+def read_dn(gather_args):
+    return [dn_to_path(gather_args.get("path_to_target") or gather_args.get("dn"))]
+
+
+def read_data_source(gather_args):
+    return [dn_to_path(gather_args.get("dn_data_source"))]
+
+
+def read_nothing(gather_args):
+    return []
+
+
+# input paths that a source function reads from the input of its source argument, from its gather_args.
+# Source functions that are not here are seen as reading every input, with or without a source argument.
+SOURCE_READS = {
+    json_key: read_key,
+    json_key_item: read_key,
+    key_lookup: read_key,
+    dn_lookup_loop: read_dn,
+    dn_lookup: read_dn,
+    get_from_source: read_dn,
+    index: lambda gather_args: [(ANY,)],
+    loop_over: lambda gather_args: [()],
+    iter_by_key: read_data_source,
+    pivot_by_prop: read_data_source,
+    iter_by_prop: read_data_source,
+    iter_by_prop2: read_data_source,
+    return_value: read_nothing,
+    yield_from: read_nothing,
+}
+
+
+def iter_plans(plan):
+    """Yields the plan and all plans below it."""
+    yield plan
+    children = plan.children
+    if isinstance(children, Plan):
+        children = [children]
+    for child in children or ():
+        yield from iter_plans(child[1] if isinstance(child, tuple) else child)
+
+
+def plan_reads(plan):
+    """Returns the (input name, path) pairs and the model dns that the plan and the plans below it depend on."""
+    reads, model_dns = set(), set()
+    for sub_plan in iter_plans(plan):
+        sources = []
+        if isinstance(sub_plan.source, tuple):
+            sources.append((sub_plan.source[0], sub_plan.source[2]))
+
+        if not isinstance(sub_plan.model, dict):
+            # the plan raises when it runs
+            continue
+        depends_dns, depends_sources = get_depends_on(sub_plan.model, sub_plan.dn)
+        model_dns.update(depends_dns)
+        sources.extend((get_from_source, source) for source in depends_sources)
+
+        for gather_func, gather_args in sources:
+            read = SOURCE_READS.get(gather_func)
+            if read is None:
+                reads.add((gather_args.get(KEY_GATHER, ANY), ()))
+            elif KEY_GATHER in gather_args:
+                reads.update((gather_args[KEY_GATHER], path) for path in read(gather_args))
+    return reads, model_dns
+
+
+def reads_context(plan):
+    """True when the source of the plan reads the context_data left by the values before it.
+
+    Sources without a source argument read it, the sources below a list read the items of the list.
+    """
+    if not isinstance(plan.source, tuple):
+        return False
+    gather_func, gather_args = plan.source[0], plan.source[2]
+    if gather_func is yield_from:
+        return True
+    return KEY_GATHER not in gather_args and SOURCE_READS.get(gather_func) is not read_nothing
+
+
+class Unit():
+    """A part of the result that is run again on its own, with the input paths it read."""
+    __slots__ = ("path", "plan", "reads", "model_dns", "reads_context", "sets_context")
+
+    def __init__(self, path, plan):
+        self.path = path
+        self.plan = plan
+        self.reads, self.model_dns = plan_reads(plan)
+        self.reads_context = reads_context(plan)
+        self.sets_context = plan.kind in CONTEXT_PLANS
+
+    def __repr__(self):
+        return f"Unit(path={self.path!r})"
+
+
+def iter_units(plan, path=()):
+    """Yields a Unit per value of the dicts at the top of the plan, in the order of the result."""
+    if plan.kind != PLAN_DICT:
+        yield Unit(path, plan)
+        return
+    for key, sub_plan in plan.children:
+        yield from iter_units(sub_plan, path + (key,))
+
+
+def run_unit(unit, storage, context_data):
+    """Runs the unit with context_data, returns its value and the context_data it left, None when it didn't change it."""
+    storage["context_data"] = context_data
+    value = plan_detail(unit.plan, storage)
+    left = storage["context_data"]
+    return value, None if left is context_data else left
+
+
+def context_dependencies(units, position):
+    """The positions of the units before position whose context_data the unit at position can read."""
+    if not units[position].reads_context:
+        return set()
+    return {other for other in range(position) if units[other].sets_context}
+
+
+def context_before(contexts, position):
+    """The context_data at the start of the unit at position, from the context_data left by the units before it."""
+    for left in reversed(contexts[:position]):
+        if left is not None:
+            return left
+    return {}
+
+
+def build_result(plan, values, positions):
+    """The result of a plan from the values of its units, in the order of the model."""
+    if plan.kind != PLAN_DICT:
+        return values[next(positions)]
+    return {key: build_result(sub_plan, values, positions) for key, sub_plan in plan.children}
+
+
+def paths_overlap(a, b):
+    """True when one path is the start of the other, ANY matches every key."""
+    return all(x is ANY or y is ANY or x == y for x, y in zip(a, b))
+
+
+def reads_changed(reads, changed):
+    return any(
+        (name is ANY or name == changed_name) and paths_overlap(path, changed_path)
+        for name, path in reads for changed_name, changed_path in changed
+    )
+
+
+def parse_pointer(pointer):
+    """Returns the keys of a JSON Pointer, like "/a/b~1c" is ("a", "b/c")."""
+    if pointer == "":
+        return ()
+    if not pointer.startswith("/"):
+        raise ValueError(f"Invalid JSON Pointer {pointer!r}")
+    return tuple(key.replace("~1", "/").replace("~0", "~") for key in pointer[1:].split("/"))
+
+
+def to_pointer(path):
+    return "".join("/" + str(key).replace("~", "~0").replace("/", "~1") for key in path)
+
+
+def get_path(document, path):
+    for key in path:
+        document = document[list_index(document, key) if isinstance(document, list) else key]
+    return document
+
+
+def list_index(items, key, insert=False):
+    if key == "-" and insert:
+        return len(items)
+    if not key.isdigit() or (len(key) > 1 and key[0] == "0"):
+        raise ValueError(f"Invalid list index {key!r}")
+    position = int(key)
+    if position > len(items) or (position == len(items) and not insert):
+        raise IndexError(f"List index {key} out of range")
+    return position
+
+
+class PatchedDocument():
+    """Applies JSON Patch operations without changing the document.
+
+    The containers on the path of an operation are copied once, the rest of the
+    new document is shared with the old one. So results that point into the old
+    document stay the same.
+    """
+
+    def __init__(self, document):
+        self.root = document
+        self.copied = {}
+
+    def own(self, node, parent, key):
+        """Returns node, copied when it is a container that is still shared with the old document."""
+        if not isinstance(node, (dict, list)) or id(node) in self.copied:
+            return node
+        node = node.copy()
+        # the copies are kept, so their ids are not given to other objects
+        self.copied[id(node)] = node
+        if parent is None:
+            self.root = node
+        else:
+            parent[key] = node
+        return node
+
+    def container(self, path):
+        """Returns the container at path, that can be changed."""
+        node = self.own(self.root, None, None)
+        for key in path:
+            if isinstance(node, list):
+                key = list_index(node, key)
+            elif not isinstance(node, dict):
+                raise ValueError(f"{to_pointer(path)} is not in an object or array")
+            node = self.own(node[key], node, key)
+        if not isinstance(node, (dict, list)):
+            raise ValueError(f"{to_pointer(path)} is not an object or array")
+        return node
+
+    def add(self, path, value):
+        if not path:
+            self.root = value
+            return
+        parent = self.container(path[:-1])
+        if isinstance(parent, list):
+            parent.insert(list_index(parent, path[-1], insert=True), value)
+        else:
+            parent[path[-1]] = value
+
+    def remove(self, path):
+        if not path:
+            raise ValueError("The document itself can't be removed")
+        parent = self.container(path[:-1])
+        key = list_index(parent, path[-1]) if isinstance(parent, list) else path[-1]
+        return parent.pop(key)
+
+    def replace(self, path, value):
+        if not path:
+            self.root = value
+            return
+        parent = self.container(path[:-1])
+        key = list_index(parent, path[-1]) if isinstance(parent, list) else path[-1]
+        if key not in parent and isinstance(parent, dict):
+            raise KeyError(path[-1])
+        parent[key] = value
+
+    def apply(self, operation):
+        """Applies an operation, returns the paths of the document it changed."""
+        op = operation["op"]
+        path = parse_pointer(operation["path"])
+        if op == "add":
+            self.add(path, operation["value"])
+        elif op == "remove":
+            self.remove(path)
+        elif op == "replace":
+            self.replace(path, operation["value"])
+        elif op == "move":
+            from_path = parse_pointer(operation["from"])
+            if path[:len(from_path)] == from_path and path != from_path:
+                raise ValueError(f"Can't move {operation['from']} into itself")
+            self.add(path, self.remove(from_path))
+            return [from_path, path]
+        elif op == "copy":
+            # a copy of the value, changes at one of the paths don't show at the other
+            self.add(path, copy.deepcopy(get_path(self.root, parse_pointer(operation["from"]))))
+        elif op == "test":
+            if get_path(self.root, path) != operation["value"]:
+                raise ValueError(f"Test failed on {operation['path']}")
+            return []
+        else:
+            raise ValueError(f"Invalid JSON Patch op {op!r}")
+        return [path]
+
+
+def apply_patch(document, patch):
+    """Returns the document with the JSON Patch applied, the document itself is not changed.
+
+    Raises ValueError, KeyError or IndexError on operations that don't apply.
+    """
+    patched = PatchedDocument(document)
+    for operation in patch:
+        patched.apply(operation)
+    return patched.root
+
+
+def diff(old, new, path=()):
+    """Returns a JSON Patch that turns old into new."""
+    if type(old) is not type(new):
+        return [{"op": "replace", "path": to_pointer(path), "value": new}]
+
+    if isinstance(old, dict):
+        patch = []
+        for key, value in old.items():
+            if key not in new:
+                patch.append({"op": "remove", "path": to_pointer(path + (key,))})
+            elif value is not new[key]:
+                patch.extend(diff(value, new[key], path + (key,)))
+        for key, value in new.items():
+            if key not in old:
+                patch.append({"op": "add", "path": to_pointer(path + (key,)), "value": value})
+        return patch
+
+    if isinstance(old, list):
+        patch = []
+        for position, (old_value, new_value) in enumerate(zip(old, new)):
+            if old_value is not new_value:
+                patch.extend(diff(old_value, new_value, path + (position,)))
+        for position in range(len(old) - 1, len(new) - 1, -1):
+            patch.append({"op": "remove", "path": to_pointer(path + (position,))})
+        for position in range(len(old), len(new)):
+            patch.append({"op": "add", "path": to_pointer(path + (position,)), "value": new[position]})
+        return patch
+
+    if old != new:
+        return [{"op": "replace", "path": to_pointer(path), "value": new}]
+    return []
+
+
+class IncrementalRunner():
+    """Runs a model in detail mode, and again on JSON Patch changes of its input.
+
+    The values of the dicts at the top of the model are run again only when the
+    input paths they read are changed. These are found from the dn arguments of
+    the sources, see SOURCE_READS, and from depends_on. A value that depends on
+    a model dn is run again when that part of the result is, a value that reads
+    the context_data of the lists before it when one of those is.
+    Results and inputs are not changed in place, every apply gives a new result.
+    """
+
+    def __init__(self, model, roles=None, **input_data):
+        self.plan = as_plan(model, roles=roles)
+        self.units = list(iter_units(self.plan))
+        self.context_dependencies = [context_dependencies(self.units, position) for position in range(len(self.units))]
+        self.input_data = {name: data.load() if type(data) in LAZY_INPUT else data for name, data in input_data.items()}
+        storage = create_storage(self.input_data)
+        values, self.contexts = [], []
+        for unit in self.units:
+            value, left = run_unit(unit, storage, storage["context_data"])
+            values.append(value)
+            self.contexts.append(left)
+        self.result = build_result(self.plan, values, iter(range(len(values))))
+
+    def affected_units(self, changed):
+        """The positions of the units that read one of the changed (input name, path) pairs, and of the units that depend on them."""
+        found = {position for position, unit in enumerate(self.units) if reads_changed(unit.reads, changed)}
+        while True:
+            added = {
+                position for position, unit in enumerate(self.units)
+                if position not in found and (
+                    any(other in found for other in self.context_dependencies[position])
+                    or any(paths_overlap(dn, self.units[other].path) for dn in unit.model_dns for other in found)
+                )
+            }
+            if not added:
+                return sorted(found)
+            found |= added
+
+    def apply(self, patch, input_name="input"):
+        """Applies the JSON Patch to the input, returns the new result and a JSON Patch of the result.
+
+        Raises ValueError, KeyError or IndexError on operations that don't apply, the runner is then not changed.
+        """
+        if input_name not in self.input_data:
+            raise ValueError(f"Input {input_name} not part of {list(self.input_data)}")
+        patched = PatchedDocument(self.input_data[input_name])
+        changed = [(input_name, path) for operation in patch for path in patched.apply(operation)]
+        input_data = {**self.input_data, input_name: patched.root}
+
+        storage = create_storage(input_data)
+        result = PatchedDocument(self.result)
+        contexts = list(self.contexts)
+        output_patch = []
+        for position in self.affected_units(changed):
+            unit = self.units[position]
+            value, contexts[position] = run_unit(unit, storage, context_before(contexts, position))
+            output_patch.extend(diff(get_path(self.result, unit.path), value, unit.path))
+            result.replace(unit.path, value)
+
+        self.input_data = input_data
+        self.contexts = contexts
+        self.result = result.root
+        return self.result, output_patch
@@ -0,0 +1,286 @@
+import heapq
+import pickle
+import operator
+import itertools
+import tempfile
+
+
+# ids that are joined at a time, the rows of a block are built with map and zip
+BLOCK_SIZE = 4096
+ROW_FORMATS = ("dict", "tuple", "columns")
+# temporary files of a spilled join, the blocks are spread over them
+JOIN_PARTITIONS = 16
+
+EMPTY = {}
+
+
+class KeyJoin():
+    """Joins the value maps of items on a list of ids, the engine of the iter_by_key source.
+
+    The columns are the keys of the items, in the order they are first seen. Every column
+    keeps the last value map that was found for it. The rows are built a block of ids at a
+    time, one list per column, without looking up every (id, column) pair by hand.
+    """
+
+    def __init__(self, ids, select=None, block_size=BLOCK_SIZE):
+        self.ids = list(ids)
+        self.select = None if select is None else set(select)
+        self.block_size = block_size
+        self.columns = {}
+        self.maps = {}
+
+    def index(self, items, key, get_values):
+        """Indexes the items once, get_values returns the (found, value map) of an item."""
+        select = self.select
+        for item in items:
+            column = item[key]
+            if select is not None and column not in select:
+                continue
+            self.columns.setdefault(column)
+            found, values = get_values(item)
+            if found:
+                self.add(column, values)
+        return self
+
+    def add(self, column, values):
+        self.maps[column] = values
+
+    def block_values(self, number, block, columns):
+        """A list of values per column for the ids of a block."""
+        maps = self.maps
+        return [list(map(maps.get(column, EMPTY).get, block)) for column in columns]
+
+    def iter_blocks(self):
+        """Yields the ids of a block with a list of values per column."""
+        columns = list(self.columns)
+        for number, start in enumerate(range(0, len(self.ids), self.block_size)):
+            block = self.ids[start:start + self.block_size]
+            yield block, self.block_values(number, block, columns)
+
+    def iter_rows(self, row_format="dict", reject=None):
+        """Yields a dict or tuple per id, or a dict of column lists per block.
+
+        Rows that reject returns True for are left out. It sees a row as a RowView, so the
+        dicts of the rows it rejects are not built. Blocks of columns can't be filtered.
+        """
+        if row_format not in ROW_FORMATS:
+            raise ValueError(f"Row format not part of {ROW_FORMATS}")
+        if reject is not None and row_format == "columns":
+            raise ValueError("A filter can't be used with row format columns")
+
+        columns = list(self.columns)
+        positions = {column: position for position, column in enumerate(columns)}
+        for block, values in self.iter_blocks():
+            if row_format == "columns":
+                yield dict(zip(columns, values))
+                continue
+
+            rows = zip(*values) if columns else [() for _ in block]
+            if reject is not None:
+                rows = (row for row in rows if not reject(RowView(positions, row)))
+            if row_format == "tuple":
+                yield from rows
+            else:
+                yield from (dict(zip(columns, row)) for row in rows)
+
+
+class RowView():
+    """A row of a join that is read like its dict, without building the dict."""
+    __slots__ = ("positions", "row")
+
+    def __init__(self, positions, row):
+        self.positions = positions
+        self.row = row
+
+    def __repr__(self):
+        return f"RowView({self.load()!r})"
+
+    def load(self):
+        return dict(zip(self.positions, self.row))
+
+    def get(self, key, default=None):
+        position = self.positions.get(key)
+        if position is None:
+            return default
+        return self.row[position]
+
+    def __getitem__(self, key):
+        return self.row[self.positions[key]]
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def keys(self):
+        return self.positions.keys()
+
+    def values(self):
+        return iter(self.row)
+
+    def items(self):
+        return zip(self.positions, self.row)
+
+
+class SpilledKeyJoin(KeyJoin):
+    """KeyJoin that writes the values of every column per block of ids to temporary files.
+
+    The blocks are spread over a fixed number of partition files, with the offsets of
+    their values kept per block. Only the values of one block are in memory while its
+    rows are built, for inputs that are read as a stream and don't fit in memory.
+    """
+
+    def __init__(self, ids, select=None, block_size=BLOCK_SIZE, partitions=JOIN_PARTITIONS):
+        super().__init__(ids, select=select, block_size=block_size)
+        blocks = -(-len(self.ids) // block_size)
+        self.files = [tempfile.TemporaryFile() for _ in range(min(partitions, blocks))]
+        # per block the offsets of its (column, values) in the file of its partition
+        self.offsets = [[] for _ in range(blocks)]
+
+    def add(self, column, values):
+        get = values.get
+        files = self.files
+        for number, offsets in enumerate(self.offsets):
+            f = files[number % len(files)]
+            start = number * self.block_size
+            offsets.append(f.tell())
+            pickle.dump((column, list(map(get, self.ids[start:start + self.block_size]))), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def block_values(self, number, block, columns):
+        # a column that is found again replaces the values written before
+        found = {}
+        f = self.files[number % len(self.files)]
+        for offset in self.offsets[number]:
+            f.seek(offset)
+            column, values = pickle.load(f)
+            found[column] = values
+
+        return [found[column] if column in found else [None] * len(block) for column in columns]
+
+    def iter_blocks(self):
+        try:
+            yield from super().iter_blocks()
+        finally:
+            for f in self.files:
+                f.close()
+
+
+# distinct ids a pivot keeps in memory, with more the elements are spilled to disk
+PIVOT_MAX_IDS = 1 << 20
+PIVOT_PARTITIONS = 16
+# elements that are pickled at once when spilled
+SPILL_BATCH = 1024
+
+
+def pivot(elements, max_ids=PIVOT_MAX_IDS, partitions=PIVOT_PARTITIONS):
+    """Pivots (id, key, value) elements into a row per id, yields (id, row).
+
+    The rows come in the order their ids are first seen, a key that is found
+    again for an id replaces the value. When there are more than max_ids ids,
+    the rest of the pivot is done on disk with SpilledPivot.
+    """
+    buffer = {}
+    elements = iter(elements)
+    for position, (id_, key, value) in enumerate(elements):
+        row = buffer.get(id_)
+        if row is None:
+            if max_ids is not None and len(buffer) >= max_ids:
+                spilled = SpilledPivot(partitions)
+                # the ids in memory are ordered by their rank, it is lower than any later position
+                for rank, (buffered_id, buffered_row) in enumerate(buffer.items()):
+                    for buffered_key, buffered_value in buffered_row.items():
+                        spilled.add(rank, buffered_id, buffered_key, buffered_value)
+                buffer = None
+                spilled.add(position, id_, key, value)
+                for position, (id_, key, value) in enumerate(elements, start=position + 1):
+                    spilled.add(position, id_, key, value)
+                yield from spilled.rows()
+                return
+            row = buffer[id_] = {}
+        row[key] = value
+    yield from buffer.items()
+
+
+class SpilledPivot():
+    """Pivot that writes the elements to a temporary file per partition of the ids.
+
+    Every partition is pivoted on its own and written back as rows, the rows of the
+    partitions are then merged on the position their id is first seen.
+    """
+
+    def __init__(self, partitions=PIVOT_PARTITIONS):
+        self.files = [tempfile.TemporaryFile() for _ in range(partitions)]
+        self.pending = [[] for _ in range(partitions)]
+
+    def add(self, position, id_, key, value):
+        number = hash(id_) % len(self.files)
+        pending = self.pending[number]
+        pending.append((position, id_, key, value))
+        if len(pending) >= SPILL_BATCH:
+            self.flush(number)
+
+    def flush(self, number):
+        if self.pending[number]:
+            pickle.dump(self.pending[number], self.files[number], protocol=pickle.HIGHEST_PROTOCOL)
+            self.pending[number] = []
+
+    def pivot_partition(self, number):
+        """Replaces the elements in the file of a partition with its rows."""
+        self.flush(number)
+        buffer = {}
+        for batch in iter_pickled(self.files[number]):
+            for position, id_, key, value in batch:
+                entry = buffer.get(id_)
+                if entry is None:
+                    entry = buffer[id_] = (position, id_, {})
+                entry[2][key] = value
+
+        # the elements are written in order of position, so the rows are as well
+        f = self.files[number]
+        f.seek(0)
+        f.truncate()
+        rows = list(buffer.values())
+        for start in range(0, len(rows), SPILL_BATCH):
+            pickle.dump(rows[start:start + SPILL_BATCH], f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def rows(self):
+        for number in range(len(self.files)):
+            self.pivot_partition(number)
+        partitions = [itertools.chain.from_iterable(iter_pickled(f)) for f in self.files]
+        try:
+            for _, id_, row in heapq.merge(*partitions, key=operator.itemgetter(0)):
+                yield id_, row
+        finally:
+            for f in self.files:
+                f.close()
+
+
+def iter_pickled(f):
+    f.seek(0)
+    while True:
+        try:
+            yield pickle.load(f)
+        except EOFError:
+            return
+
+
+def pivot_sorted(groups):
+    """Pivots groups of (key, (id, value) pairs sorted by id) into a row per id, yields (id, row).
+
+    Only a row at a time is kept in memory, the rows come in order of id.
+    """
+    def tag(number, key, pairs):
+        for seq, (id_, value) in enumerate(pairs):
+            yield id_, number, seq, key, value
+
+    merged = heapq.merge(*[tag(number, key, pairs) for number, (key, pairs) in enumerate(groups)])
+    last = EMPTY
+    for id_, elements in itertools.groupby(merged, key=operator.itemgetter(0)):
+        if last is not EMPTY and id_ < last:
+            raise ValueError(f"Input is not sorted by id, {id_!r} comes after {last!r}")
+        last = id_
+        yield id_, {key: value for _, _, _, key, value in elements}
@@ -0,0 +1,697 @@
+import re
+import sys
+import json
+import math
+import mmap
+import time
+
+
+CHUNK_SIZE = 1 << 16
+# seconds between flushes of json lines output
+FLUSH_INTERVAL = 1.0
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+STRUCTURE = re.compile(r'["\[\]{}]')
+STRING_END = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"')
+DELIMITERS = frozenset(" \t\n\r,:]}")
+
+# the same patterns on bytes, for memory-mapped files
+BYTES_WHITESPACE = re.compile(rb"[ \t\n\r]*")
+BYTES_STRING_END = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*"')
+BYTES_SCALAR_END = re.compile(rb"[^ \t\n\r,:\]}]*")
+# everything up to and including the next bracket that is not in a string
+BYTES_NEXT_BRACKET = re.compile(rb'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*[\[\]{}]')
+# containers nested up to this depth are skipped by a single regex match
+SKIP_DEPTH = 4
+
+
+def compile_skip_patterns(depth):
+    """Patterns that match a container nested up to depth levels, and an array or object item with such a value.
+
+    They need possessive quantifiers to not backtrack on deeper containers, these
+    exist since python 3.11. On older versions None is returned for all of them.
+    """
+    string = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+    container = None
+    for _ in range(depth):
+        body = rb'(?:[^"\[\]{}]++|' + string + (rb"|" + container if container else b"") + rb")*+"
+        container = rb"(?:\{" + body + rb"\}|\[" + body + rb"\])"
+
+    value = rb"(" + string + rb"|" + container + rb'|[^ \t\n\r,:\[\]{}"][^ \t\n\r,:\]}]*+)'
+    whitespace = rb"[ \t\n\r]*+"
+    try:
+        return (
+            re.compile(container),
+            re.compile(value + whitespace + rb"([,\]])" + whitespace),
+            re.compile(rb"(" + string + rb")" + whitespace + rb":" + whitespace + value + whitespace + rb"([,}])" + whitespace),
+        )
+    except re.error:
+        return None, None, None
+
+
+BYTES_SKIP_CONTAINER, BYTES_ARRAY_ITEM, BYTES_OBJECT_ITEM = compile_skip_patterns(SKIP_DEPTH)
+
+
+class JsonBackend():
+    """Json decoder and encoder.
+
+    loads takes a str or bytes, dumps takes the value and an indent and returns a str.
+    separators are the item and key separators that dumps writes without an indent.
+    """
+
+    def __init__(self, name, loads, dumps, separators=(", ", ": ")):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+        self.separators = separators
+
+    def __repr__(self):
+        return f"JsonBackend({self.name!r})"
+
+    def load(self, fp):
+        return self.loads(fp.read())
+
+
+def json_dumps(value, indent=None):
+    return json.dumps(value, indent=indent)
+
+
+JSON_BACKENDS = {}
+# the first installed backend of this list is the default
+JSON_BACKEND_PREFERENCE = ["orjson", "json"]
+CONFIG = {
+    "json_backend": None,
+}
+
+
+def register_json_backend(name, loads, dumps, separators=(", ", ": ")):
+    JSON_BACKENDS[name] = JsonBackend(name, loads, dumps, separators)
+
+
+def has_non_finite(value):
+    """True when there is a NaN or infinite float in the value."""
+    if isinstance(value, float):
+        return not math.isfinite(value)
+    if isinstance(value, dict):
+        return any(map(has_non_finite, value.values()))
+    if isinstance(value, (list, tuple)):
+        return any(map(has_non_finite, value))
+    return False
+
+
+def get_json_backend(name=None):
+    """Backend by name, without a name the one set by set_json_backend or the preferred installed one."""
+    if name is None:
+        name = CONFIG["json_backend"]
+    if name is None:
+        name = next(name for name in JSON_BACKEND_PREFERENCE if name in JSON_BACKENDS)
+    try:
+        return JSON_BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Json backend not part of {JSON_BACKENDS.keys()}")
+
+
+def get_output_backend(name=None):
+    """Backend that writes output, by name or the one set by set_json_backend.
+
+    Without either it is the json module, so the output doesn't change with the libraries that are installed.
+    """
+    if name is None:
+        name = CONFIG["json_backend"] or "json"
+    return get_json_backend(name)
+
+
+def set_json_backend(name=None):
+    """Sets the backend that is used when none is given, None goes back to the preferred installed one."""
+    if name is not None:
+        get_json_backend(name)
+    CONFIG["json_backend"] = name
+
+
+register_json_backend("json", json.loads, json_dumps)
+
+# orjson is optional, it is a lot faster but can't do everything the json module does.
+# Those values, like integers above 64 bit and indents other than 2, go through the json module.
+# orjson writes NaN and Infinity as null, values with them also go through the json module.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    def orjson_loads(text):
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            return json.loads(text)
+
+    def orjson_dumps(value, indent=None):
+        if indent is None:
+            option = orjson.OPT_NON_STR_KEYS
+        elif indent == 2:
+            option = orjson.OPT_NON_STR_KEYS | orjson.OPT_INDENT_2
+        else:
+            return json.dumps(value, indent=indent)
+        try:
+            text = orjson.dumps(value, option=option)
+        except orjson.JSONEncodeError:
+            return json.dumps(value, indent=indent)
+        if b"null" in text and has_non_finite(value):
+            return json.dumps(value, indent=indent)
+        return text.decode()
+
+    register_json_backend("orjson", orjson_loads, orjson_dumps, separators=(",", ":"))
+
+
+def get_by_steps(data_source, steps):
+    """Same lookup as semantic_model.get_by_dn, on already parsed steps."""
+    index = data_source
+    try:
+        for is_index, step in steps:
+            if is_index:
+                index = index[step]
+            else:
+                index = index.get(step, {})
+    except (AttributeError, IndexError, KeyError):
+        return False, ""
+    return True, index
+
+
+class JsonReader():
+    """Reads json values from a file object, without loading the whole file."""
+
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def read(self, size=None):
+        """Adds the next chunk to the buffer, the part before pos is dropped."""
+        chunk = self.fp.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def error(self, message):
+        return json.JSONDecodeError(message, self.buffer, self.pos)
+
+    def peek(self):
+        """Skips whitespace and returns the next character, or an empty string at the end of the file."""
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise self.error(f"Expecting {char!r}")
+        self.pos += 1
+
+    def decode(self):
+        """Decodes the next value, reading until it is complete."""
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.read(size):
+                    raise
+                size *= 2
+                continue
+
+            # a number cut off by the end of the buffer, like "-2" of "-25.0e3", also decodes
+            if (end == len(self.buffer) or self.buffer[end] not in DELIMITERS) and self.read(size):
+                continue
+            self.pos = end
+            return value
+
+    def skip_string(self):
+        while True:
+            match = STRING_END.match(self.buffer, self.pos)
+            if match is not None:
+                self.pos = match.end()
+                return
+            if not self.read():
+                raise self.error("Unterminated string")
+
+    def skip(self):
+        """Moves past the next value without decoding it."""
+        if self.peek() not in "[{":
+            self.decode()
+            return
+
+        depth = 0
+        while True:
+            match = STRUCTURE.search(self.buffer, self.pos)
+            if match is None:
+                self.pos = len(self.buffer)
+                if not self.read():
+                    raise self.error("Unterminated value")
+                continue
+
+            self.pos = match.end()
+            char = match.group()
+            if char == '"':
+                self.skip_string()
+            elif char in "[{":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def next_item(self, end):
+        """Moves past the delimiter after an item, returns False at the end of the container."""
+        char = self.peek()
+        self.pos += 1
+        if char == end:
+            return False
+        if char != ",":
+            raise self.error("Expecting ',' delimiter")
+        return True
+
+    def locate(self, steps):
+        """Moves the reader to the value at steps.
+
+        Returns None when the reader is at the value, otherwise the (found, value) result
+        of the lookup. Values that are not json objects or arrays on the path are decoded,
+        and the rest of the lookup is done on the decoded value.
+        """
+        for i, (is_index, step) in enumerate(steps):
+            char = self.peek()
+            if is_index and char == "[":
+                self.pos += 1
+                if self.peek() == "]":
+                    return False, ""
+                for _ in range(step):
+                    self.skip()
+                    if not self.next_item("]"):
+                        return False, ""
+
+            elif not is_index and char == "{":
+                self.pos += 1
+                if self.peek() == "}":
+                    return get_by_steps({}, steps[i:])
+                while True:
+                    key = self.decode()
+                    self.expect(":")
+                    if key == step:
+                        break
+                    self.skip()
+                    if not self.next_item("}"):
+                        return get_by_steps({}, steps[i:])
+            elif char in "[{":
+                # an object has no index and an array has no keys
+                return False, ""
+            else:
+                return get_by_steps(self.decode(), steps[i:])
+        return None
+
+    def iter_keys(self):
+        """Yields the keys of the object the reader is at, the values are skipped."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.decode()
+            self.expect(":")
+            yield key
+            self.skip()
+            if not self.next_item("}"):
+                return
+
+    def iter_array(self):
+        """Yields the items of the array the reader is at, one at a time."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.decode()
+            if not self.next_item("]"):
+                return
+
+
+class JsonStream():
+    """Json input file that is read incrementally.
+
+    Loop sources stream the items of the array at their dn, other sources
+    only decode the value they need.
+    """
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE, json_backend=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.json_backend = get_json_backend(json_backend)
+
+    def __repr__(self):
+        return f"JsonStream({self.path!r})"
+
+    def open(self):
+        return open(self.path, encoding="utf-8")
+
+    def load(self):
+        with self.open() as f:
+            return self.json_backend.load(f)
+
+    def iter_steps(self, steps):
+        with self.open() as f:
+            reader = JsonReader(f, self.chunk_size)
+            result = reader.locate(steps)
+            if result is None:
+                if reader.peek() == "[":
+                    yield from reader.iter_array()
+                elif reader.peek() == "{":
+                    yield from reader.iter_keys()
+                else:
+                    yield from reader.decode()
+            else:
+                found, value = result
+                if found:
+                    yield from value
+
+    def get_by_steps(self, steps):
+        with self.open() as f:
+            reader = JsonReader(f, self.chunk_size)
+            result = reader.locate(steps)
+            if result is None:
+                return True, reader.decode()
+            return result
+
+
+class JsonDocument():
+    """Json input file that is memory-mapped and decoded lazily.
+
+    The offsets of the keys and items of an object or array are indexed once, the first
+    time a lookup passes through it. Only the values that sources reach are decoded.
+    """
+
+    def __init__(self, path, json_backend=None):
+        self.path = path
+        self.json_backend = get_json_backend(json_backend)
+        self.buffer = None
+        self.children = {}
+        self.ends = {}
+
+    def __repr__(self):
+        return f"JsonDocument({self.path!r})"
+
+    def data(self):
+        if self.buffer is None:
+            with open(self.path, "rb") as f:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.buffer
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+            self.children.clear()
+            self.ends.clear()
+
+    def error(self, message, pos):
+        return json.JSONDecodeError(message, self.data()[pos:pos + 20].decode("utf-8", "replace"), pos)
+
+    def skip_whitespace(self, pos):
+        return BYTES_WHITESPACE.match(self.data(), pos).end()
+
+    def char(self, pos):
+        return self.data()[pos:pos + 1]
+
+    def string_end(self, pos):
+        match = BYTES_STRING_END.match(self.data(), pos + 1)
+        if match is None:
+            raise self.error("Unterminated string", pos)
+        return match.end()
+
+    def container_end(self, pos):
+        """Offset after the object or array that starts at pos."""
+        try:
+            return self.ends[pos]
+        except KeyError:
+            pass
+
+        data = self.data()
+        if BYTES_SKIP_CONTAINER is not None:
+            match = BYTES_SKIP_CONTAINER.match(data, pos)
+            if match is not None:
+                self.ends[pos] = match.end()
+                return match.end()
+
+        end = pos + 1
+        while True:
+            match = BYTES_NEXT_BRACKET.match(data, end)
+            if match is None:
+                raise self.error("Unterminated value", pos)
+            end = match.end()
+            if data[end - 1:end] in (b"[", b"{"):
+                end = self.container_end(end - 1)
+            else:
+                self.ends[pos] = end
+                return end
+
+    def value_end(self, pos):
+        char = self.char(pos)
+        if char == b'"':
+            return self.string_end(pos)
+        if char in (b"[", b"{"):
+            return self.container_end(pos)
+        return BYTES_SCALAR_END.match(self.data(), pos).end()
+
+    def index(self, pos):
+        """Offsets of the values in the container at pos, a dict for an object and a list for an array."""
+        try:
+            return self.children[pos]
+        except KeyError:
+            pass
+
+        data = self.data()
+        is_object = data[pos:pos + 1] == b"{"
+        end_char = b"}" if is_object else b"]"
+        item_pattern = BYTES_OBJECT_ITEM if is_object else BYTES_ARRAY_ITEM
+        children = {} if is_object else []
+        current = self.skip_whitespace(pos + 1)
+        if data[current:current + 1] == end_char:
+            current += 1
+        else:
+            while True:
+                # items with values up to SKIP_DEPTH deep are matched at once
+                match = item_pattern.match(data, current) if item_pattern is not None else None
+                if match is not None:
+                    if is_object:
+                        children[json.loads(match.group(1))] = match.start(2)
+                    else:
+                        children.append(current)
+                    current = match.end()
+                    char = match.group(match.lastindex)
+                else:
+                    if is_object:
+                        key_end = self.string_end(current)
+                        key = json.loads(data[current:key_end])
+                        current = self.skip_whitespace(key_end)
+                        if data[current:current + 1] != b":":
+                            raise self.error("Expecting ':' delimiter", current)
+                        current = self.skip_whitespace(current + 1)
+                        children[key] = current
+                    else:
+                        children.append(current)
+
+                    current = self.skip_whitespace(self.value_end(current))
+                    char = data[current:current + 1]
+                    current = self.skip_whitespace(current + 1)
+                if char == end_char:
+                    break
+                if char != b",":
+                    raise self.error("Expecting ',' delimiter", current)
+
+        self.ends[pos] = current
+        self.children[pos] = children
+        return children
+
+    def decode(self, pos):
+        return self.json_backend.loads(self.data()[pos:self.value_end(pos)])
+
+    def root(self):
+        return self.skip_whitespace(0)
+
+    def locate(self, steps):
+        """Finds the value at steps.
+
+        Returns (offset, None) with the offset of the value, or (None, result) with the
+        (found, value) result of the lookup when it ends before the value.
+        """
+        pos = self.root()
+        for i, (is_index, step) in enumerate(steps):
+            char = self.char(pos)
+            if is_index and char == b"[":
+                try:
+                    pos = self.index(pos)[step]
+                except IndexError:
+                    return None, (False, "")
+            elif not is_index and char == b"{":
+                try:
+                    pos = self.index(pos)[step]
+                except KeyError:
+                    return None, get_by_steps({}, steps[i:])
+            elif char in (b"[", b"{"):
+                # an object has no index and an array has no keys
+                return None, (False, "")
+            else:
+                return None, get_by_steps(self.decode(pos), steps[i:])
+        return pos, None
+
+    def get_by_steps(self, steps):
+        pos, result = self.locate(steps)
+        if pos is None:
+            return result
+        return True, self.decode(pos)
+
+    def iter_steps(self, steps):
+        pos, result = self.locate(steps)
+        if pos is None:
+            found, value = result
+            if found:
+                yield from value
+        elif self.char(pos) == b"[":
+            for child in self.index(pos):
+                yield self.decode(child)
+        elif self.char(pos) == b"{":
+            yield from self.index(pos)
+        else:
+            yield from self.decode(pos)
+
+    def load(self):
+        return self.json_backend.loads(self.data()[:])
+
+    # the top level value can be read like a dict or list, values are decoded when read
+
+    def __getitem__(self, key):
+        pos = self.root()
+        if self.char(pos) not in (b"[", b"{"):
+            return self.decode(pos)[key]
+        return self.decode(self.index(pos)[key])
+
+    def get(self, key, default=None):
+        pos = self.root()
+        if self.char(pos) != b"{":
+            return self.decode(pos).get(key, default)
+        children = self.index(pos)
+        if key not in children:
+            return default
+        return self.decode(children[key])
+
+    def __contains__(self, key):
+        pos = self.root()
+        if self.char(pos) == b"{":
+            return key in self.index(pos)
+        return key in self.decode(pos)
+
+    def __iter__(self):
+        return self.iter_steps(())
+
+
+class JsonWriter():
+    """Writes json from start, end, key and value events, as the values are produced.
+
+    The output is the same as the dumps of the json backend with the same indent.
+    """
+
+    def __init__(self, fp, indent=None, json_backend=None):
+        self.fp = fp
+        self.indent = indent
+        backend = get_output_backend(json_backend)
+        self.dumps = backend.dumps
+        self.item_separator = backend.separators[0] if indent is None else ","
+        self.key_separator = backend.separators[1] if indent is None else ": "
+        self.counts = []
+        self.after_key = False
+
+    def newline(self):
+        if self.indent is None:
+            return ""
+        return "\n" + " " * (self.indent * len(self.counts))
+
+    def before_value(self):
+        if self.after_key:
+            self.after_key = False
+            return
+        if self.counts:
+            if self.counts[-1]:
+                self.fp.write(self.item_separator)
+            self.counts[-1] += 1
+            self.fp.write(self.newline())
+
+    def start(self, char):
+        self.before_value()
+        self.fp.write(char)
+        self.counts.append(0)
+
+    def end(self, char):
+        count = self.counts.pop()
+        if count:
+            self.fp.write(self.newline())
+        self.fp.write(char)
+
+    def start_dict(self):
+        self.start("{")
+
+    def end_dict(self):
+        self.end("}")
+
+    def start_list(self):
+        self.start("[")
+
+    def end_list(self):
+        self.end("]")
+
+    def key(self, key):
+        self.before_value()
+        self.fp.write(self.dumps(key) + self.key_separator)
+        self.after_key = True
+
+    def value(self, value):
+        self.before_value()
+        text = self.dumps(value, indent=self.indent)
+        if self.indent is not None and self.counts and isinstance(value, (dict, list, tuple)):
+            text = text.replace("\n", self.newline())
+        self.fp.write(text)
+
+
+def iter_json_lines(fp, json_backend=None):
+    """Yields a document for every line of json lines input, empty lines are skipped."""
+    loads = get_json_backend(json_backend).loads
+    for line in fp:
+        if line.strip():
+            yield loads(line)
+
+
+def iter_json_lines_file(path, json_backend=None):
+    if path == "-":
+        yield from iter_json_lines(sys.stdin, json_backend)
+        return
+    with open(path, encoding="utf-8") as f:
+        yield from iter_json_lines(f, json_backend)
+
+
+def write_json_lines(fp, items, flush_interval=FLUSH_INTERVAL, json_backend=None):
+    """Writes every item on its own line, fp is flushed at least every flush_interval seconds."""
+    dumps = get_output_backend(json_backend).dumps
+    last_flush = time.monotonic()
+    for item in items:
+        fp.write(dumps(item))
+        fp.write("\n")
+        now = time.monotonic()
+        if now - last_flush >= flush_interval:
+            fp.flush()
+            last_flush = now
+    fp.flush()
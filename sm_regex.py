@@ -0,0 +1,43 @@
+import re
+import functools
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_regex(pattern):
+    """re.compile with a cache of its own, re only keeps a few hundred patterns."""
+    return re.compile(pattern)
+
+
+# patterns that change meaning or fail when they are part of a larger pattern
+NOT_JOINABLE = re.compile(r"\\[1-9]|\(\?P=|\(\?[aiLmsux]+\)")
+
+
+class RegexSet():
+    """Finds the name of the first pattern in a dict of patterns that matches the start of a value.
+
+    The patterns are joined into one alternation, so a value is matched in one scan.
+    When they can't be joined, like patterns with backreferences, they are matched one at a time.
+    """
+
+    def __init__(self, patterns):
+        self.names = list(patterns)
+        self.patterns = [compile_regex(pattern) for pattern in patterns.values()]
+        self.joined = None
+        if self.patterns and not any(NOT_JOINABLE.search(pattern.pattern) for pattern in self.patterns):
+            try:
+                joined = re.compile("|".join(f"(?P<_{i}>{pattern.pattern})" for i, pattern in enumerate(self.patterns)))
+            except (re.error, TypeError):
+                return
+            # the group of a pattern closes after the groups inside it, so it is the lastindex of a match
+            self.group_names = {joined.groupindex[f"_{i}"]: name for i, name in enumerate(self.names)}
+            self.joined = joined
+
+    def match(self, item):
+        if self.joined is not None:
+            result = self.joined.match(item)
+            return None if result is None else self.group_names[result.lastindex]
+
+        for name, pattern in zip(self.names, self.patterns):
+            if pattern.match(item):
+                return name
+        return None
@@ -0,0 +1,110 @@
+import concurrent.futures
+
+from semantic_model import InvalidModel, LAZY_INPUT, Runner, create_storage
+from sm_incremental import build_result, context_before, context_dependencies, iter_units, paths_overlap, run_unit
+
+
+# threads per runner, the sources are expected to wait on files or databases
+WORKERS = 8
+
+
+def unit_dependencies(units):
+    """Returns per unit the positions of the units it depends on, by the model dns of depends_on.
+
+    A model dn matches the units in it and the unit it is part of. A unit that reads the
+    context_data of the lists before it depends on those lists. Raises InvalidModel on a cycle.
+    """
+    dependencies = []
+    for position, unit in enumerate(units):
+        dependencies.append({
+            other_position for other_position, other in enumerate(units)
+            if other_position != position and any(paths_overlap(dn, other.path) for dn in unit.model_dns)
+        } | context_dependencies(units, position))
+
+    # every unit should be reached when the units without dependencies are taken away one by one
+    remaining = {position: set(found) for position, found in enumerate(dependencies)}
+    while remaining:
+        ready = [position for position, found in remaining.items() if not found]
+        if not ready:
+            cycle = sorted(".".join(units[position].path) for position in remaining)
+            raise InvalidModel(f"Cycle in depends_on between {cycle}")
+        for position in ready:
+            remaining.pop(position)
+        for found in remaining.values():
+            found.difference_update(ready)
+    return dependencies
+
+
+class ScheduledRunner(Runner):
+    """Runner that runs the values of the dicts at the top of the model on a thread pool.
+
+    Values run at the same time, unless one depends on the other with depends_on, or reads
+    the context_data of the lists before it, like a source without a source argument.
+    Made for sources that wait on files or databases, the result is the same as Runner.detail.
+    Lazy inputs, like JsonStream, are read by one thread at a time, so with them the values run in order.
+    """
+
+    def __init__(self, model, roles=None, workers=WORKERS):
+        super().__init__(model, roles=roles)
+        self.units = list(iter_units(self.plan))
+        self.dependencies = unit_dependencies(self.units)
+        self.workers = workers
+        self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def run_unit(self, unit, input_data, context_data):
+        # every unit gets its own storage, with the context_data left by the lists before it
+        return run_unit(unit, create_storage(input_data), context_data)
+
+    def detail(self, **input_data):
+        if len(self.units) < 2 or any(type(data) in LAZY_INPUT for data in input_data.values()):
+            return super().detail(**input_data)
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix="sm_schedule")
+
+        values = [None] * len(self.units)
+        contexts = [None] * len(self.units)
+        waiting = {position: set(found) for position, found in enumerate(self.dependencies)}
+        running = {}
+        errors = {}
+        while waiting or running:
+            # after an error only the units before it are started, like they would be when run in order
+            first_error = min(errors, default=len(self.units))
+            ready = [position for position, found in waiting.items() if not found and position < first_error]
+            for position in ready:
+                waiting.pop(position)
+                context_data = context_before(contexts, position)
+                running[self.executor.submit(self.run_unit, self.units[position], input_data, context_data)] = position
+            if not running:
+                break
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                position = running.pop(future)
+                try:
+                    values[position], contexts[position] = future.result()
+                except Exception as e:
+                    errors[position] = e
+                    continue
+                for found in waiting.values():
+                    found.discard(position)
+
+        if errors:
+            raise errors[min(errors)]
+        return build_result(self.plan, values, iter(range(len(self.units))))
+
+
+def run_detail_scheduled(model, roles=None, workers=WORKERS, **input_data):
+    """run_detail with the values of the model run on a thread pool, see ScheduledRunner."""
+    with ScheduledRunner(model, roles=roles, workers=workers) as runner:
+        return runner.detail(**input_data)
@@ -0,0 +1,440 @@
+import os
+import re
+import sys
+import json
+import hashlib
+import importlib.util
+
+from semantic_model import (
+    InvalidModel, FILTERS, as_plan, is_node, create_meta_data_list, new_dn,
+    PLAN_ERROR, PLAN_DICT, PLAN_VALUE, PLAN_LIST, PLAN_LIST_ITEM, PLAN_LIST_ITEMS, PLAN_LIST_NESTED,
+)
+
+
+# bump when the generated code changes, older cached modules will be regenerated.
+VERSION = 4
+
+INDENT = "    "
+
+
+class Writer():
+    """Collects the lines of the generated module."""
+
+    def __init__(self):
+        self.constants = []
+        self.functions = []
+        self.counter = 0
+        self.names = {}
+
+    def name(self, prefix):
+        self.counter += 1
+        return f"_{prefix}_{self.counter}"
+
+    def constant(self, prefix, value):
+        if (prefix, value) not in self.names:
+            name = self.name(prefix)
+            self.constants.append(f"{name} = {value}")
+            self.names[prefix, value] = name
+        return self.names[prefix, value]
+
+
+def raise_line(e):
+    if isinstance(e, InvalidModel) or type(e).__module__ != "builtins":
+        return f"raise InvalidModel({str(e)!r})"
+    return f"raise {type(e).__name__}(*{e.args!r})"
+
+
+def list_item_literal(model, dn, value):
+    return (
+        "{"
+        f"'value': {value}, 'dn': {dn!r}, 'title': {model.get('title')!r}, "
+        f"'description': {model.get('description')!r}, 'type': {model['type']!r}, "
+        f"'field_type': {model.get('field_type')!r}, 'searchable': {model.get('searchable', True)!r}, "
+        "**common}"
+    )
+
+
+def meta_data_literal(model, dn, key, value):
+    meta_data = create_meta_data_list(model, dn, key, None)
+    parts = [f"{key!r}: {value}"]
+    parts.extend(f"{k!r}: {v!r}" for k, v in meta_data.items() if k != key)
+    return ", ".join(parts)
+
+
+def list_node_literal(plan, dn, value, keys):
+    """list_node for a dict value with known keys, or for a single value when keys is None."""
+    if keys is None:
+        meta_data = meta_data_literal(plan.model, dn, "value", value)
+        return f"{{'_dn': {dn!r}, '__columns': ['value'], **common, {meta_data}}}"
+
+    meta_data = [
+        meta_data_literal(plan.model["nested"][key], new_dn(dn, key), key, f"{value}[{key!r}]")
+        for key in keys
+    ]
+    return f"{{'_dn': {dn!r}, '__columns': {list(keys)!r}, **common, {', '.join(meta_data)}}}"
+
+
+def yield_node(plan, dn, value, keys):
+    try:
+        return f"yield {list_node_literal(plan, dn, value, keys)}"
+    except Exception as e:
+        return raise_line(e)
+
+
+def data_expr(gather_args, ctx):
+    if "source" not in gather_args:
+        return ctx
+    return f"inputs[{gather_args['source']!r}]"
+
+
+def emit_source_call(w, plan, ctx):
+    gather_func, _, gather_args, _, _, _ = plan.source
+    func = w.constant("source", f"SOURCE_FUNC[{plan.model['source']['type']!r}]")
+    args = w.constant("args", repr(gather_args))
+    model = w.constant("model", repr(plan.model))
+    return f"{func}(gather_args={args}, model={model}, dn_parent={plan.dn!r}, storage={{'input': inputs, 'context_data': {ctx}}})"
+
+
+def emit_value(w, lines, ind, plan, var, ctx):
+    """Inline the source of a single value, the common sources become plain dict lookups."""
+    pad = INDENT * ind
+    if plan.kind == PLAN_ERROR:
+        lines.append(f"{pad}{raise_line(plan.error)}")
+        return
+    if plan.source is None:
+        lines.append(f"{pad}raise InvalidModel({f'Missing {chr(39)}source{chr(39)} on dn {plan.dn}'!r})")
+        return
+    if isinstance(plan.source, Exception):
+        lines.append(f"{pad}{raise_line(plan.source)}")
+        return
+
+    _, _, gather_args, _, postformat_func, postformat_args = plan.source
+    source_type = plan.model["source"]["type"]
+    data = data_expr(gather_args, ctx)
+
+    if source_type == "json_key_item" and "dn" in gather_args:
+        # only the dn is looked up in the try, a missing input raises like it does in run_detail
+        lines.append(f"{pad}{var} = {data}")
+        lines.append(f"{pad}try:")
+        lines.append(f"{pad}{INDENT}{var} = {var}[{gather_args['dn']!r}]")
+        lines.append(f"{pad}except KeyError:")
+        if "default" in gather_args:
+            lines.append(f"{pad}{INDENT}{var} = {w.constant('default', repr(gather_args['default']))}")
+        else:
+            message = f"Missing data and default for source {source_type} with dn {plan.dn}"
+            lines.append(f"{pad}{INDENT}raise InvalidModel({message!r})")
+
+    elif source_type == "key_lookup":
+        key = gather_args.get("key") or gather_args.get("dn")
+        lines.append(f"{pad}{var} = {data}.get({key!r})")
+
+    elif source_type == "return_value" and "value" in gather_args:
+        lines.append(f"{pad}{var} = {w.constant('value', repr(gather_args['value']))}")
+
+    elif source_type == "index" and "index" in gather_args:
+        lines.append(f"{pad}{var} = {data}[{gather_args['index']!r}]")
+
+    elif source_type == "yield":
+        index = f"[{gather_args['index']!r}]" if "index" in gather_args else ""
+        lines.append(f"{pad}{var} = {ctx}{index}")
+
+    elif source_type in {"get_from_source", "get_from_input_file"} and (gather_args.get("path_to_target") or "dn" in gather_args):
+        dn = gather_args.get("path_to_target") or gather_args["dn"]
+        lines.append(f"{pad}found, {var} = get_by_dn({data}, {w.constant('dn', f'compile_dn({str(dn)!r})')})")
+        lines.append(f"{pad}if not found:")
+        lines.append(f"{pad}{INDENT}{var} = {w.constant('default', repr(gather_args.get('default')))}")
+
+    else:
+        lines.append(f"{pad}{var} = {emit_source_call(w, plan, ctx)}")
+
+    postformat_name = plan.model["source"].get("postformat", {}).get("type", "default")
+    if postformat_name != "default":
+        func = w.constant("postformat", f"POSTFORMAT[{postformat_name!r}]")
+        kwargs = f", **{w.constant('postformat_args', repr(postformat_args))}" if postformat_args else ""
+        lines.append(f"{pad}{var} = {func}({var}{kwargs})")
+
+
+def emit_rows(w, plan):
+    """Module level generator for the rows of a list, with the same errors as gather_items."""
+    if ("rows", id(plan)) in w.names:
+        return w.names["rows", id(plan)]
+    name = w.name("rows")
+    w.names["rows", id(plan)] = name
+    lines = [f"def {name}(inputs, ctx):"]
+    if plan.source is None:
+        lines.append(f"{INDENT}raise InvalidModel({f'Missing {chr(39)}source{chr(39)} on dn {plan.dn}'!r})")
+    elif isinstance(plan.source, Exception):
+        message = f"Error while gathering data, on dn {plan.dn}, reason: {plan.source}"
+        lines.append(f"{INDENT}raise InvalidModel({message!r})")
+    else:
+        _, filter_func, _, filter_args, _, postformat_args = plan.source
+        source = plan.model["source"]
+        lines.append(f"{INDENT}try:")
+        lines.append(f"{INDENT * 2}for item in {emit_source_call(w, plan, 'ctx')}:")
+        pad = INDENT * 3
+        filter_name = source.get("filter_type", "default")
+        if "filter" in source:
+            # a pushed down filter is part of the source arguments, filter_func is then always_false
+            if filter_func is not FILTERS["default"]:
+                func = w.constant("filter", repr(filter_func))
+                lines.append(f"{pad}if {func}(item):")
+                lines.append(f"{pad}{INDENT}continue")
+        elif filter_name != "default":
+            func = w.constant("filter", f"FILTERS[{filter_name!r}]")
+            args = w.constant("filter_args", repr(filter_args))
+            lines.append(f"{pad}if {func}(item, **{args}):")
+            lines.append(f"{pad}{INDENT}continue")
+        postformat_name = source.get("postformat", {}).get("type", "default")
+        if postformat_name != "default":
+            func = w.constant("postformat", f"POSTFORMAT[{postformat_name!r}]")
+            args = w.constant("postformat_args", repr(postformat_args))
+            lines.append(f"{pad}item = {func}(item, **{args})")
+        lines.append(f"{pad}yield item")
+        lines.append(f"{INDENT}except Exception as e:")
+        message = f"Error while gathering data, on dn {plan.dn}, reason: "
+        lines.append(f"{INDENT * 2}raise InvalidModel({message!r} + str(e))")
+
+    w.functions.append("\n".join(lines))
+    return name
+
+
+def emit_detail(w, lines, ind, plan, var, ctx):
+    pad = INDENT * ind
+    kind = plan.kind
+    if kind == PLAN_ERROR:
+        lines.append(f"{pad}{raise_line(plan.error)}")
+
+    elif kind == PLAN_DICT:
+        lines.append(f"{pad}{var} = {{}}")
+        for key, sub_plan in plan.children:
+            sub_var = w.name("v")
+            emit_detail(w, lines, ind, sub_plan, sub_var, ctx)
+            lines.append(f"{pad}{var}[{key!r}] = {sub_var}")
+
+    elif kind == PLAN_LIST:
+        lines.append(f"{pad}{var} = []")
+
+    elif kind == PLAN_VALUE:
+        emit_value(w, lines, ind, plan, var, ctx)
+
+    else:
+        row = w.name("row")
+        lines.append(f"{pad}{var} = []")
+        lines.append(f"{pad}for {row} in {emit_rows(w, plan)}(inputs, {ctx}):")
+        pad_row = pad + INDENT
+        if kind == PLAN_LIST_ITEM:
+            sub_plan = plan.children
+            if sub_plan is None:
+                lines.append(f"{pad_row}pass")
+            elif sub_plan.kind == PLAN_ERROR:
+                lines.append(f"{pad_row}{raise_line(sub_plan.error)}")
+            else:
+                lines.append(f"{pad_row}{var}.append({row})")
+
+        elif kind == PLAN_LIST_ITEMS:
+            values = []
+            for sub_plan in plan.children:
+                sub_var = w.name("v")
+                emit_value(w, lines, ind + 1, sub_plan, sub_var, row)
+                values.append(sub_var)
+            lines.append(f"{pad_row}{var}.append([{', '.join(values)}])")
+
+        else:
+            sub_item = w.name("v")
+            lines.append(f"{pad_row}{sub_item} = {{}}")
+            for key, sub_plan in plan.children:
+                sub_var = w.name("v")
+                emit_detail(w, lines, ind + 1, sub_plan, sub_var, row)
+                lines.append(f"{pad_row}{sub_item}[{key!r}] = {sub_var}")
+            lines.append(f"{pad_row}{var}.append({sub_item})")
+
+
+def emit_list(w, lines, ind, plan, ctx):
+    pad = INDENT * ind
+    kind = plan.kind
+    dn = plan.dn
+    if kind == PLAN_ERROR:
+        lines.append(f"{pad}{raise_line(plan.error)}")
+
+    elif kind == PLAN_DICT:
+        for key, sub_plan in plan.children:
+            emit_list(w, lines, ind, sub_plan, ctx)
+
+    elif kind == PLAN_LIST:
+        lines.append(f"{pad}yield []")
+
+    elif kind == PLAN_VALUE:
+        var = w.name("v")
+        emit_value(w, lines, ind, plan, var, ctx)
+        lines.append(f"{pad}yield {list_item_literal(plan.model, dn, var)}")
+
+    else:
+        row = w.name("row")
+        lines.append(f"{pad}for {row} in {emit_rows(w, plan)}(inputs, {ctx}):")
+        pad_row = pad + INDENT
+        if kind == PLAN_LIST_ITEM:
+            sub_plan = plan.children
+            if sub_plan is None:
+                lines.append(f"{pad_row}pass")
+            elif sub_plan.kind == PLAN_ERROR:
+                lines.append(f"{pad_row}{raise_line(sub_plan.error)}")
+            else:
+                lines.append(f"{pad_row}yield {list_item_literal(sub_plan.model, dn + ('item',), row)}")
+
+        elif kind == PLAN_LIST_ITEMS:
+            if not plan.children:
+                lines.append(f"{pad_row}pass")
+            for sub_plan in plan.children:
+                var = w.name("v")
+                emit_value(w, lines, ind + 1, sub_plan, var, row)
+                if sub_plan.kind != PLAN_ERROR:
+                    lines.append(f"{pad_row}yield {list_item_literal(sub_plan.model, dn + ('item',), var)}")
+
+        else:
+            if not plan.children:
+                lines.append(f"{pad_row}pass")
+            for key, sub_plan in plan.children:
+                emit_list(w, lines, ind + 1, sub_plan, row)
+
+
+def emit_nodes(w, lines, ind, plan, ctx):
+    pad = INDENT * ind
+    kind = plan.kind
+    dn = plan.dn
+    if kind == PLAN_ERROR:
+        lines.append(f"{pad}{raise_line(plan.error)}")
+        return
+
+    if kind == PLAN_VALUE:
+        var = w.name("v")
+        emit_value(w, lines, ind, plan, var, ctx)
+        lines.append(f"{pad}{yield_node(plan, dn, var, None)}")
+        return
+
+    try:
+        node = is_node(plan.model)
+    except Exception as e:
+        lines.append(f"{pad}{raise_line(e)}")
+        return
+
+    keys = [key for key, _ in plan.children] if kind in {PLAN_DICT, PLAN_LIST_NESTED} else None
+    if node and kind == PLAN_DICT:
+        var = w.name("v")
+        emit_detail(w, lines, ind, plan, var, ctx)
+        lines.append(f"{pad}{yield_node(plan, dn, var, keys)}")
+
+    elif node:
+        var = w.name("v")
+        item = w.name("v")
+        emit_detail(w, lines, ind, plan, var, ctx)
+        lines.append(f"{pad}for {item} in {var}:")
+        lines.append(f"{pad}{INDENT}{yield_node(plan, dn, item, keys)}")
+
+    elif kind == PLAN_DICT:
+        for key, sub_plan in plan.children:
+            emit_nodes(w, lines, ind, sub_plan, ctx)
+
+    elif kind == PLAN_LIST_NESTED:
+        row = w.name("row")
+        lines.append(f"{pad}for {row} in {emit_rows(w, plan)}(inputs, {ctx}):")
+        if not plan.children:
+            lines.append(f"{pad}{INDENT}pass")
+        for key, sub_plan in plan.children:
+            emit_nodes(w, lines, ind + 1, sub_plan, row)
+
+
+def emit_common(w, lines, plan):
+    if plan.common is None:
+        lines.append(f"{INDENT}common = {{}}")
+        return
+    var = w.name("v")
+    emit_detail(w, lines, 1, plan.common, var, "ctx")
+    lines.append(f"{INDENT}common = {{f'common_{{key}}': val for key, val in {var}.items()}}")
+
+
+def generate_module(model, roles=None, origin=None):
+    """Returns the source of a python module with detail, list and nodes functions for the model."""
+    plan = as_plan(model, roles=roles)
+    roles = plan.roles
+    w = Writer()
+    signature = "(input=None, **input_data):"
+    setup = [
+        f"{INDENT}inputs = dict(input_data)",
+        f"{INDENT}if input is not None:",
+        f"{INDENT * 2}inputs['input'] = input",
+        f"{INDENT}ctx = {{}}",
+    ]
+
+    detail = [f"def detail{signature}"] + setup
+    emit_detail(w, detail, 1, plan, "result", "ctx")
+    detail.append(f"{INDENT}return result")
+
+    list_ = [f"def list{signature}"] + setup
+    emit_common(w, list_, plan)
+    emit_list(w, list_, 1, plan, "ctx")
+    list_.append(f"{INDENT}yield from ()")
+
+    nodes = [f"def nodes{signature}"] + setup
+    emit_common(w, nodes, plan)
+    emit_nodes(w, nodes, 1, plan, "ctx")
+    nodes.append(f"{INDENT}yield from ()")
+
+    header = [
+        f"# Generated by sm_to_python from {origin or 'sm model'}, do not edit.",
+        f"# roles: {None if roles is None else sorted(roles)!r}",
+        "from semantic_model import InvalidModel, SOURCE_FUNC, FILTERS, POSTFORMAT, get_by_dn, compile_dn, compile_filter",
+    ]
+    parts = ["\n".join(header), "\n".join(w.constants)] + w.functions + ["\n".join(detail), "\n".join(list_), "\n".join(nodes)]
+    return "\n\n\n".join(part for part in parts if part) + "\n"
+
+
+def module_path(model_path, roles=None):
+    """Path of the generated module, next to the model and keyed by the hash of its content."""
+    with open(model_path, "rb") as f:
+        content = f.read()
+
+    digest = hashlib.sha256()
+    digest.update(f"{VERSION}:{None if roles is None else sorted(roles)!r}:".encode())
+    digest.update(content)
+
+    directory, file_name = os.path.split(os.path.abspath(model_path))
+    stem = re.sub(r"\W", "_", os.path.splitext(file_name)[0])
+    return os.path.join(directory, f"{stem}_sm_{digest.hexdigest()[:16]}.py")
+
+
+def compile_model_file(model_path, roles=None):
+    """Generate the module for the model file, unless it is already cached. Returns the path."""
+    path = module_path(model_path, roles=roles)
+    if os.path.exists(path):
+        return path
+
+    with open(model_path) as f:
+        source = generate_module(json.load(f), roles=roles, origin=os.path.basename(model_path))
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(source)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_model_module(model_path, roles=None):
+    """Import the generated module for the model file, generating it when needed."""
+    path = compile_model_file(model_path, roles=roles)
+    name = os.path.splitext(os.path.basename(path))[0]
+    if name in sys.modules and getattr(sys.modules[name], "__file__", None) == path:
+        return sys.modules[name]
+
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[name] = module
+    return module
+
+
+def run_sm_to_python(sm_model_path, input_file):
+    print(compile_model_file(sm_model_path))
+
+
+if __name__ == "__main__":
+    print(generate_module(json.load(sys.stdin)), end="")
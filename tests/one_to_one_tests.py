@@ -5,7 +5,7 @@ import unittest
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
 
-from one_to_one import one_to_one_looper, CONFIG
+from one_to_one import one_to_one_looper, CONFIG, DATA, identify, set_regexes
 
 from semantic_model import run_detail, run_list, InvalidModel, get_by_dn, yield_by_dn
 from semantic_model import run_nodes, iter_by_key
@@ -444,5 +444,32 @@ class TestgatherList(unittest.TestCase):
 
         self.assertDictEqual(dic_result, dic_input_data, test_output(dic_result, dic_input_data))
 
+
+class TestIdentify(unittest.TestCase):
+
+    def setUp(self):
+        self.regexes = DATA["regex"]
+
+    def tearDown(self):
+        set_regexes(self.regexes)
+
+    def test_regexes_changed(self):
+        set_regexes({"Email Address": r"[^@ ]+@[^@ ]+$"})
+        self.assertEqual(identify("bob@example.com"), "Email Address")
+        self.assertEqual(identify("abc-123"), "")
+
+        # regexes added in place are used as well
+        DATA["regex"]["Code"] = r"[a-z]+-[0-9]+$"
+        self.assertEqual(identify("abc-123"), "Code")
+
+        DATA["regex"] = {"Code": r"[a-z]+-[0-9]+$"}
+        self.assertEqual(identify("bob@example.com"), "")
+
+        # a regex changed in place is used after set_regexes
+        DATA["regex"]["Code"] = r"[A-Z]+-[0-9]+$"
+        set_regexes(DATA["regex"])
+        self.assertEqual((identify("abc-123"), identify("ABC-123")), ("", "Code"))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,130 @@
+import os
+import sys
+import time
+import array
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+from semantic_model import run_detail, run_columns, Runner, prepare_model_for_run
+from sm_columns import DictionaryColumn, encode_column, dictionary_encode, to_rows, numpy, numpy_int_to_iso_timestamp
+
+
+DSM_MODEL = {
+    "type": "dict",
+    "nested": {
+        "name": {"type": "string", "source": {"type": "json_key_item", "source": "input", "dn": "name"}},
+        "events": {
+            "type": "list",
+            "source": {"type": "dn_lookup_loop", "source": "input", "dn": "events"},
+            "nested": {
+                "id": {"type": "integer", "source": {"type": "json_key_item", "dn": "id"}},
+                "score": {"type": "float", "source": {"type": "json_key_item", "dn": "score"}},
+                "level": {"type": "string", "source": {"type": "json_key_item", "dn": "level"}},
+                "message": {"type": "string", "source": {"type": "json_key_item", "dn": "message"}},
+                "size": {"type": "integer", "source": {"type": "json_key_item", "dn": "size", "default": None}},
+            }
+        },
+    }
+}
+
+INPUT_DATA = {
+    "name": "export",
+    "events": [
+        {"id": i, "score": i / 2, "level": ["info", "warning"][i % 2], "message": f"message {i}", **({"size": i} if i % 3 else {})}
+        for i in range(6)
+    ],
+}
+
+
+class TestColumns(unittest.TestCase):
+
+    def test_same_as_detail(self):
+        expected = run_detail(DSM_MODEL, input=INPUT_DATA)
+        result = run_columns(DSM_MODEL, input=INPUT_DATA)
+        self.assertEqual(result["name"], expected["name"])
+        self.assertEqual(to_rows(result["events"]), expected["events"])
+
+    def test_encoded_columns(self):
+        events = run_columns(DSM_MODEL, input=INPUT_DATA)["events"]
+        self.assertEqual(events["id"], array.array("q", range(6)))
+        self.assertEqual(events["score"], array.array("d", [i / 2 for i in range(6)]))
+        self.assertEqual(events["level"], DictionaryColumn(["info", "warning"], array.array("I", [0, 1, 0, 1, 0, 1])))
+        self.assertEqual(events["message"], [f"message {i}" for i in range(6)])
+        self.assertEqual(events["size"], [None, 1, 2, None, 4, 5])
+
+    def test_options(self):
+        events = run_columns(DSM_MODEL, categorical_ratio=0, input=INPUT_DATA)["events"]
+        self.assertEqual(events["level"], ["info", "warning"] * 3)
+
+        events = Runner(DSM_MODEL).columns(encode=lambda values, model_type: values, input=INPUT_DATA)["events"]
+        self.assertEqual(events["id"], list(range(6)))
+
+    def test_empty_list(self):
+        events = run_columns(DSM_MODEL, input={"name": "", "events": []})["events"]
+        self.assertEqual(len(events["id"]), 0)
+        self.assertEqual(events["level"], [])
+
+    def test_encode_column(self):
+        self.assertEqual(encode_column([1, 2 ** 70], "integer"), [1, 2 ** 70])
+        self.assertEqual(encode_column([1, 2], "float"), array.array("d", [1.0, 2.0]))
+        self.assertEqual(encode_column([{}, {}], "string"), [{}, {}])
+        self.assertIsNone(dictionary_encode(["a", "b", "c"]))
+
+        column = dictionary_encode(["b", "a", "b", "b"])
+        self.assertEqual(len(column), 4)
+        self.assertEqual(column[1], "a")
+        self.assertEqual(column.to_list(), ["b", "a", "b", "b"])
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy(self):
+        events = run_columns(DSM_MODEL, use_numpy=True, input=INPUT_DATA)["events"]
+        self.assertIsInstance(events["id"], numpy.ndarray)
+        self.assertEqual(events["id"].tolist(), list(range(6)))
+
+
+TIMESERIES_MODEL = {
+    "type": "list",
+    "source": {"type": "dn_lookup_loop", "source": "input", "dn": "points"},
+    "items": [
+        {"type": "string", "source": {"type": "index", "index": 0, "postformat": {"type": "int_to_iso_timestamp"}}},
+        {"type": "float", "source": {"type": "yield", "index": 1}},
+    ]
+}
+
+
+class TestPositionalItems(unittest.TestCase):
+
+    def test_detected(self):
+        self.assertEqual([i for i, _, _ in prepare_model_for_run(TIMESERIES_MODEL).positional], [0, 1])
+
+        dsm_model = {**TIMESERIES_MODEL, "items": [{"type": "string", "source": {"type": "json_key_item", "dn": "a"}}]}
+        self.assertIsNone(prepare_model_for_run(dsm_model).positional)
+
+    def test_same_rows(self):
+        points = [[1585234800000 + i * 1500, i / 3] for i in range(10000)]
+        result = run_detail(TIMESERIES_MODEL, input={"points": points})
+        self.assertEqual(len(result), 10000)
+        self.assertEqual(result[1], [run_detail(TIMESERIES_MODEL, input={"points": points[1:2]})[0][0], 1 / 3])
+
+    def test_errors_per_row(self):
+        with self.assertRaises(IndexError):
+            run_detail(TIMESERIES_MODEL, input={"points": [[1585234800000, 1], [1585234800000]]})
+        with self.assertRaisesRegex(ValueError, "invalid literal"):
+            run_detail(TIMESERIES_MODEL, input={"points": [[1585234800000, 1], ["x", 2]]})
+
+        dsm_model = {**TIMESERIES_MODEL, "items": [{"type": "string", "source": {"type": "index", "index": 0, "postformat": {"type": "int_to_iso_timestamp", "fail-silent": True}}}]}
+        self.assertEqual(run_detail(dsm_model, input={"points": [["x"]]}), [["x"]])
+
+    @unittest.skipIf(numpy is None or time.timezone != 0 or time.daylight, "needs numpy and local time in UTC")
+    def test_numpy_int_to_iso_timestamp(self):
+        self.assertEqual(
+            numpy_int_to_iso_timestamp([1585234800000, 1585234800123, "1585234800001"]),
+            ["2020-03-26T15:00:00", "2020-03-26T15:00:00.123000", "2020-03-26T15:00:00.001000"],
+        )
+        with self.assertRaises(ValueError):
+            numpy_int_to_iso_timestamp([2 ** 62])
+
+
+if __name__ == "__main__":
+    unittest.main()
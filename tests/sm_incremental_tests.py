@@ -0,0 +1,233 @@
+import os
+import sys
+import copy
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+from semantic_model import run_detail, get_data, SOURCE_FUNC, InvalidModel
+from sm_incremental import IncrementalRunner, apply_patch, diff, parse_pointer, to_pointer, SOURCE_READS
+
+
+INPUT_DATA = {
+    "meta": {"name": "export", "tag": "a"},
+    "rows": [{"id": 1}, {"id": 2}],
+    "other": [1, 2],
+}
+
+CALLS = []
+
+
+def counted(gather_args, model, dn_parent, storage):
+    CALLS.append(dn_parent)
+    return get_data(gather_args, model, dn_parent, storage).get(gather_args["dn"])
+
+
+DSM_MODEL = {
+    "type": "dict",
+    "nested": {
+        "name": {"type": "string", "source": {"type": "get_from_source", "source": "input", "dn": "meta.name"}},
+        "tag": {"type": "string", "source": {"type": "counted", "source": "input", "dn": "meta"}},
+        "static": {"type": "string", "source": {"type": "counted", "dn": "meta"}},
+        "inner": {
+            "type": "dict",
+            "nested": {
+                "ids": {
+                    "type": "list",
+                    "source": {"type": "dn_lookup_loop", "source": "input", "dn": "rows"},
+                    "nested": {
+                        "id": {"type": "integer", "source": {"type": "json_key_item", "dn": "id"}},
+                        "name": {"type": "string", "source": {"type": "counted", "source": "input", "dn": "meta"}},
+                    }
+                },
+                "other": {"type": "list", "source": {"type": "dn_lookup_loop", "source": "input", "dn": "other"}, "item": {"type": "integer"}},
+            }
+        },
+    }
+}
+
+
+class TestApplyPatch(unittest.TestCase):
+
+    def test_operations(self):
+        document = copy.deepcopy(INPUT_DATA)
+        patch = [
+            {"op": "add", "path": "/rows/-", "value": {"id": 3}},
+            {"op": "add", "path": "/rows/0", "value": {"id": 0}},
+            {"op": "remove", "path": "/other/0"},
+            {"op": "replace", "path": "/meta/name", "value": "new"},
+            {"op": "move", "from": "/meta/tag", "path": "/tag"},
+            {"op": "copy", "from": "/rows/1", "path": "/first"},
+            {"op": "test", "path": "/first/id", "value": 1},
+        ]
+        self.assertEqual(apply_patch(document, patch), {
+            "meta": {"name": "new"},
+            "rows": [{"id": 0}, {"id": 1}, {"id": 2}, {"id": 3}],
+            "other": [2],
+            "tag": "a",
+            "first": {"id": 1},
+        })
+        self.assertEqual(document, INPUT_DATA)
+        self.assertEqual(apply_patch(document, [{"op": "replace", "path": "", "value": [1]}]), [1])
+
+    def test_invalid(self):
+        for operation in [
+            {"op": "replace", "path": "/missing", "value": 1},
+            {"op": "remove", "path": "/rows/2"},
+            {"op": "add", "path": "/rows/01", "value": 1},
+            {"op": "add", "path": "/meta/name/x", "value": 1},
+            {"op": "test", "path": "/meta/name", "value": "other"},
+            {"op": "move", "from": "/meta", "path": "/meta/inner"},
+            {"op": "missing", "path": "/meta"},
+            {"op": "add", "path": "meta", "value": 1},
+        ]:
+            with self.assertRaises((ValueError, KeyError, IndexError), msg=operation):
+                apply_patch(INPUT_DATA, [operation])
+
+    def test_pointer(self):
+        self.assertEqual(parse_pointer("/a~1b/~0c/0"), ("a/b", "~c", "0"))
+        self.assertEqual(to_pointer(("a/b", "~c", 0)), "/a~1b/~0c/0")
+        self.assertEqual(parse_pointer(""), ())
+
+    def test_diff(self):
+        old = {"a": [1, 2, 3], "b": {"c": 1}, "d": 1}
+        for new in [
+            {"a": [1, 2], "b": {"c": 2, "e": [1]}},
+            {"a": [1, 5, 3, 4, 5], "b": [], "d": 1.5},
+            old,
+        ]:
+            self.assertEqual(apply_patch(old, diff(old, new)), new)
+        self.assertEqual(diff(old, copy.deepcopy(old)), [])
+        self.assertEqual(diff(old, {**old, "d": 2}), [{"op": "replace", "path": "/d", "value": 2}])
+
+
+class TestIncrementalRunner(unittest.TestCase):
+
+    def setUp(self):
+        SOURCE_FUNC["counted"] = counted
+        SOURCE_READS[counted] = lambda gather_args: [(gather_args["dn"],)]
+        CALLS.clear()
+
+    def tearDown(self):
+        SOURCE_FUNC.pop("counted")
+        SOURCE_READS.pop(counted, None)
+
+    def test_same_as_run_detail(self):
+        runner = IncrementalRunner(DSM_MODEL, input=INPUT_DATA)
+        self.assertEqual(runner.result, run_detail(DSM_MODEL, input=INPUT_DATA))
+
+        document = INPUT_DATA
+        for patch in [
+            [{"op": "add", "path": "/rows/-", "value": {"id": 3}}],
+            [{"op": "replace", "path": "/meta/tag", "value": "b"}, {"op": "remove", "path": "/rows/0"}],
+            [{"op": "replace", "path": "/other", "value": [5]}],
+            [{"op": "replace", "path": "", "value": {"meta": {"name": "x", "tag": "y"}, "rows": [], "other": []}}],
+        ]:
+            old = runner.result
+            old_copy = copy.deepcopy(old)
+            document = apply_patch(document, patch)
+            result, output_patch = runner.apply(patch)
+            self.assertEqual(result, run_detail(DSM_MODEL, input=document))
+            self.assertEqual(apply_patch(old, output_patch), result)
+            self.assertEqual(old, old_copy)
+        self.assertEqual(INPUT_DATA["rows"], [{"id": 1}, {"id": 2}])
+
+    def test_only_changed_parts(self):
+        runner = IncrementalRunner(DSM_MODEL, input=INPUT_DATA)
+        CALLS.clear()
+
+        result, output_patch = runner.apply([{"op": "replace", "path": "/other/1", "value": 3}])
+        self.assertEqual(output_patch, [{"op": "replace", "path": "/inner/other/1", "value": 3}])
+        self.assertEqual(CALLS, [])
+
+        result, output_patch = runner.apply([{"op": "replace", "path": "/meta/name", "value": "new"}])
+        self.assertEqual(output_patch, [
+            {"op": "replace", "path": "/name", "value": "new"},
+            {"op": "replace", "path": "/tag/name", "value": "new"},
+            {"op": "replace", "path": "/inner/ids/0/name/name", "value": "new"},
+            {"op": "replace", "path": "/inner/ids/1/name/name", "value": "new"},
+        ])
+        self.assertEqual(CALLS, [("tag",), ("inner", "ids", "name"), ("inner", "ids", "name")])
+
+        CALLS.clear()
+        result, output_patch = runner.apply([{"op": "add", "path": "/unused", "value": 1}])
+        self.assertEqual((output_patch, CALLS), ([], []))
+        self.assertEqual(result, run_detail(DSM_MODEL, input={**INPUT_DATA, "meta": {"name": "new", "tag": "a"}, "other": [1, 3], "unused": 1}))
+
+    def test_depends_on(self):
+        dsm_model = {
+            "type": "dict",
+            "nested": {
+                "name": {"type": "string", "source": {"type": "get_from_source", "source": "input", "dn": "meta.name"}},
+                "version": {
+                    "type": "string",
+                    "source": {"type": "counted", "dn": "meta"},
+                    "depends_on": [{"source": "input", "dn": "meta.tag"}],
+                },
+                "after_name": {"type": "string", "source": {"type": "counted", "dn": "meta"}, "depends_on": "name"},
+            }
+        }
+        runner = IncrementalRunner(dsm_model, input=INPUT_DATA)
+        CALLS.clear()
+        runner.apply([{"op": "replace", "path": "/meta/tag", "value": "b"}])
+        self.assertEqual(CALLS, [("version",)])
+
+        CALLS.clear()
+        runner.apply([{"op": "replace", "path": "/meta/name", "value": "new"}])
+        self.assertEqual(CALLS, [("after_name",)])
+
+        with self.assertRaisesRegex(InvalidModel, "Invalid depends_on"):
+            IncrementalRunner({**dsm_model, "nested": {"name": {**dsm_model["nested"]["name"], "depends_on": [1]}}}, input=INPUT_DATA)
+
+    def test_context_data(self):
+        # last has no source argument, it reads the last row of the list before it
+        dsm_model = {
+            "type": "dict",
+            "nested": {
+                "rows": {
+                    "type": "list",
+                    "source": {"type": "dn_lookup_loop", "source": "input", "dn": "rows"},
+                    "nested": {"id": {"type": "integer", "source": {"type": "json_key_item", "dn": "id"}}},
+                },
+                "name": {"type": "string", "source": {"type": "get_from_source", "source": "input", "dn": "meta.name"}},
+                "last": {"type": "integer", "source": {"type": "json_key_item", "dn": "id", "default": None}},
+                "tag": {"type": "object", "source": {"type": "counted", "dn": "tag"}},
+            }
+        }
+        runner = IncrementalRunner(dsm_model, input=INPUT_DATA)
+        self.assertEqual(runner.result, run_detail(dsm_model, input=INPUT_DATA))
+
+        document = INPUT_DATA
+        for patch in [
+            [{"op": "replace", "path": "/rows/1/id", "value": 9}],
+            [{"op": "add", "path": "/rows/-", "value": {"id": 3, "tag": "x"}}],
+            [{"op": "replace", "path": "/rows", "value": []}],
+        ]:
+            document = apply_patch(document, patch)
+            result, _ = runner.apply(patch)
+            self.assertEqual(result, run_detail(dsm_model, input=document))
+
+        CALLS.clear()
+        runner.apply([{"op": "replace", "path": "/meta/name", "value": "new"}])
+        self.assertEqual(CALLS, [])
+
+    def test_unknown_source_reads_everything(self):
+        SOURCE_READS.pop(counted)
+        runner = IncrementalRunner(DSM_MODEL, input=INPUT_DATA)
+        CALLS.clear()
+        runner.apply([{"op": "replace", "path": "/other/1", "value": 3}])
+        self.assertEqual(CALLS, [("tag",), ("static",), ("inner", "ids", "name"), ("inner", "ids", "name")])
+
+    def test_invalid_patch(self):
+        runner = IncrementalRunner(DSM_MODEL, input=INPUT_DATA)
+        result = runner.result
+        with self.assertRaises(KeyError):
+            runner.apply([{"op": "replace", "path": "/other/1", "value": 3}, {"op": "replace", "path": "/missing", "value": 1}])
+        self.assertIs(runner.result, result)
+        self.assertIs(runner.input_data["input"], INPUT_DATA)
+        with self.assertRaises(ValueError):
+            runner.apply([], input_name="missing")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+from semantic_model import iter_by_key, iter_by_prop, iter_by_prop2, run_detail, ID_FORMAT, InvalidModel
+from sm_join import KeyJoin, SpilledKeyJoin, RowView, pivot, pivot_sorted
+from sm_json import JsonStream, JsonDocument
+
+
+INPUT_DATA = {
+    "series": [
+        {"name": "apple", "values": {"id_1": 1, "id_2": 2, "id_3": 3}},
+        {"name": "banana", "values": {"id_1": 4, "id_3": 6}},
+        {"name": "citrus", "values": {"id_2": 8}},
+        {"name": "banana", "values": {"id_2": 10}},
+        {"name": "durian"},
+    ]
+}
+
+EXPECTED = [
+    {"apple": 1, "banana": None, "citrus": None, "durian": None},
+    {"apple": 2, "banana": 10, "citrus": 8, "durian": None},
+    {"apple": 3, "banana": None, "citrus": None, "durian": None},
+]
+
+GATHER_ARGS = {"type": "iter_by_key", "source": "input", "dn_data_source": "series", "key": "name", "dn_to_ids": "[0].values", "dn_to_values": "values"}
+
+
+def run(input_data, **gather_args):
+    return list(iter_by_key({**GATHER_ARGS, **gather_args}, model={}, dn_parent=("ok",), storage={"input": {"input": input_data}}))
+
+
+class TestKeyJoin(unittest.TestCase):
+
+    def test_rows(self):
+        for block_size in [1, 2, 4096]:
+            self.assertEqual(run(INPUT_DATA, block_size=block_size), EXPECTED)
+            self.assertEqual(run(INPUT_DATA, block_size=block_size, spill=True), EXPECTED)
+
+    def test_row_formats(self):
+        self.assertEqual(run(INPUT_DATA, row_format="tuple"), [tuple(row.values()) for row in EXPECTED])
+        self.assertEqual(run(INPUT_DATA, row_format="columns", block_size=2), [
+            {"apple": [1, 2], "banana": [None, 10], "citrus": [None, 8], "durian": [None, None]},
+            {"apple": [3], "banana": [None], "citrus": [None], "durian": [None]},
+        ])
+        with self.assertRaises(ValueError):
+            run(INPUT_DATA, row_format="rows")
+
+    def test_select(self):
+        self.assertEqual(run(INPUT_DATA, select=["citrus", "apple"]), [{"apple": row["apple"], "citrus": row["citrus"]} for row in EXPECTED])
+        self.assertEqual(run(INPUT_DATA, select=[], row_format="tuple"), [(), (), ()])
+
+    def test_duplicate_ids(self):
+        ids = ["id_2", "id_1", "id_2"]
+        for join_class in [KeyJoin, SpilledKeyJoin]:
+            join = join_class(ids, block_size=2).index(INPUT_DATA["series"], "name", lambda item: (True, item.get("values", {})))
+            self.assertEqual(list(join.iter_rows("tuple")), [(2, 10, 8, None), (1, None, None, None), (2, 10, 8, None)])
+
+    def test_spill_partitions(self):
+        ids = [f"id_{i % 3}" for i in range(50)]
+        items = INPUT_DATA["series"] + [{"name": "apple", "values": {"id_0": 5}}]
+        expected = list(KeyJoin(ids, block_size=4).index(items, "name", lambda item: (True, item.get("values", {}))).iter_rows("tuple"))
+
+        join = SpilledKeyJoin(ids, block_size=4, partitions=3).index(items, "name", lambda item: (True, item.get("values", {})))
+        # 13 blocks over 3 files
+        self.assertEqual((len(join.files), len(join.offsets)), (3, 13))
+        self.assertEqual(list(join.iter_rows("tuple")), expected)
+        self.assertTrue(all(f.closed for f in join.files))
+
+        self.assertEqual(run(INPUT_DATA, spill=True, block_size=1, partitions=2), EXPECTED)
+
+    def test_lazy_input(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "input.json")
+            with open(path, "w") as f:
+                json.dump(INPUT_DATA, f)
+
+            for input_data in [JsonStream(path, chunk_size=7), JsonDocument(path)]:
+                self.assertEqual(run(input_data), EXPECTED)
+                self.assertEqual(run(input_data, spill=True, block_size=2), EXPECTED)
+
+            with open(path, "w") as f:
+                json.dump(INPUT_DATA["series"], f)
+            self.assertEqual(run(JsonStream(path), dn_data_source=None), EXPECTED)
+
+    def test_filter(self):
+        seen = []
+
+        def reject(row):
+            seen.append(type(row))
+            return row.get("banana") is None
+
+        self.assertEqual(run(INPUT_DATA, filter=reject), [EXPECTED[1]])
+        self.assertEqual(set(seen), {RowView})
+        self.assertEqual(run(INPUT_DATA, filter=reject, row_format="tuple"), [tuple(EXPECTED[1].values())])
+        self.assertEqual(run(INPUT_DATA, filter=reject, row_format="tuple", block_size=1, spill=True), [tuple(EXPECTED[1].values())])
+        self.assertEqual(set(seen), {RowView})
+        with self.assertRaises(ValueError):
+            run(INPUT_DATA, filter=reject, row_format="columns")
+
+        view = RowView({"apple": 0, "banana": 1}, (1, None))
+        self.assertEqual(view.load(), {"apple": 1, "banana": None})
+        self.assertEqual(dict(view.items()), view.load())
+        self.assertEqual((view["apple"], view.get("citrus", 5), "banana" in view, len(view)), (1, 5, True, 2))
+
+    def test_filter_in_model(self):
+        dsm_model = {
+            "type": "list",
+            "source": {**GATHER_ARGS, "filter": {"or": [{"type": "eq", "dn": "banana", "value": None}, {"type": "contains", "arg": "durian"}]}},
+            "item": {"type": "object"},
+        }
+        self.assertEqual(run_detail(dsm_model, input=INPUT_DATA), [])
+
+        dsm_model = {**dsm_model, "source": {**GATHER_ARGS, "filter": {"type": "in", "dn": "apple", "values": [1, 3]}}}
+        self.assertEqual(run_detail(dsm_model, input=INPUT_DATA), [EXPECTED[1]])
+
+        dsm_model = {**dsm_model, "source": {**dsm_model["source"], "row_format": "tuple"}}
+        self.assertEqual(run_detail(dsm_model, input=INPUT_DATA), [tuple(EXPECTED[1].values())])
+
+        dsm_model = {**dsm_model, "source": {**dsm_model["source"], "row_format": "columns"}}
+        with self.assertRaisesRegex(InvalidModel, "row format columns"):
+            run_detail(dsm_model, input=INPUT_DATA)
+
+    def test_in_model(self):
+        dsm_model = {
+            "type": "list",
+            "source": {**GATHER_ARGS, "row_format": "tuple", "select": ["apple", "citrus"]},
+            "items": [
+                {"type": "integer", "source": {"type": "index", "index": 0}},
+                {"type": "integer", "source": {"type": "index", "index": 1}},
+            ]
+        }
+        self.assertEqual(run_detail(dsm_model, input=INPUT_DATA), [[1, None], [2, 8], [3, None]])
+
+
+PIVOT_DATA = {
+    "metrics": {
+        "cpu": [{"meta": {"id": "a"}, "value": 1}, {"meta": {"id": "c"}, "value": 2}, {"meta": {"id": "b"}, "value": 3}],
+        "memory": [{"meta": {"id": "b"}, "value": 4}, {"meta": {"id": "d"}, "value": 5}, {"value": 6}],
+        "disk": [{"meta": {"id": "a"}}, {"meta": {"id": "c"}, "value": 7}, {"meta": {"id": "c"}, "value": 8}],
+    }
+}
+
+PIVOT_EXPECTED = [
+    {"cpu": 1, "disk": {}, "id": "a"},
+    {"cpu": 2, "disk": 8, "id": "c"},
+    {"cpu": 3, "memory": 4, "id": "b"},
+    {"memory": 5, "id": "d"},
+]
+
+PIVOT_ARGS = {"source": "input", "dn_data_source": "metrics", "dn_to_id": "meta.id", "dn_to_value": "value"}
+
+
+def run_pivot(input_data, source=iter_by_prop, **gather_args):
+    return list(source({**PIVOT_ARGS, **gather_args}, model={}, dn_parent=("ok",), storage={"input": {"input": input_data}}))
+
+
+class TestPivot(unittest.TestCase):
+
+    def setUp(self):
+        self.input_data = json.loads(json.dumps(PIVOT_DATA))
+        # an id of {} can't be pivoted
+        self.input_data["metrics"]["memory"].pop()
+
+    def test_pivot(self):
+        self.assertEqual(run_pivot(self.input_data), PIVOT_EXPECTED)
+        with self.assertRaises(TypeError):
+            run_pivot(PIVOT_DATA)
+
+    def test_spill(self):
+        expected = run_pivot(self.input_data)
+        for max_ids in [0, 1, 2, 3]:
+            for partitions in [1, 2, 5]:
+                result = run_pivot(self.input_data, max_ids=max_ids, partitions=partitions)
+                self.assertEqual([list(row.items()) for row in result], [list(row.items()) for row in expected])
+
+    def test_sorted(self):
+        for items in self.input_data["metrics"].values():
+            items.sort(key=lambda element: element["meta"]["id"])
+        expected = sorted(run_pivot(self.input_data), key=lambda row: row["id"])
+        result = run_pivot(self.input_data, sorted=True)
+        self.assertEqual([list(row.items()) for row in result], [list(row.items()) for row in expected])
+
+        self.input_data["metrics"]["cpu"].reverse()
+        with self.assertRaisesRegex(ValueError, "not sorted"):
+            run_pivot(self.input_data, sorted=True)
+
+    def test_id_format(self):
+        input_data = {"metrics": {"cpu": [{"meta": {"id": "0.1.2.3.4.5.6.7.8.9.10.11"}, "value": 1}]}}
+        self.assertEqual(run_pivot(input_data, source=iter_by_prop2), [{"cpu": 1, "id": "(7.8.9.10,2.3.4.5)"}])
+
+        ID_FORMAT["upper"] = str.upper
+        try:
+            self.assertEqual(run_pivot(self.input_data, id_format="upper")[0]["id"], "A")
+        finally:
+            ID_FORMAT.pop("upper")
+        with self.assertRaises(ValueError):
+            run_pivot(self.input_data, id_format="missing")
+
+    def test_lazy_input(self):
+        expected = run_pivot(self.input_data)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "input.json")
+            with open(path, "w") as f:
+                json.dump(self.input_data, f)
+            for input_data in [JsonStream(path, chunk_size=7), JsonDocument(path)]:
+                self.assertEqual(run_pivot(input_data), expected)
+
+    def test_engines(self):
+        elements = [("b", "x", 1), ("a", "x", 2), ("b", "y", 3), ("b", "x", 4)]
+        expected = [("b", {"x": 4, "y": 3}), ("a", {"x": 2})]
+        self.assertEqual(list(pivot(elements)), expected)
+        self.assertEqual(list(pivot(elements, max_ids=1, partitions=3)), expected)
+        self.assertEqual(list(pivot_sorted([("x", [("a", 2), ("b", 1), ("b", 4)]), ("y", [("b", 3)])])), sorted(expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
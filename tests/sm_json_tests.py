@@ -0,0 +1,349 @@
+import os
+import sys
+import json
+import io
+import tempfile
+import unittest
+import subprocess
+import importlib.util
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+from sm_json import JsonStream, JsonDocument, JsonWriter, iter_json_lines, write_json_lines, JSON_BACKENDS, get_json_backend, get_output_backend, set_json_backend
+from semantic_model import get_by_dn, yield_by_dn, run_detail, run_list, run_detail_json, run_list_json, run_detail_to, SOURCE_FUNC
+
+
+INPUT_DATA = {
+    "meta": {"name": "export", "tags": ["a", "b"]},
+    "rows": [
+        {"id": 1, "value": -2.5e10, "name": "first \"quoted\" ]}"},
+        {"id": 2, "value": 12345678901, "name": "ünïcode"},
+        {"id": 3, "value": None, "name": ""},
+    ],
+}
+
+
+class TestJsonStream(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "input.json")
+        with open(self.path, "w") as f:
+            json.dump(INPUT_DATA, f, indent=1)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_yield_by_dn(self):
+        for chunk_size in [1, 3, 7, 1024]:
+            stream = JsonStream(self.path, chunk_size=chunk_size)
+            self.assertEqual(list(yield_by_dn(stream, "rows")), INPUT_DATA["rows"])
+            self.assertEqual(list(yield_by_dn(stream, "meta.tags")), ["a", "b"])
+
+    def test_get_by_dn(self):
+        stream = JsonStream(self.path, chunk_size=5)
+        for dn in ["meta.name", "rows.[1].value", "rows.[2].name", "rows.[3]", "meta.missing", "meta.name.[0]", "rows.id"]:
+            self.assertEqual(get_by_dn(stream, dn), get_by_dn(INPUT_DATA, dn), dn)
+
+    def test_run_detail(self):
+        dsm_model = {
+            "type": "dict",
+            "nested": {
+                "name": {"type": "string", "source": {"type": "get_from_source", "source": "input", "dn": "meta.name"}},
+                "rows": {
+                    "type": "list",
+                    "source": {"type": "dn_lookup_loop", "source": "input", "dn": "rows"},
+                    "nested": {
+                        "id": {"type": "integer", "source": {"type": "json_key_item", "dn": "id"}},
+                    }
+                },
+                "tags": {
+                    "type": "list",
+                    "source": {"type": "json_key", "source": "input", "dn": "meta", "multi": True},
+                    "item": {"type": "string"},
+                },
+            }
+        }
+        expected = run_detail(dsm_model, input=INPUT_DATA)
+        self.assertEqual(run_detail(dsm_model, input=JsonStream(self.path, chunk_size=4)), expected)
+
+        model_path = os.path.join(self.directory.name, "sm_model.json")
+        with open(model_path, "w") as f:
+            json.dump(dsm_model, f)
+        self.assertEqual(run_detail_json(model_path, input_format="stream", input=self.path), expected)
+
+    def test_loaded_once_per_run(self):
+        loads = []
+        stream = JsonStream(self.path)
+        load = stream.load
+        stream.load = lambda: loads.append(1) or load()
+
+        dsm_model = {
+            "type": "dict",
+            "nested": {
+                key: {"type": "object", "source": {"type": "json_key_item", "source": "input", "dn": key}}
+                for key in ["meta", "rows"]
+            }
+        }
+        self.assertEqual(run_detail(dsm_model, input=stream), {"meta": INPUT_DATA["meta"], "rows": INPUT_DATA["rows"]})
+        self.assertEqual(len(loads), 1)
+        run_detail(dsm_model, input=stream)
+        self.assertEqual(len(loads), 2)
+
+    def test_key_lookup(self):
+        dsm_model = {"type": "object", "source": {"type": "key_lookup", "source": "input", "key": "meta"}}
+        self.assertEqual(run_detail(dsm_model, input=JsonStream(self.path)), INPUT_DATA["meta"])
+
+
+class TestJsonDocument(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "input.json")
+        with open(self.path, "w") as f:
+            json.dump(INPUT_DATA, f, indent=1)
+        self.document = JsonDocument(self.path)
+
+    def tearDown(self):
+        self.document.close()
+        self.directory.cleanup()
+
+    def test_get_by_dn(self):
+        for dn in ["meta.name", "rows.[1].value", "rows.[2].name", "rows.[3]", "meta.missing", "meta.name.[0]", "rows.id", "rows..id"]:
+            self.assertEqual(get_by_dn(self.document, dn), get_by_dn(INPUT_DATA, dn), dn)
+
+    def test_yield_by_dn(self):
+        self.assertEqual(list(yield_by_dn(self.document, "rows")), INPUT_DATA["rows"])
+        self.assertEqual(list(yield_by_dn(self.document, "meta")), ["name", "tags"])
+        self.assertEqual(list(yield_by_dn(self.document, "missing")), [])
+
+    def test_read_like_dict(self):
+        self.assertEqual(self.document["meta"], INPUT_DATA["meta"])
+        self.assertEqual(self.document.get("missing", 1), 1)
+        self.assertIn("rows", self.document)
+        self.assertEqual(list(self.document), ["meta", "rows"])
+        with self.assertRaises(KeyError):
+            self.document["missing"]
+
+    def test_only_reached_values_indexed(self):
+        get_by_dn(self.document, "rows.[1].name")
+        self.assertEqual(len(self.document.children), 3)
+
+    def test_deep_nesting(self):
+        deep = {"a": [[[[[[{"b": [1, {"c": "]"}]}]]]]]], "d": 2}
+        with open(self.path, "w") as f:
+            json.dump(deep, f)
+        document = JsonDocument(self.path)
+        self.assertEqual(get_by_dn(document, "d"), (True, 2))
+        self.assertEqual(get_by_dn(document, "a.[0].[0].[0].[0].[0].[0].b.[1].c"), (True, "]"))
+        document.close()
+
+    def test_run_detail(self):
+        dsm_model = TestJsonWriter.dsm_model
+        expected = run_detail(dsm_model, input=INPUT_DATA)
+        self.assertEqual(run_detail(dsm_model, input=self.document), expected)
+
+        model_path = os.path.join(self.directory.name, "sm_model.json")
+        with open(model_path, "w") as f:
+            json.dump(dsm_model, f)
+        self.assertEqual(run_detail_json(model_path, input_format="mmap", input=self.path), expected)
+
+
+class TestJsonWriter(unittest.TestCase):
+
+    dsm_model = {
+        "type": "dict",
+        "nested": {
+            "name": {"type": "string", "source": {"type": "get_from_source", "source": "input", "dn": "meta.name"}},
+            "meta": {"type": "object", "source": {"type": "json_key_item", "source": "input", "dn": "meta"}},
+            "rows": {
+                "type": "list",
+                "source": {"type": "dn_lookup_loop", "source": "input", "dn": "rows"},
+                "nested": {
+                    "id": {"type": "integer", "source": {"type": "json_key_item", "dn": "id"}},
+                    "name": {"type": "string", "source": {"type": "json_key_item", "dn": "name"}},
+                }
+            },
+            "empty": {
+                "type": "list",
+                "source": {"type": "dn_lookup_loop", "source": "input", "dn": "missing"},
+                "item": {"type": "string"},
+            },
+        }
+    }
+
+    def test_same_as_json_dumps(self):
+        expected = run_detail(self.dsm_model, input=INPUT_DATA)
+        for name, backend in JSON_BACKENDS.items():
+            for indent in [None, 2, 4]:
+                fp = io.StringIO()
+                run_detail_to(self.dsm_model, fp, indent=indent, json_backend=name, input=INPUT_DATA)
+                self.assertEqual(fp.getvalue(), backend.dumps(expected, indent=indent), (name, indent))
+        fp = io.StringIO()
+        run_detail_to(self.dsm_model, fp, indent=2, json_backend="json", input=INPUT_DATA)
+        self.assertEqual(fp.getvalue(), json.dumps(expected, indent=2))
+
+    def test_written_while_produced(self):
+        fp = io.StringIO()
+        written = []
+
+        def rows(gather_args, model, dn_parent, storage):
+            for i in range(3):
+                written.append(len(fp.getvalue()))
+                yield i
+
+        SOURCE_FUNC["test_rows"] = rows
+        try:
+            dsm_model = {"type": "list", "source": {"type": "test_rows"}, "item": {"type": "integer"}}
+            run_detail_to(dsm_model, fp, json_backend="json")
+        finally:
+            SOURCE_FUNC.pop("test_rows")
+
+        self.assertEqual(fp.getvalue(), "[0, 1, 2]")
+        self.assertEqual(written, [1, 2, 5])
+
+    def test_events(self):
+        fp = io.StringIO()
+        writer = JsonWriter(fp, indent=2)
+        writer.start_dict()
+        writer.key("a")
+        writer.start_list()
+        writer.value({"b": [1, 2]})
+        writer.start_list()
+        writer.end_list()
+        writer.end_list()
+        writer.key("c")
+        writer.value(None)
+        writer.end_dict()
+        self.assertEqual(fp.getvalue(), json.dumps({"a": [{"b": [1, 2]}, []], "c": None}, indent=2))
+
+
+class TestJsonLines(unittest.TestCase):
+
+    dsm_model = {
+        "type": "list",
+        "source": {"type": "dn_lookup_loop", "source": "input", "dn": "rows"},
+        "nested": {
+            "id": {"type": "integer", "source": {"type": "json_key_item", "dn": "id"}},
+            "name": {"type": "string", "source": {"type": "json_key_item", "dn": "name"}},
+        }
+    }
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.model_path = os.path.join(self.directory.name, "sm_model.json")
+        with open(self.model_path, "w") as f:
+            json.dump(self.dsm_model, f)
+
+        self.documents = [INPUT_DATA, {"rows": []}, {"rows": INPUT_DATA["rows"][:1]}]
+        self.path = os.path.join(self.directory.name, "input.ndjson")
+        with open(self.path, "w") as f:
+            write_json_lines(f, self.documents)
+            f.write("\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_roundtrip(self):
+        with open(self.path) as f:
+            self.assertEqual(list(iter_json_lines(f)), self.documents)
+
+    def test_run_per_line(self):
+        expected = [run_detail(self.dsm_model, input=document) for document in self.documents]
+        self.assertEqual(list(run_detail_json(self.model_path, input_format="ndjson", input=self.path)), expected)
+
+        expected = [item for document in self.documents for item in run_list(self.dsm_model, input=document)]
+        self.assertEqual(list(run_list_json(self.model_path, input_format="ndjson", input=self.path)), expected)
+
+    @unittest.skipUnless(importlib.util.find_spec("data"), "the cli imports one_to_one, that needs the data module")
+    def test_cli_stdin(self):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "semantic_model.py")
+        with open(self.path, "rb") as f:
+            process = subprocess.run(
+                [sys.executable, script, "-mode", "list", "-input", "-", "-sm", self.model_path, "-input-format", "ndjson", "-output", "ndjson"],
+                stdin=f, capture_output=True, check=True,
+            )
+        expected = [item for document in self.documents for item in run_list(self.dsm_model, input=document)]
+        self.assertEqual(list(iter_json_lines(io.StringIO(process.stdout.decode()))), json.loads(json.dumps(expected)))
+
+    def test_flush(self):
+        class Output(io.StringIO):
+            flushes = 0
+
+            def flush(self):
+                self.flushes += 1
+
+        fp = Output()
+        write_json_lines(fp, range(3), flush_interval=0)
+        self.assertEqual(fp.getvalue(), "0\n1\n2\n")
+        self.assertEqual(fp.flushes, 4)
+
+
+class TestJsonBackend(unittest.TestCase):
+
+    def tearDown(self):
+        set_json_backend(None)
+
+    def test_backends_read_and_write(self):
+        values = [INPUT_DATA, [], {"big": 2 ** 70, "float": 1.5}, "ünï"]
+        for name, backend in JSON_BACKENDS.items():
+            for value in values:
+                self.assertEqual(backend.loads(backend.dumps(value)), value, name)
+                self.assertEqual(backend.loads(backend.dumps(value, indent=4).encode()), value, name)
+                self.assertEqual(json.loads(backend.dumps(value, indent=2)), value, name)
+
+    def test_non_finite_floats(self):
+        value = {"nan": float("nan"), "list": [float("inf"), -float("inf"), None]}
+        for name, backend in JSON_BACKENDS.items():
+            for indent in [None, 2]:
+                self.assertEqual(backend.dumps(value, indent=indent), json.dumps(value, indent=indent), name)
+
+    def test_decode_error(self):
+        for name, backend in JSON_BACKENDS.items():
+            with self.assertRaises(json.JSONDecodeError):
+                backend.loads('{"a": ')
+
+    def test_select(self):
+        self.assertIn(get_json_backend().name, JSON_BACKENDS)
+        set_json_backend("json")
+        self.assertEqual(get_json_backend().name, "json")
+        self.assertEqual(get_json_backend("json"), JSON_BACKENDS["json"])
+        with self.assertRaises(ValueError):
+            set_json_backend("missing")
+        with self.assertRaises(ValueError):
+            get_json_backend("missing")
+
+    def test_output_default(self):
+        # the output is written by the json module unless a backend is picked
+        value = {"name": "Bøb", "rows": [1, 2]}
+        self.assertEqual(get_output_backend().name, "json")
+        fp = io.StringIO()
+        run_detail_to({"type": "object", "source": {"type": "return_value", "value": value}}, fp)
+        self.assertEqual(fp.getvalue(), json.dumps(value))
+        fp = io.StringIO()
+        write_json_lines(fp, [value])
+        self.assertEqual(fp.getvalue(), json.dumps(value) + "\n")
+
+        for name in JSON_BACKENDS:
+            set_json_backend(name)
+            self.assertEqual(get_output_backend().name, name)
+            self.assertEqual(get_output_backend("json").name, "json")
+
+    def test_run_with_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            model_path = os.path.join(directory, "sm_model.json")
+            with open(model_path, "w") as f:
+                json.dump(TestJsonWriter.dsm_model, f)
+            path = os.path.join(directory, "input.json")
+            with open(path, "w") as f:
+                json.dump(INPUT_DATA, f)
+
+            expected = run_detail(TestJsonWriter.dsm_model, input=INPUT_DATA)
+            for name in JSON_BACKENDS:
+                for input_format in ["json", "stream", "mmap"]:
+                    result = run_detail_json(model_path, input_format=input_format, json_backend=name, input=path)
+                    self.assertEqual(result, expected, (name, input_format))
+
+
+if __name__ == "__main__":
+    unittest.main()
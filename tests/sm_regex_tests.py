@@ -0,0 +1,30 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+from sm_regex import RegexSet, compile_regex
+
+
+class TestRegex(unittest.TestCase):
+
+    def test_compiled_once(self):
+        self.assertIs(compile_regex("[0-9]+"), compile_regex("[0-9]+"))
+
+    def test_regex_set_first_match(self):
+        patterns = {"nested": r"(x(y))z", "x": r"x", "number": r"[0-9]+", "any": r"."}
+        regex_set = RegexSet(patterns)
+        self.assertIsNotNone(regex_set.joined)
+        for value, expected in [("xyz", "nested"), ("xy", "x"), ("12", "number"), ("q", "any"), ("", None)]:
+            self.assertEqual(regex_set.match(value), expected, value)
+
+    def test_regex_set_not_joinable(self):
+        regex_set = RegexSet({"double": r"(x)\1", "x": r"(?i)x"})
+        self.assertIsNone(regex_set.joined)
+        self.assertEqual([regex_set.match(value) for value in ["xx", "X", "y"]], ["double", "x", None])
+        self.assertIsNone(RegexSet({}).match("x"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+from semantic_model import run_detail, get_data, SOURCE_FUNC, InvalidModel
+from sm_json import JsonDocument
+from sm_schedule import ScheduledRunner, run_detail_scheduled
+
+
+INPUT_DATA = {
+    "meta": {"name": "export", "tag": "a"},
+    "rows": [{"id": 1}, {"id": 2}],
+}
+
+EVENTS = []
+LOCK = threading.Lock()
+# values with the barrier argument wait until all of them are started
+BARRIER = threading.Barrier(8)
+
+
+def slow(gather_args, model, dn_parent, storage):
+    with LOCK:
+        EVENTS.append(("start", dn_parent))
+    if gather_args.get("barrier"):
+        BARRIER.wait(timeout=10)
+    time.sleep(gather_args.get("sleep", 0.05))
+    if gather_args.get("fail"):
+        raise ValueError(f"failed {dn_parent}")
+    with LOCK:
+        EVENTS.append(("end", dn_parent))
+    return get_data(gather_args, model, dn_parent, storage).get(gather_args["dn"])
+
+
+def slow_model(count, **extra):
+    return {
+        "type": "dict",
+        "nested": {
+            f"value_{i}": {"type": "object", "source": {"type": "slow", "source": "input", "dn": "meta", **extra}}
+            for i in range(count)
+        },
+    }
+
+
+class TestScheduledRunner(unittest.TestCase):
+
+    dsm_model = {
+        "type": "dict",
+        "nested": {
+            "name": {"type": "string", "source": {"type": "get_from_source", "source": "input", "dn": "meta.name"}},
+            "inner": {
+                "type": "dict",
+                "nested": {
+                    "ids": {
+                        "type": "list",
+                        "source": {"type": "dn_lookup_loop", "source": "input", "dn": "rows"},
+                        "nested": {
+                            "id": {"type": "integer", "source": {"type": "json_key_item", "dn": "id"}},
+                            "tag": {"type": "string", "source": {"type": "get_from_source", "source": "input", "dn": "meta.tag"}},
+                        }
+                    },
+                    "meta": {"type": "object", "source": {"type": "json_key_item", "source": "input", "dn": "meta"}},
+                },
+            },
+            "empty": {"type": "dict", "nested": {}},
+            "last": {"type": "string", "source": {"type": "return_value", "value": "x"}},
+        }
+    }
+
+    def setUp(self):
+        SOURCE_FUNC["slow"] = slow
+        EVENTS.clear()
+
+    def tearDown(self):
+        SOURCE_FUNC.pop("slow")
+
+    def test_same_as_run_detail(self):
+        expected = run_detail(self.dsm_model, input=INPUT_DATA)
+        result = run_detail_scheduled(self.dsm_model, input=INPUT_DATA)
+        self.assertEqual(result, expected)
+        self.assertEqual(json.dumps(result), json.dumps(expected))
+
+        with ScheduledRunner(self.dsm_model, roles=[]) as runner:
+            self.assertEqual(runner.detail(input=INPUT_DATA), run_detail(self.dsm_model, roles=[], input=INPUT_DATA))
+
+    def test_lazy_input(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "input.json")
+            with open(path, "w") as f:
+                json.dump(INPUT_DATA, f)
+            document = JsonDocument(path)
+            self.assertEqual(run_detail_scheduled(self.dsm_model, input=document), run_detail(self.dsm_model, input=INPUT_DATA))
+            document.close()
+
+    def test_parallel(self):
+        dsm_model = slow_model(8, barrier=True, sleep=0)
+        result = run_detail_scheduled(dsm_model, workers=8, input=INPUT_DATA)
+        # all values were started before the first one was done, the barrier breaks when they don't run at the same time
+        self.assertEqual([event for event, _ in EVENTS], ["start"] * 8 + ["end"] * 8)
+        self.assertEqual(list(result), [f"value_{i}" for i in range(8)])
+        self.assertEqual(result["value_7"], INPUT_DATA["meta"])
+
+    def test_depends_on(self):
+        dsm_model = slow_model(3)
+        dsm_model["nested"]["value_0"]["depends_on"] = ["value_2"]
+        dsm_model["nested"]["value_1"]["depends_on"] = ["value_0"]
+        run_detail_scheduled(dsm_model, input=INPUT_DATA)
+        self.assertEqual(EVENTS, [
+            ("start", ("value_2",)), ("end", ("value_2",)),
+            ("start", ("value_0",)), ("end", ("value_0",)),
+            ("start", ("value_1",)), ("end", ("value_1",)),
+        ])
+
+        dsm_model = slow_model(3)
+        for i in range(3):
+            dsm_model["nested"][f"value_{i}"]["depends_on"] = [f"value_{(i + 1) % 3}"]
+        with self.assertRaisesRegex(InvalidModel, "Cycle in depends_on"):
+            ScheduledRunner(dsm_model)
+
+    def test_context_data(self):
+        # last has no source argument, it reads the last row of the list before it
+        dsm_model = {
+            "type": "dict",
+            "nested": {
+                "rows": {
+                    "type": "list",
+                    "source": {"type": "dn_lookup_loop", "source": "input", "dn": "rows"},
+                    "nested": {"id": {"type": "integer", "source": {"type": "json_key_item", "dn": "id"}}},
+                },
+                "last": {"type": "integer", "source": {"type": "json_key_item", "dn": "id", "default": None}},
+                "row": {"type": "object", "source": {"type": "yield"}},
+                "name": {"type": "string", "source": {"type": "get_from_source", "source": "input", "dn": "meta.name"}},
+            }
+        }
+        for input_data in [INPUT_DATA, {**INPUT_DATA, "rows": []}]:
+            self.assertEqual(run_detail_scheduled(dsm_model, input=input_data), run_detail(dsm_model, input=input_data))
+
+        with ScheduledRunner(dsm_model) as runner:
+            self.assertEqual(runner.dependencies, [set(), {0}, {0}, set()])
+
+    def test_first_error(self):
+        dsm_model = slow_model(4)
+        dsm_model["nested"]["value_1"]["source"] = {**dsm_model["nested"]["value_1"]["source"], "fail": True, "sleep": 0.1}
+        dsm_model["nested"]["value_3"]["source"] = {**dsm_model["nested"]["value_3"]["source"], "fail": True, "sleep": 0}
+        with self.assertRaisesRegex(ValueError, r"failed \('value_1',\)"):
+            run_detail_scheduled(dsm_model, input=INPUT_DATA)
+
+
+if __name__ == "__main__":
+    unittest.main()
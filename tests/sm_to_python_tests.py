@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+from semantic_model import run_detail, run_list, run_nodes, InvalidModel
+from sm_to_python import generate_module, compile_model_file, load_model_module
+
+
+DSM_MODEL = {
+    "type": "dict",
+    "nested": {
+        "person": {
+            "type": "dict",
+            "nested": {
+                "name": {
+                    "title": "Name",
+                    "type": "string",
+                    "source": {"type": "json_key_item", "source": "input", "dn": "NAME"},
+                },
+                "age": {
+                    "type": "integer",
+                    "source": {"type": "get_from_source", "source": "input", "dn": "info.age", "default": 0},
+                },
+            }
+        },
+        "events": {
+            "type": "list",
+            "source": {"type": "dn_lookup_loop", "source": "input", "dn": "events"},
+            "nested": {
+                "id": {
+                    "type": "string",
+                    "source": {"type": "key_lookup", "dn": "id"},
+                },
+                "timestamp": {
+                    "type": "string",
+                    "source": {"type": "json_key_item", "dn": "ts", "postformat": {"type": "int_to_iso_timestamp"}},
+                },
+            }
+        },
+        "points": {
+            "type": "list",
+            "source": {"type": "dn_lookup_loop", "source": "input", "dn": "points"},
+            "items": [
+                {"type": "string", "source": {"type": "index", "index": 0}},
+                {"type": "float", "source": {"type": "yield", "index": 1}},
+            ]
+        },
+    }
+}
+
+INPUT_DATA = {
+    "NAME": "Bob",
+    "info": {"age": 23},
+    "events": [{"id": "a", "ts": 1585234800000}, {"id": "b", "ts": 1585234801000}],
+    "points": [["2020-03-26T15:00:00Z", 5164.23076923], ["2020-03-26T15:00:01Z", 5164.23076924]],
+}
+
+
+def load_source(source):
+    namespace = {}
+    exec(compile(source, "<sm_to_python>", "exec"), namespace)
+    return namespace
+
+
+class TestSmToPython(unittest.TestCase):
+
+    def test_detail(self):
+        module = load_source(generate_module(DSM_MODEL))
+        self.assertDictEqual(module["detail"](INPUT_DATA), run_detail(DSM_MODEL, input=INPUT_DATA))
+
+    def test_list(self):
+        module = load_source(generate_module(DSM_MODEL))
+        self.assertEqual(list(module["list"](INPUT_DATA)), list(run_list(DSM_MODEL, input=INPUT_DATA)))
+
+    def test_nodes(self):
+        dsm_model = {"type": "dict", "nested": {"person": DSM_MODEL["nested"]["person"]}}
+        module = load_source(generate_module(dsm_model))
+        self.assertEqual(list(module["nodes"](INPUT_DATA)), list(run_nodes(dsm_model, input=INPUT_DATA)))
+
+    def test_roles(self):
+        dsm_model = {
+            "type": "dict",
+            "nested": {
+                "name": {
+                    "type": "string",
+                    "rbac": {"user": {"read": True}},
+                    "source": {"type": "json_key_item", "source": "input", "dn": "NAME"},
+                },
+                "secret": {
+                    "type": "string",
+                    "rbac": {"admin": {"read": True}},
+                    "source": {"type": "json_key_item", "source": "input", "dn": "NAME"},
+                },
+            }
+        }
+        module = load_source(generate_module(dsm_model, roles=["user"]))
+        self.assertDictEqual(module["detail"](INPUT_DATA), {"name": "Bob"})
+
+    def test_missing_data(self):
+        module = load_source(generate_module(DSM_MODEL))
+        with self.assertRaisesRegex(InvalidModel, r"Missing data and default for source json_key_item with dn \('person', 'name'\)"):
+            module["detail"]({"events": [], "points": []})
+
+    def test_filter(self):
+        dsm_model = {
+            "type": "dict",
+            "nested": {
+                "events": {
+                    "type": "list",
+                    "source": {"type": "dn_lookup_loop", "source": "input", "dn": "events", "filter": {"type": "in", "dn": "type", "values": ["b"]}},
+                    "item": {"type": "object"},
+                },
+                "keys": {
+                    "type": "list",
+                    "source": {"type": "json_key", "source": "input", "dn": "tags", "multi": True, "filter": {"type": "contains", "arg": "b"}},
+                    "item": {"type": "string"},
+                },
+            }
+        }
+        input_data = {"events": [{"type": "a"}, {"type": "b"}, {}], "tags": ["ab", "cd"]}
+        module = load_source(generate_module(dsm_model))
+        self.assertDictEqual(module["detail"](input_data), run_detail(dsm_model, input=input_data))
+
+    def test_missing_input(self):
+        dsm_model = {
+            "type": "dict",
+            "nested": {
+                "name": {"type": "string", "source": {"type": "json_key_item", "source": "other", "dn": "NAME", "default": "x"}},
+            }
+        }
+        module = load_source(generate_module(dsm_model))
+        with self.assertRaises(KeyError) as expected:
+            run_detail(dsm_model, input=INPUT_DATA)
+        with self.assertRaises(KeyError) as generated:
+            module["detail"](INPUT_DATA)
+        self.assertEqual(generated.exception.args, expected.exception.args)
+        self.assertEqual(module["detail"](INPUT_DATA, other={}), run_detail(dsm_model, input=INPUT_DATA, other={}))
+
+    def test_cached_next_to_model(self):
+        with tempfile.TemporaryDirectory() as directory:
+            model_path = os.path.join(directory, "sm_model.json")
+            with open(model_path, "w") as f:
+                json.dump(DSM_MODEL, f)
+
+            path = compile_model_file(model_path)
+            self.assertEqual(os.path.dirname(path), directory)
+            self.assertEqual(compile_model_file(model_path), path)
+            self.assertNotEqual(compile_model_file(model_path, roles=["admin"]), path)
+
+            module = load_model_module(model_path)
+            self.assertDictEqual(module.detail(INPUT_DATA), run_detail(DSM_MODEL, input=INPUT_DATA))
+
+            with open(model_path, "w") as f:
+                json.dump({"type": "dict", "nested": {}}, f)
+            self.assertNotEqual(compile_model_file(model_path), path)
+
+
+if __name__ == "__main__":
+    unittest.main()
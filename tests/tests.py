@@ -1,11 +1,25 @@
 import os
+import re
 import sys
+import json
+import datetime
+import tempfile
 import unittest
+import threading
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
 
 from semantic_model import run_detail, run_list, InvalidModel, get_by_dn, yield_by_dn
 from semantic_model import run_nodes, iter_by_key
+from semantic_model import prepare_model_for_run, Plan, compile_dn
+from semantic_model import cached_plan, clear_plan_cache, PLAN_CACHE, PLAN_CACHE_SIZE
+from semantic_model import Runner, run_detail_many, run_list_many
+from semantic_model import load_model_file, clear_model_cache, MODEL_CACHE, MODEL_CACHE_SIZE, run_detail_json
+from semantic_model import POSTFORMAT, POSTFORMAT_BATCH, POSTFORMAT_CHUNK_SIZE, register_postformat
+from semantic_model import regex_to_iso_timestamp, get_datetime_parser
+from semantic_model import PurePostformat, postformat_cache_info, clear_postformat_cache, uuid_namespace
+from semantic_model import stable_id, stable_id_batch, create_uuid5
+from semantic_model import compile_filter, Filter
 
 
 class TestBasics(unittest.TestCase):
@@ -2275,6 +2289,37 @@ class TestBasicsSources(unittest.TestCase):
 
         self.assertEqual(result, expected)
 
+    def test_compiled_dn(self):
+        input_data = {
+            "top": {
+                "lower": [
+                    {"lowest": "find me"},
+                    {"lowest": "find me two"},
+                ]
+            }
+        }
+        dn = compile_dn("top.lower.[1].lowest")
+        self.assertIs(dn, compile_dn("top.lower.[1].lowest"))
+        self.assertEqual(dn, "top.lower.[1].lowest")
+        self.assertEqual(dn.steps, ((False, "top"), (False, "lower"), (True, 1), (False, "lowest")))
+        self.assertEqual(get_by_dn(input_data, dn), (True, "find me two"))
+        self.assertEqual(get_by_dn(input_data, compile_dn("top.lower.[2].lowest")), (False, ""))
+        self.assertEqual(get_by_dn(input_data, compile_dn("")), (False, ""))
+        self.assertEqual(list(yield_by_dn(input_data, compile_dn("top.lower"))), input_data["top"]["lower"])
+
+    def test_compiled_dn_errors(self):
+        # the compiled dn doesn't show in the errors of the sources
+        dsm_model = {"type": "string", "source": {"type": "json_key_item", "source": "input", "dn": "name"}}
+        for input_data in [["Bob"], "Bob"]:
+            try:
+                input_data["name"]
+            except TypeError as e:
+                expected = str(e)
+            with self.assertRaises(TypeError) as context:
+                run_detail(dsm_model, input=input_data)
+            self.assertEqual(str(context.exception), expected)
+            self.assertIsNone(context.exception.__context__)
+
 
 class TestBasicsListItem(unittest.TestCase):
 
@@ -2705,5 +2750,502 @@ class TestBasicSource(unittest.TestCase):
             print(_)
 
 
+class TestPrepareModel(unittest.TestCase):
+
+    dsm_model = {
+        "type": "dict",
+        "nested": {
+            "people": {
+                "type": "list",
+                "rbac": {"user": {"read": True}, "admin": {"read": True}},
+                "source": {"type": "dn_lookup_loop", "source": "input", "dn": "people"},
+                "nested": {
+                    "name": {
+                        "type": "string",
+                        "rbac": {"user": {"read": True}, "admin": {"read": True}},
+                        "source": {"type": "json_key_item", "dn": "name"},
+                    },
+                    "secret": {
+                        "type": "string",
+                        "rbac": {"admin": {"read": True}},
+                        "source": {"type": "json_key_item", "dn": "secret"},
+                    },
+                },
+            },
+        },
+    }
+
+    def test_plan_reused_over_inputs(self):
+        plan = prepare_model_for_run(self.dsm_model)
+        self.assertIsInstance(plan, Plan)
+
+        for name in ["Bob", "Alice"]:
+            input_data = {"people": [{"name": name, "secret": "x"}]}
+            result = run_detail(plan, input=input_data)
+            self.assertDictEqual(result, {"people": [{"name": name, "secret": "x"}]})
+
+    def test_plan_with_roles(self):
+        plan = prepare_model_for_run(self.dsm_model, roles=["user"])
+        input_data = {"people": [{"name": "Bob", "secret": "x"}]}
+
+        self.assertDictEqual(run_detail(plan, input=input_data), {"people": [{"name": "Bob"}]})
+        self.assertDictEqual(run_detail(plan, roles=["admin"], input=input_data), {"people": [{"name": "Bob", "secret": "x"}]})
+
+    def test_plan_list(self):
+        plan = prepare_model_for_run(self.dsm_model)
+        input_data = {"people": [{"name": "Bob", "secret": "x"}]}
+
+        self.assertEqual([i["value"] for i in run_list(plan, input=input_data)], ["Bob", "x"])
+
+    def test_plan_cached_per_roles(self):
+        clear_plan_cache()
+        plan_user = cached_plan(self.dsm_model, roles=["user"])
+        self.assertIs(cached_plan(self.dsm_model, roles=("user",)), plan_user)
+        self.assertIsNot(cached_plan(self.dsm_model, roles=["admin"]), plan_user)
+        self.assertIsNot(cached_plan(self.dsm_model), plan_user)
+
+        input_data = {"people": [{"name": "Bob", "secret": "x"}]}
+        self.assertDictEqual(run_detail(self.dsm_model, roles=["user"], input=input_data), {"people": [{"name": "Bob"}]})
+        self.assertDictEqual(run_detail(self.dsm_model, roles=["admin"], input=input_data), {"people": [{"name": "Bob", "secret": "x"}]})
+
+        clear_plan_cache()
+        self.assertIsNot(cached_plan(self.dsm_model, roles=["user"]), plan_user)
+
+    def test_plan_cache_bounded(self):
+        clear_plan_cache()
+        models = [{"type": "dict", "nested": {}} for _ in range(PLAN_CACHE_SIZE + 10)]
+        for model in models:
+            cached_plan(model)
+        self.assertEqual(len(PLAN_CACHE), PLAN_CACHE_SIZE)
+
+    def test_plan_error_raised_on_run(self):
+        dsm_model = {
+            "type": "dict",
+            "nested": {
+                "options": {
+                    "type": "list",
+                    "source": {"type": "unknown_source", "source": "input", "dn": "items"},
+                    "item": {"type": "string"},
+                }
+            }
+        }
+        plan = prepare_model_for_run(dsm_model)
+        with self.assertRaisesRegex(InvalidModel, r"Missing source function on unknown_source on source with dn \('options',\)"):
+            _ = run_detail(plan, input={"items": []})
+
+    def test_plan_list_nested_with_item(self):
+        dsm_model = {
+            "type": "dict",
+            "nested": {
+                "options": {
+                    "type": "list",
+                    "source": {"type": "dn_lookup_loop", "source": "input", "dn": "items"},
+                    "item": {"type": "string"},
+                    "nested": {"inner": {"type": "dict", "nested": {"name": {"type": "string"}}}},
+                }
+            }
+        }
+        with self.assertRaisesRegex(InvalidModel, r"List with nested and item or items can't be listed, on dn \('options',\)"):
+            _ = list(run_nodes(dsm_model, input={"items": ["a"]}))
+
+
+class TestModelCache(unittest.TestCase):
+
+    def setUp(self):
+        clear_model_cache()
+        self.directory = tempfile.TemporaryDirectory()
+        self.model_path = os.path.join(self.directory.name, "sm_model.json")
+        self.write_model({"name": {"type": "string", "source": {"type": "json_key_item", "source": "input", "dn": "name"}}})
+
+    def tearDown(self):
+        self.directory.cleanup()
+        clear_model_cache()
+
+    def write_model(self, nested, mtime_ns=None):
+        with open(self.model_path, "w") as f:
+            json.dump({"type": "dict", "nested": nested}, f)
+        if mtime_ns is not None:
+            os.utime(self.model_path, ns=(mtime_ns, mtime_ns))
+
+    def input_path(self, input_data):
+        path = os.path.join(self.directory.name, "input.json")
+        with open(path, "w") as f:
+            json.dump(input_data, f)
+        return path
+
+    def test_same_model_object(self):
+        model = load_model_file(self.model_path)
+        self.assertIs(load_model_file(self.model_path), model)
+        self.assertIs(cached_plan(load_model_file(self.model_path)), cached_plan(model))
+
+    def test_reloaded_when_file_changes(self):
+        self.write_model({}, mtime_ns=10 ** 18)
+        model = load_model_file(self.model_path)
+        self.write_model({"other": {"type": "string", "source": {"type": "json_key_item", "source": "input", "dn": "name"}}}, mtime_ns=2 * 10 ** 18)
+        self.assertIsNot(load_model_file(self.model_path), model)
+        self.assertEqual(len(MODEL_CACHE), 1)
+        self.assertEqual(run_detail_json(self.model_path, input=self.input_path({"name": "Bob"})), {"other": "Bob"})
+
+    def test_bounded(self):
+        for i in range(MODEL_CACHE_SIZE + 5):
+            path = os.path.join(self.directory.name, f"sm_model_{i}.json")
+            with open(path, "w") as f:
+                json.dump({"type": "dict", "nested": {}}, f)
+            load_model_file(path)
+        self.assertEqual(len(MODEL_CACHE), MODEL_CACHE_SIZE)
+
+
+class TestRunner(unittest.TestCase):
+
+    dsm_model = {
+        "type": "dict",
+        "nested": {
+            "names": {
+                "type": "list",
+                "source": {"type": "dn_lookup_loop", "source": "input", "dn": "people"},
+                "nested": {
+                    "name": {
+                        "type": "string",
+                        "source": {"type": "json_key_item", "dn": "name"},
+                    },
+                },
+            },
+        },
+    }
+
+    def test_interleaved_list_runs(self):
+        runner = Runner(self.dsm_model)
+        first = runner.list(input={"people": [{"name": "a"}, {"name": "b"}]})
+        second = runner.list(input={"people": [{"name": "c"}, {"name": "d"}]})
+
+        result = [next(first)["value"], next(second)["value"], next(first)["value"], next(second)["value"]]
+        self.assertEqual(result, ["a", "c", "b", "d"])
+
+    def test_threads(self):
+        runner = Runner(self.dsm_model)
+        results = {}
+
+        def run(i):
+            input_data = {"people": [{"name": f"{i}-{j}"} for j in range(200)]}
+            results[i] = runner.detail(input=input_data)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for i in range(8):
+            self.assertEqual(results[i], {"names": [{"name": f"{i}-{j}"} for j in range(200)]})
+
+    def test_detail_many(self):
+        documents = [{"people": [{"name": "a"}]}, {"people": []}, {"people": [{"name": "b"}, {"name": "c"}]}]
+        expected = [{"names": [{"name": "a"}]}, {"names": []}, {"names": [{"name": "b"}, {"name": "c"}]}]
+        self.assertEqual(list(run_detail_many(self.dsm_model, iter(documents))), expected)
+
+    def test_list_many(self):
+        documents = [{"people": [{"name": "a"}]}, {"people": [{"name": "b"}, {"name": "c"}]}]
+        results = [[item["value"] for item in items] for items in run_list_many(self.dsm_model, documents)]
+        self.assertEqual(results, [["a"], ["b", "c"]])
+
+    def test_detail_many_input_name(self):
+        dsm_model = {
+            "type": "dict",
+            "nested": {
+                "name": {"type": "string", "source": {"type": "json_key_item", "source": "event", "dn": "name"}},
+                "host": {"type": "string", "source": {"type": "json_key_item", "source": "config", "dn": "host"}},
+            },
+        }
+        documents = [{"name": "a"}, {"name": "b"}]
+        results = list(run_detail_many(dsm_model, documents, input_name="event", config={"host": "localhost"}))
+        self.assertEqual(results, [{"name": "a", "host": "localhost"}, {"name": "b", "host": "localhost"}])
+
+    def test_detail_many_workers(self):
+        documents = [{"people": [{"name": str(i)}]} for i in range(50)]
+        expected = [{"names": [{"name": str(i)}]} for i in range(50)]
+
+        results = list(run_detail_many(self.dsm_model, documents, workers=2, chunksize=4))
+        self.assertEqual(results, expected)
+
+        for workers in [None, 2]:
+            results = list(run_detail_many(self.dsm_model, documents, workers=workers, chunksize=4, ordered=False))
+            self.assertEqual(sorted(index for index, _ in results), list(range(50)))
+            for index, result in results:
+                self.assertEqual(result, expected[index])
+
+    def test_detail_many_workers_reads_ahead(self):
+        read = []
+
+        def documents():
+            for i in range(200):
+                read.append(i)
+                yield {"people": [{"name": str(i)}]}
+
+        for ordered in [True, False]:
+            read.clear()
+            results = run_detail_many(self.dsm_model, documents(), workers=2, chunksize=4, ordered=ordered)
+            next(results)
+            # two chunks per worker and the chunk read after the first result
+            self.assertLessEqual(len(read), 2 * 4 * 2 + 4)
+            self.assertEqual(len(list(results)), 199)
+            self.assertEqual(len(read), 200)
+
+    def test_list_many_workers(self):
+        documents = [{"people": [{"name": "a"}]}, {"people": [{"name": "b"}, {"name": "c"}]}]
+        results = [[item["value"] for item in items] for items in run_list_many(self.dsm_model, documents, workers=2)]
+        self.assertEqual(results, [["a"], ["b", "c"]])
+
+    def test_inputs_not_shared_between_runs(self):
+        dsm_model = {
+            "type": "dict",
+            "nested": {
+                "name": {"type": "string", "source": {"type": "json_key_item", "source": "other", "dn": "name", "default": None}},
+            },
+        }
+        _ = run_detail(dsm_model, other={"name": "Bob"})
+        with self.assertRaises(KeyError):
+            run_detail(dsm_model, input={})
+
+
+class TestPostformatBatch(unittest.TestCase):
+
+    dsm_model = {
+        "type": "list",
+        "source": {"type": "dn_lookup_loop", "source": "input", "dn": "names", "postformat": {"type": "test_upper"}},
+        "item": {"type": "string"},
+    }
+
+    def setUp(self):
+        clear_plan_cache()
+
+    def tearDown(self):
+        clear_plan_cache()
+        func = POSTFORMAT.pop("test_upper", None)
+        POSTFORMAT_BATCH.pop(func, None)
+
+    def test_called_per_chunk(self):
+        calls = []
+
+        def upper_batch(items, **kwargs):
+            calls.append(len(items))
+            return [item.upper() for item in items]
+
+        register_postformat("test_upper", lambda item, **kwargs: item.upper(), batch=upper_batch)
+        names = [str(i) + "a" for i in range(POSTFORMAT_CHUNK_SIZE + 1)]
+        self.assertEqual(run_detail(self.dsm_model, input={"names": names}), [name.upper() for name in names])
+        self.assertEqual(calls, [POSTFORMAT_CHUNK_SIZE, 1])
+
+    def test_per_item_without_batch(self):
+        POSTFORMAT["test_upper"] = lambda item, **kwargs: item.upper()
+        self.assertEqual(run_detail(self.dsm_model, input={"names": ["a", "b"]}), ["A", "B"])
+
+    def test_failing_batch_per_item(self):
+        def upper_batch(items, **kwargs):
+            raise ValueError("no batch")
+
+        register_postformat("test_upper", lambda item, **kwargs: item.upper(), batch=upper_batch)
+        self.assertEqual(run_detail(self.dsm_model, input={"names": ["a", "b"]}), ["A", "B"])
+        with self.assertRaisesRegex(InvalidModel, "has no attribute 'upper'"):
+            run_detail(self.dsm_model, input={"names": ["a", 1]})
+
+    def test_builtin_batches(self):
+        dsm_model = {
+            "type": "list",
+            "source": {"type": "dn_lookup_loop", "source": "input", "dn": "values", "postformat": {"type": "regex_search", "regex": "[0-9]+", "default": "-"}},
+            "item": {"type": "string"},
+        }
+        self.assertEqual(run_detail(dsm_model, input={"values": ["a12", "b", "3c"]}), ["12", "-", "3"])
+
+        dsm_model = {**dsm_model, "source": {**dsm_model["source"], "postformat": {"type": "int_to_iso_timestamp", "fail-silent": True}}}
+        expected = [run_detail(dsm_model, input={"values": [value]})[0] for value in [1585234800000, "x"]]
+        self.assertEqual(run_detail(dsm_model, input={"values": [1585234800000, "x"]}), expected)
+        self.assertEqual(expected[1], "x")
+
+
+class TestDatetimeParser(unittest.TestCase):
+
+    def test_same_as_strptime(self):
+        formats = ["%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%d/%m/%Y %H:%M", "%Y%m%d%H%M%S", "%b %d %Y %%", "%f%S"]
+        values = [
+            "2020-03-26T15:00:07", "2020-3-26T15:00:07", "2020-03-26 15:00:07.5", "2020-03-26 15:00:07.123456",
+            "26/03/2020 15:00", "26/03/2020  15:00", "20200326150007", "2020032615007", "Mar 26 2020 %",
+            "2020-02-30T15:00:07", "2020-03-26T24:00:07", "0000-03-26T15:00:07", "12345", "", "x",
+        ]
+        for re_format in formats:
+            for value in values:
+                try:
+                    expected = datetime.datetime.strptime(value, re_format).isoformat()
+                except ValueError as e:
+                    with self.assertRaisesRegex(ValueError, re.escape(str(e))):
+                        regex_to_iso_timestamp(value, format=re_format)
+                else:
+                    self.assertEqual(regex_to_iso_timestamp(value, format=re_format), expected, (re_format, value))
+
+    def test_cached(self):
+        parser = get_datetime_parser("%Y-%m-%d")
+        parser.parse("2020-03-26")
+        self.assertEqual(parser.cache["2020-03-26"], "2020-03-26T00:00:00")
+
+    def test_epoch(self):
+        expected = datetime.datetime.fromtimestamp(1585234800).isoformat()
+        self.assertEqual(regex_to_iso_timestamp("1585234800", format="%s"), expected)
+        self.assertEqual(regex_to_iso_timestamp(1585234800, format="%s"), expected)
+
+
+class TestPurePostformat(unittest.TestCase):
+
+    dsm_model = {
+        "type": "list",
+        "source": {"type": "dn_lookup_loop", "source": "input", "dn": "values", "postformat": {"type": "test_pure", "suffix": "!"}},
+        "item": {"type": "string"},
+    }
+
+    def setUp(self):
+        self.calls = []
+
+        def add_suffix(item, **kwargs):
+            self.calls.append(item)
+            return f"{item}{kwargs['suffix']}"
+
+        register_postformat("test_pure", add_suffix, pure=True)
+        clear_plan_cache()
+
+    def tearDown(self):
+        clear_plan_cache()
+        func = POSTFORMAT.pop("test_pure")
+        POSTFORMAT_BATCH.pop(func, None)
+
+    def test_cached(self):
+        values = ["a", "b", "a", 1, True, "a"]
+        self.assertEqual(run_detail(self.dsm_model, input={"values": values}), ["a!", "b!", "a!", "1!", "True!", "a!"])
+        self.assertEqual(self.calls, ["a", "b", 1, True])
+        self.assertEqual(postformat_cache_info()["test_pure"]["hits"], 2)
+        self.assertEqual(postformat_cache_info()["test_pure"]["misses"], 4)
+
+    def test_unhashable(self):
+        func = POSTFORMAT["test_pure"]
+        self.assertEqual(func(["a"], suffix="!"), "['a']!")
+        self.assertEqual(func.cache_info()["uncached"], 1)
+        self.assertEqual(func("a", suffix="!", other=[]), "a!")
+        self.assertEqual(func.cache_info()["uncached"], 2)
+        func.cache_clear()
+        self.assertEqual(func.cache_info()["uncached"], 0)
+
+        with self.assertRaises(TypeError):
+            PurePostformat(lambda item: item + 1)("a")
+
+    def test_batch_distinct(self):
+        batches = []
+
+        def add_suffix_batch(items, **kwargs):
+            batches.append(items)
+            return [f"{item}{kwargs['suffix']}" for item in items]
+
+        register_postformat("test_pure", lambda item, **kwargs: f"{item}{kwargs['suffix']}", batch=add_suffix_batch, pure=True)
+        clear_plan_cache()
+        self.assertEqual(run_detail(self.dsm_model, input={"values": ["a", "b", "a"]}), ["a!", "b!", "a!"])
+        self.assertEqual(batches, [["a", "b"]])
+        info = POSTFORMAT["test_pure"].cache_info()
+        self.assertEqual((info["hits"], info["misses"], info["uncached"]), (1, 2, 0))
+
+    def test_builtin(self):
+        self.assertIsInstance(POSTFORMAT["hash_uuid"], PurePostformat)
+        self.assertIs(uuid_namespace("domain"), uuid_namespace("domain"))
+        clear_postformat_cache()
+        self.assertEqual(POSTFORMAT["int_to_iso_timestamp"].cache_info()["size"], 0)
+
+
+class TestStableId(unittest.TestCase):
+
+    def test_same_as_hash_uuid(self):
+        for namespace in ["", "events", "x" * 16]:
+            for value in ["a", "ünïcode", "event-1"]:
+                self.assertEqual(stable_id(value, namespace=namespace), create_uuid5(namespace, value))
+
+    def test_batch(self):
+        values = [f"event-{i}" for i in range(10)] + [1]
+        self.assertEqual(stable_id_batch(values, namespace="events"), [stable_id(value, namespace="events") for value in values])
+
+        ids = stable_id_batch(values, namespace="events", hash="fast")
+        self.assertEqual(ids, stable_id_batch(values, namespace="events", hash="fast"))
+        self.assertEqual(len(set(ids)), len(values))
+        self.assertEqual(len(ids[0]), 16)
+        self.assertNotEqual(ids, stable_id_batch(values, namespace="other", hash="fast"))
+
+    def test_run(self):
+        dsm_model = {
+            "type": "list",
+            "source": {"type": "dn_lookup_loop", "source": "input", "dn": "ids", "postformat": {"type": "stable_id", "namespace": "events"}},
+            "item": {"type": "string"},
+        }
+        self.assertEqual(run_detail(dsm_model, input={"ids": ["a", "b"]}), [create_uuid5("events", "a"), create_uuid5("events", "b")])
+
+        dsm_model = {**dsm_model, "source": {**dsm_model["source"], "postformat": {"type": "stable_id", "hash": "md5"}}}
+        with self.assertRaisesRegex(InvalidModel, "Hash md5 not part of"):
+            run_detail(dsm_model, input={"ids": ["a"]})
+
+
+class TestFilter(unittest.TestCase):
+
+    items = [
+        {"id": 1, "status": "done", "tags": {"a": 1}},
+        {"id": 2, "status": "open", "tags": {}},
+        {"id": 3, "tags": {"b": 2}},
+        {"id": 4, "status": "done", "tags": {}},
+    ]
+
+    def setUp(self):
+        clear_plan_cache()
+
+    def kept(self, expression):
+        reject = compile_filter(expression)
+        return [item["id"] for item in self.items if not reject(item)]
+
+    def test_expressions(self):
+        self.assertEqual(self.kept({"type": "eq", "dn": "status", "value": "done"}), [2, 3])
+        self.assertEqual(self.kept({"type": "ne", "dn": "status", "value": "done"}), [1, 3, 4])
+        self.assertEqual(self.kept({"type": "gt", "dn": "id", "value": 2}), [1, 2])
+        self.assertEqual(self.kept({"type": "in", "dn": "status", "values": ["open", "closed"]}), [1, 3, 4])
+        self.assertEqual(self.kept({"type": "not_in", "dn": "status", "values": ["open"]}), [2, 3])
+        self.assertEqual(self.kept({"type": "in", "dn": "tags", "values": [{}]}), [1, 3])
+        self.assertEqual(self.kept({"type": "dict_key_is_empty", "key": "tags"}), [1, 3])
+        self.assertEqual(self.kept({"and": [{"type": "eq", "dn": "status", "value": "done"}, {"type": "dict_key_is_empty", "key": "tags"}]}), [1, 2, 3])
+        self.assertEqual(self.kept({"or": [{"type": "eq", "dn": "id", "value": 1}, {"type": "eq", "dn": "id", "value": 3}]}), [2, 4])
+        self.assertEqual(self.kept({"not": {"type": "eq", "dn": "status", "value": "done"}}), [1, 4])
+        self.assertEqual(self.kept({"type": "eq", "dn": "tags.a", "value": 1}), [2, 3, 4])
+
+    def test_repr(self):
+        reject = compile_filter({"not": {"type": "in", "dn": "status", "values": ["done"]}})
+        self.assertIsInstance(eval(repr(reject)), Filter)
+        self.assertEqual(eval(repr(reject)).expression, reject.expression)
+
+    def test_invalid(self):
+        for expression in [{"type": "missing"}, [], {"type": "eq", "dn": "a..b"}]:
+            with self.assertRaises(ValueError):
+                compile_filter(expression)
+
+        dsm_model = {"type": "list", "source": {"type": "dn_lookup_loop", "source": "input", "dn": "items", "filter": {"type": "missing"}}, "item": {"type": "object"}}
+        with self.assertRaisesRegex(InvalidModel, "Invalid filter"):
+            run_detail(dsm_model, input={"items": self.items})
+
+    def test_run(self):
+        source = {"type": "dn_lookup_loop", "source": "input", "dn": "items", "filter": {"type": "ne", "dn": "status", "value": "done"}}
+        dsm_model = {"type": "list", "source": source, "nested": {"id": {"type": "integer", "source": {"type": "json_key_item", "dn": "id"}}}}
+        self.assertEqual(run_detail(dsm_model, input={"items": self.items}), [{"id": 1}, {"id": 3}, {"id": 4}])
+
+        # a filter_type is combined with the filter, items are left out when either is true
+        source = {**source, "filter_type": "dict_key_is_empty", "filter_args": {"key": "tags"}}
+        dsm_model = {**dsm_model, "source": source}
+        self.assertEqual(run_detail(dsm_model, input={"items": self.items}), [{"id": 1}, {"id": 3}])
+
+    def test_run_without_pushdown(self):
+        dsm_model = {
+            "type": "list",
+            "source": {"type": "json_key", "source": "input", "dn": "items", "multi": True, "filter": {"type": "contains", "arg": "b"}},
+            "item": {"type": "string"},
+        }
+        self.assertEqual(run_detail(dsm_model, input={"items": ["ab", "cd", "b"]}), ["cd"])
+
+
 if __name__ == "__main__":
     unittest.main()